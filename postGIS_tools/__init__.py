@@ -13,7 +13,11 @@ All functions in the sub-modules are available with the following import:
 """
 from postGIS_tools.functions import *
 from postGIS_tools.configurations import *
+from postGIS_tools.catalog import get_catalog, invalidate_catalog
+from postGIS_tools.connections import get_connection, get_engine, configure_connection_pool, close_all_connections
+from postGIS_tools.export_engine import postgis_to_file
+from postGIS_tools.hexgrid import make_hex_grid, bin_points_to_hexagons, hex_grid_origin
 from postGIS_tools.routines.copy_tables import *
-from postGIS_tools.logs import log_activity
+from postGIS_tools.logs import log_activity, flush_logs, set_log_mode
 
 # CONFIG, SUPERUSER_CONFIG = get_postGIS_config()
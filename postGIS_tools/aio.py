@@ -0,0 +1,858 @@
+"""
+Overview of ``aio.py``
+----------------------
+
+Awaitable versions of the core ``postGIS_tools`` functions, for code that runs on ``asyncio``.
+
+Queries go through ``asyncpg`` and a pool of connections per URI (and per event loop),
+so hundreds of concurrent catalog lookups and small queries can share a few connections
+without any threads. The CPU-heavy steps (encoding rows for ``COPY``, decoding geometries,
+sniffing CSV files and writing shapefiles) are handed to the loop's default executor
+so they don't stall the other tasks on the loop.
+
+Tables are written with the same DDL, ``COPY`` encoding and column clean-up as the
+synchronous functions, so the results are interchangeable.
+
+``asyncpg`` is an optional dependency: ``pip install asyncpg``.
+
+Examples
+--------
+
+    >>> import asyncio
+    >>> from postGIS_tools import aio
+    >>> async def count_rows(uri):
+    ...     tables = await aio.get_list_of_tables_in_db(uri)
+    ...     counts = await asyncio.gather(*[aio.fetch_things_from_database(f"SELECT count(*) FROM {t}", uri)
+    ...                                    for t in tables])
+    ...     return dict(zip(tables, [c[0][0] for c in counts]))
+    >>> asyncio.run(count_rows(uri))
+    {'bike_lanes': 1204, 'parcels': 310227}
+
+    >>> async def read_in_chunks(uri):
+    ...     async for gdf in await aio.query_geo_table("SELECT * FROM parcels", uri, chunksize=50000):
+    ...         print(len(gdf))
+
+"""
+import asyncio
+import json
+import os
+import re
+import time
+import weakref
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Union, AsyncIterator
+
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+from postGIS_tools import logs
+from postGIS_tools.catalog import CATALOG_QUERY, cached_catalog, store_catalog, invalidate_catalog, CatalogSnapshot
+from postGIS_tools.connections import POOL_MAX_IDLE_SECONDS
+from postGIS_tools.copy_engine import DEFAULT_CHUNKSIZE, CSV_SAMPLE_BYTES, quote_identifier, \
+    prepare_frame_for_copy, create_table_statements, iterate_chunks, iterate_encoded_chunks, \
+    geometry_to_ewkb, geometry_sql_type, sniff_csv, open_csv_file, csv_table_statements, table_column_types_sql, \
+    match_table_column_types
+from postGIS_tools.functions import _prepare_geodataframe
+from postGIS_tools.queries.spatial_table import sql_to_finalize_spatial_table
+from postGIS_tools.logs import log_activity
+
+# Pool defaults, which can be changed with ``configure_pool()``
+AIO_POOL_MIN_SIZE = 1
+AIO_POOL_MAX_SIZE = 10
+
+_POOL_SETTINGS = {"min_size": AIO_POOL_MIN_SIZE,
+                  "max_size": AIO_POOL_MAX_SIZE}
+
+# asyncpg pools belong to the loop that made them, so everything is cached per loop
+_POOLS = weakref.WeakKeyDictionary()  # loop -> {uri: asyncio.Task that resolves to an asyncpg.Pool}
+_CATALOG_LOADS = weakref.WeakKeyDictionary()  # loop -> {uri: asyncio.Task that resolves to a CatalogSnapshot}
+
+
+################################################################################
+# CONNECTIONS
+################################################################################
+
+
+def _asyncpg_dsn(uri: str) -> str:
+    """ asyncpg doesn't understand SQLAlchemy-style driver names like 'postgresql+psycopg2://' """
+    return re.sub(r"^postgres(ql)?\+\w+://", "postgresql://", uri)
+
+
+async def _init_connection(connection):
+    """ Send and receive PostGIS geometries as raw EWKB bytes, instead of hex-encoded text """
+    try:
+        await connection.set_type_codec("geometry", schema="public", encoder=bytes, decoder=bytes, format="binary")
+    except ValueError:
+        # PostGIS isn't installed in this database
+        pass
+
+
+def configure_pool(
+        min_size: int = AIO_POOL_MIN_SIZE,
+        max_size: int = AIO_POOL_MAX_SIZE
+):
+    """
+    Change the settings used for async connection pools made from now on.
+    Call ``close_pools()`` first to rebuild pools that already exist.
+
+    :param min_size: number of connections to keep open per URI
+    :param max_size: maximum number of open connections per URI
+    :return: None
+    """
+    _POOL_SETTINGS.update({"min_size": min_size, "max_size": max_size})
+
+
+async def get_pool(uri: str):
+    """
+    Get the ``asyncpg`` pool for a URI on the running event loop, creating it on first use.
+    Tasks that ask for the same pool while it's being created all wait for the same one.
+
+    :param uri: connection string
+    :return: ``asyncpg.Pool``
+    """
+    if asyncpg is None:
+        raise ImportError("postGIS_tools.aio needs asyncpg. Install it with 'pip install asyncpg'")
+
+    loop = asyncio.get_running_loop()
+    pools = _POOLS.setdefault(loop, {})
+
+    if uri not in pools:
+        # create_pool() returns an awaitable Pool rather than a coroutine, so wrap it to run it as a task
+        async def create_pool():
+            return await asyncpg.create_pool(_asyncpg_dsn(uri),
+                                             init=_init_connection,
+                                             max_inactive_connection_lifetime=POOL_MAX_IDLE_SECONDS,
+                                             **_POOL_SETTINGS)
+
+        pools[uri] = loop.create_task(create_pool())
+
+    try:
+        return await asyncio.shield(pools[uri])
+
+    except Exception:
+        # Don't cache a pool that couldn't connect
+        pools.pop(uri, None)
+        raise
+
+
+@asynccontextmanager
+async def get_connection(uri: str):
+    """
+    Borrow an ``asyncpg`` connection from the pool for this URI.
+
+    :param uri: connection string
+    :return: ``asyncpg.Connection``
+    """
+    pool = await get_pool(uri)
+
+    async with pool.acquire() as connection:
+        yield connection
+
+
+async def close_pools(uri: str = None):
+    """
+    Close the async pools on the running event loop.
+
+    :param uri: only close the pool for this URI. If ``None``, close them all.
+    :return: None
+    """
+    pools = _POOLS.get(asyncio.get_running_loop(), {})
+    uris = [uri] if uri else list(pools)
+
+    for this_uri in uris:
+        if this_uri in pools:
+            pool = await pools.pop(this_uri)
+            await pool.close()
+
+
+async def _run_in_executor(function, *args, **kwargs):
+    """ Run a blocking function on the loop's default executor """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(function, *args, **kwargs))
+
+
+async def _log_activity(function_name: str, uri: str, query_text: str = "", debug: bool = False):
+    """ Queued logging is non-blocking. Synchronous logging writes to the database, so keep it off the loop. """
+    if logs.LOG_MODE == "sync":
+        await _run_in_executor(log_activity, function_name, uri=uri, query_text=query_text, debug=debug)
+    else:
+        log_activity(function_name, uri=uri, query_text=query_text, debug=debug)
+
+
+################################################################################
+# GET THINGS FROM THE DATABASE
+################################################################################
+
+
+async def fetch_things_from_database(
+        query: str,
+        uri: str,
+        debug: bool = False
+) -> list:
+    """
+    Send a query to the database and return every row.
+
+    :param query: your query as ``str``, e.g. ``SELECT * FROM my_table``
+    :param uri: connection string
+    :return: list of row tuples, like ``cursor.fetchall()``
+    """
+
+    if debug:
+        print('-' * 40)
+        print(f'## Fetching ALL from {uri}')
+        print(query)
+
+    async with get_connection(uri) as connection:
+        rows = await connection.fetch(query)
+
+    return [tuple(row) for row in rows]
+
+
+async def get_catalog(
+        uri: str,
+        max_age: float = None,
+        debug: bool = False
+) -> CatalogSnapshot:
+    """
+    Get the catalog snapshot for a database, loading it if there isn't a fresh one.
+    The snapshot cache is shared with ``postGIS_tools.catalog.get_catalog()``,
+    and concurrent lookups for the same URI wait on a single load.
+
+    :param uri: connection string
+    :param max_age: seconds before a cached snapshot is reloaded. Defaults to ``CATALOG_TTL_SECONDS``
+    :return: ``CatalogSnapshot``
+    """
+    catalog = cached_catalog(uri, max_age=max_age)
+    if catalog is not None:
+        return catalog
+
+    loop = asyncio.get_running_loop()
+    loads = _CATALOG_LOADS.setdefault(loop, {})
+
+    if uri not in loads:
+        if debug:
+            print(f'## Loading catalog snapshot for {uri}')
+
+        async def load() -> CatalogSnapshot:
+            try:
+                async with get_connection(uri) as connection:
+                    raw = await connection.fetchval(CATALOG_QUERY)
+                return store_catalog(uri, json.loads(raw))
+            finally:
+                loads.pop(uri, None)
+
+        loads[uri] = loop.create_task(load())
+
+    return await asyncio.shield(loads[uri])
+
+
+async def get_list_of_tables_in_db(
+        uri: str,
+        debug: bool = False
+) -> list:
+    """
+    Return a list of all tables that exist in a given database.
+
+    :param uri: connection string
+    :return: list of all tables in database
+    """
+    return (await get_catalog(uri, debug=debug)).table_names()
+
+
+async def get_list_of_columns_in_table(
+        table: str,
+        uri: str,
+        debug: bool = False
+) -> list:
+    """
+    Return a list of all columns that exist in a given table
+
+    :param table: 'name_of_the_table'
+    :param uri: connection string
+    :return: list of columns
+    """
+    return (await get_catalog(uri, debug=debug)).column_names(table)
+
+
+async def get_list_of_spatial_tables_in_db(
+        uri: str,
+        debug: bool = False
+) -> list:
+    """
+    Return a list of all spatial tables that exist in a given database.
+
+    :param uri: connection string
+    :return: list of all spatial tables in database
+    """
+    return (await get_catalog(uri, debug=debug)).spatial_tables()
+
+
+def _records_to_frame(
+        rows: list,
+        columns: list,
+        first_row: int = 0
+) -> pd.DataFrame:
+    df = pd.DataFrame.from_records([tuple(row) for row in rows], columns=columns, coerce_float=True)
+    df.index = pd.RangeIndex(first_row, first_row + len(df))
+    return df
+
+
+def _frame_to_geoframe(
+        df: pd.DataFrame,
+        geom_col: str,
+        crs: str = None
+) -> gpd.GeoDataFrame:
+    """ Decode the EWKB geometry column, taking the CRS from the data if one isn't given """
+    geometries = shapely.from_wkb(df[geom_col].to_numpy(dtype=object))
+
+    if crs is None:
+        srids = shapely.get_srid(geometries[pd.notnull(geometries)])
+        if len(srids) and srids[0] != 0:
+            crs = f"epsg:{srids[0]}"
+
+    df[geom_col] = geometries
+    return gpd.GeoDataFrame(df, geometry=geom_col, crs=crs)
+
+
+async def _query_table_chunks(
+        query: str,
+        uri: str,
+        chunksize: int
+) -> AsyncIterator[pd.DataFrame]:
+    async with get_connection(uri) as connection:
+        # Cursors only live as long as the transaction they're in
+        async with connection.transaction():
+            statement = await connection.prepare(query)
+            columns = [attribute.name for attribute in statement.get_attributes()]
+            cursor = await statement.cursor()
+
+            first_row = 0
+            while True:
+                rows = await cursor.fetch(chunksize)
+                if not rows:
+                    break
+
+                yield _records_to_frame(rows, columns, first_row)
+
+                first_row += len(rows)
+
+
+async def _query_geo_table_chunks(
+        query: str,
+        uri: str,
+        geom_col: str,
+        chunksize: int
+) -> AsyncIterator[gpd.GeoDataFrame]:
+    crs = None
+
+    async for df in _query_table_chunks(query, uri, chunksize):
+        gdf = await _run_in_executor(_frame_to_geoframe, df, geom_col, crs)
+
+        # Take the CRS from the first chunk, the same way GeoDataFrame.from_postgis() does
+        crs = crs or gdf.crs
+        yield gdf
+
+
+async def query_table(
+        query: str,
+        uri: str,
+        debug: bool = False,
+        chunksize: int = None
+) -> Union[pd.DataFrame, AsyncIterator[pd.DataFrame]]:
+    """
+    Query a table in a database and get the result as a ``pandas.DataFrame``
+
+    If ``chunksize`` is provided you get an async iterator of ``DataFrames`` with at most ``chunksize``
+    rows each, read through a server-side cursor. The index keeps counting up across chunks.
+
+    :param query: 'SELECT * FROM my_table'
+    :param uri: connection string
+    :param chunksize: number of rows per chunk, or ``None`` to get everything at once
+    :return: ``pandas.DataFrame``, or an async iterator of them if ``chunksize`` is provided
+    """
+
+    if debug:
+        print('-' * 40)
+        print(f'## QUERYING via asyncpg on {uri}')
+        print(query)
+
+    if chunksize:
+        return _query_table_chunks(query, uri, chunksize)
+
+    async with get_connection(uri) as connection:
+        statement = await connection.prepare(query)
+        rows = await statement.fetch()
+        columns = [attribute.name for attribute in statement.get_attributes()]
+
+    return _records_to_frame(rows, columns)
+
+
+async def query_geo_table(
+        query: str,
+        uri: str,
+        geom_col: str = 'geom',
+        debug: bool = False,
+        chunksize: int = None
+) -> Union[gpd.GeoDataFrame, AsyncIterator[gpd.GeoDataFrame]]:
+    """
+    Query a geo table in a SQL database and get the result as a ``geopandas.GeoDataFrame``
+
+    If ``chunksize`` is provided you get an async iterator of ``GeoDataFrames`` with at most ``chunksize`` rows each.
+
+    :param query: 'SELECT gid, pop2015, geom FROM my_table WHERE pop2015 > 1000'
+    :param uri: connection string
+    :param geom_col: the name of the geometry column. Should either be 'geom' or 'geometry'
+    :param chunksize: number of rows per chunk, or ``None`` to get everything at once
+    :return: ``geopandas.GeoDataFrame``, or an async iterator of them if ``chunksize`` is provided
+    """
+
+    if chunksize:
+        if debug:
+            print('-' * 40)
+            print(f'## QUERYING via asyncpg on {uri}')
+            print(query)
+
+        return _query_geo_table_chunks(query, uri, geom_col, chunksize)
+
+    df = await query_table(query, uri, debug=debug)
+
+    return await _run_in_executor(_frame_to_geoframe, df, geom_col)
+
+
+################################################################################
+# UPDATE THINGS IN THE DATABASE
+################################################################################
+
+
+async def execute_query(
+        query: str,
+        uri: str,
+        debug: bool = False
+):
+    """
+    Execute and commit a SQL command in the database.
+    The query can hold several statements, which run in a single transaction.
+
+    :param query: 'DROP VIEW IF EXISTS my_view;'
+    :param uri: connection string
+    :return: None
+    """
+    start_time = time.time()
+
+    if debug:
+        print(f'## UPDATING via asyncpg on {uri}:')
+        print('\t', query)
+
+    async with get_connection(uri) as connection:
+        await connection.execute(query)
+
+    # The query may have changed what's in the database, so the cached catalog is stale
+    invalidate_catalog(uri)
+
+    if debug:
+        runtime = round(time.time() - start_time, 2)
+        print(f'## -> COMMITTED IN - {runtime} seconds')
+
+    await _log_activity("pGIS.aio.execute_query", uri=uri, query_text=query, debug=debug)
+
+
+async def project_spatial_table(
+        tablename: str,
+        geom_type: str,
+        orig_epsg: int,
+        new_epsg: int,
+        uri: str,
+        debug: bool = False
+):
+    """
+    Alter a table's ``geom`` column to a new EPSG
+
+    :param tablename: name of the table (string)
+    :param geom_type: name of a SQL-valid geometry type (string)
+    :param orig_epsg: the EPSG that the data currently has (integer)
+    :param new_epsg: the EPSG you want the data to be projected into (integer)
+    :param uri: connection string
+    :return: None
+    """
+
+    qry = f'''ALTER TABLE {tablename}
+              ALTER COLUMN geom TYPE geometry({geom_type}, {new_epsg})
+              USING ST_Transform( ST_SetSRID( geom, {orig_epsg} ), {new_epsg} ); '''
+    await execute_query(qry, uri=uri, debug=debug)
+
+
+async def prep_spatial_table(
+        spatial_table_name: str,
+        uri: str,
+        geom_colname: str = "geom",
+        cluster: bool = False,
+        debug: bool = False
+):
+    """
+    Add a ``uid`` primary key and a spatial index on the geometry column, optionally ``CLUSTER``
+    the table on that index, and ``ANALYZE`` it, all in one transaction.
+    See ``postGIS_tools.queries.spatial_table.sql_to_finalize_spatial_table()``.
+
+    :param spatial_table_name: 'name_of_the_table'
+    :param uri: connection string
+    :param geom_colname: name of the geometry column
+    :param cluster: reorder the table on the spatial index
+    :return: None
+    """
+    query = sql_to_finalize_spatial_table(spatial_table_name, geom_colname=geom_colname, cluster=cluster)
+
+    if debug:
+        print(f'## FINALIZING {spatial_table_name} via asyncpg on {uri}:')
+        print('\t', query)
+
+    # SET LOCAL only lasts until the end of an explicit transaction
+    async with get_connection(uri) as connection:
+        async with connection.transaction():
+            await connection.execute(query)
+
+    invalidate_catalog(uri)
+
+    await _log_activity("pGIS.aio.prep_spatial_table", uri=uri, query_text=query, debug=debug)
+
+
+################################################################################
+# INGEST DATA INTO THE DATABASE
+################################################################################
+
+
+async def _encode_in_executor(
+        frames,
+        column_types: list,
+        copy_format: str,
+        row_counter: list
+):
+    """ Encode each chunk on the executor and hand the bytes to ``asyncpg`` as they're ready """
+    encoded_chunks = iterate_encoded_chunks(frames, column_types, copy_format, row_counter)
+
+    while True:
+        data = await _run_in_executor(next, encoded_chunks, None)
+        if data is None:
+            break
+        yield data
+
+
+async def _write_dataframe(
+        frame: pd.DataFrame,
+        table_name: str,
+        uri: str,
+        if_exists: str = "replace",
+        index_label: str = None,
+        sql_types: dict = None,
+        copy_format: str = "binary",
+        chunksize: int = DEFAULT_CHUNKSIZE,
+        debug: bool = False
+) -> int:
+    """ The async counterpart of ``copy_engine.write_dataframe()`` """
+    start_time = time.time()
+
+    if if_exists not in ["replace", "append"]:
+        raise ValueError(f"if_exists must be 'replace' or 'append', not '{if_exists}'")
+    if copy_format not in ["binary", "csv"]:
+        raise ValueError(f"copy_format must be 'binary' or 'csv', not '{copy_format}'")
+
+    frame, column_types, index_columns = prepare_frame_for_copy(frame, index=True, index_label=index_label,
+                                                                sql_types=sql_types)
+
+    row_counter = [0]
+
+    async with get_connection(uri) as connection:
+        async with connection.transaction():
+            if if_exists == "replace":
+                await connection.execute(f"DROP TABLE IF EXISTS {quote_identifier(table_name)};")
+
+            table_exists = await connection.fetchval("SELECT to_regclass($1) IS NOT NULL",
+                                                     quote_identifier(table_name))
+            if not table_exists:
+                for query in create_table_statements(table_name, column_types, index_columns):
+                    await connection.execute(query)
+            else:
+                table_types = await connection.fetch(table_column_types_sql(table_name))
+                column_types = match_table_column_types(column_types, [tuple(row) for row in table_types], table_name)
+
+            await connection.copy_to_table(table_name,
+                                           source=_encode_in_executor(iterate_chunks(frame, chunksize), column_types,
+                                                                      copy_format, row_counter),
+                                           columns=[column for column, _ in column_types],
+                                           format=copy_format)
+
+    invalidate_catalog(uri)
+
+    n_rows = row_counter[0]
+    if debug:
+        runtime = round(time.time() - start_time, 2)
+        rate = int(n_rows / runtime) if runtime else n_rows
+        print(f"## COPY {n_rows} rows into {table_name} in {runtime} seconds ({rate} rows/sec)")
+
+    return n_rows
+
+
+async def dataframe_to_postgis(
+        dataframe: pd.DataFrame,
+        table_name: str,
+        uri: str,
+        copy_format: str = "binary",
+        chunksize: int = DEFAULT_CHUNKSIZE,
+        debug: bool = False
+):
+    """
+    Write a ``pandas.DataFrame`` to a PostgreSQL database with ``COPY``, replacing the table.
+
+    :param dataframe: ``pandas.DataFrame``
+    :param table_name: 'name_of_the_table'
+    :param uri: connection string
+    :param copy_format: ``'binary'`` or ``'csv'``
+    :param chunksize: number of rows encoded and sent at a time
+    :return: None
+    """
+
+    if debug:
+        print(f'## Writing {table_name} from Pandas dataframe to {uri} via asyncpg')
+
+    # FORCE ALL COLUMN NAMES TO LOWER-CASE (pgSQL requirement)
+    dataframe.columns = [x.lower() for x in dataframe.columns]
+
+    await _write_dataframe(dataframe, table_name, uri, copy_format=copy_format, chunksize=chunksize, debug=debug)
+
+    await _log_activity("pGIS.aio.dataframe_to_postgis",
+                        uri=uri,
+                        query_text=f"Wrote pandas.DataFrame to {table_name}",
+                        debug=debug)
+
+
+async def geodataframe_to_postgis(
+        geodataframe: gpd.GeoDataFrame,
+        output_table_name: str,
+        uri: str,
+        src_epsg: Union[bool, int] = None,
+        output_epsg: Union[bool, int] = None,
+        copy_format: str = "binary",
+        chunksize: int = DEFAULT_CHUNKSIZE,
+        if_exists: str = "replace",
+        geom_type: str = None,
+        prep_table: bool = True,
+        debug: bool = False
+):
+    """
+    Write a ``geopandas.GeoDataFrame`` to a PostGIS table with ``COPY``.
+    The columns are cleaned up the same way as ``postGIS_tools.geodataframe_to_postgis()``.
+
+    :param geodataframe: geopandas.GeoDataFrame
+    :param output_table_name: 'name_of_the_output_table'
+    :param uri: connection string
+    :param src_epsg: if not None, will assign the geodataframe this EPSG
+    :param output_epsg: if not None, will reproject data from input EPSG to specified EPSG
+    :param copy_format: ``'binary'`` or ``'csv'``
+    :param chunksize: number of rows sent at a time
+    :param if_exists: ``'replace'`` the table, or ``'append'`` these rows to it.
+                      When appending, no reprojection or prep is done.
+    :param geom_type: geometry type for the ``geom`` column. Inferred from the data if ``None``
+    :param prep_table: add the ``uid`` and spatial index after writing
+    :return: None
+    """
+
+    prepared = _prepare_geodataframe(geodataframe, src_epsg=src_epsg, geom_type=geom_type)
+    if prepared is None:
+        return
+    geom_typ, epsg_code = prepared
+
+    if debug:
+        print(f'## PROCESSING {geom_typ} geodataframe to {output_table_name} via asyncpg')
+
+    # Encode every geometry to EWKB at once and COPY the bytes into a typed geometry column
+    geodataframe['geom'] = await _run_in_executor(geometry_to_ewkb, geodataframe['geometry'].values, epsg_code)
+    geodataframe.drop('geometry', axis=1, inplace=True)
+
+    await _write_dataframe(pd.DataFrame(geodataframe), output_table_name, uri,
+                           if_exists=if_exists, index_label='gid',
+                           sql_types={'geom': geometry_sql_type(geom_typ, epsg_code)},
+                           copy_format=copy_format, chunksize=chunksize, debug=debug)
+
+    await _log_activity("pGIS.aio.geodataframe_to_postgis",
+                        uri=uri,
+                        query_text=f"Wrote geopandas.GeoDataFrame to {output_table_name}",
+                        debug=debug)
+
+    # Appended rows land in a table that has already been set up
+    if if_exists == "append":
+        return
+
+    if output_epsg:
+        await project_spatial_table(output_table_name, geom_typ, epsg_code, output_epsg, uri=uri, debug=debug)
+
+    if prep_table:
+        await prep_spatial_table(output_table_name, uri=uri, debug=debug)
+
+
+async def csv_to_postgis(
+        csv_filepath: str,
+        table_name: str,
+        uri: str,
+        overwrite: bool = False,
+        delimiter: str = ",",
+        infer_types: bool = True,
+        debug: bool = False,
+        encoding: str = None
+):
+    """
+    Stream a ``.CSV`` file (or a ``.gz`` / ``.zip`` of one) into a new table with ``COPY``.
+    The table matches the one made by ``postGIS_tools.csv_to_postgis()``.
+
+    :param csv_filepath: file path to .csv file
+    :param table_name: name of the table to create
+    :param uri: connection string
+    :param overwrite: bool to control whether you want to overwrite the table, should it already exist in the db
+    :param delimiter: column separator
+    :param infer_types: pick column types from a sample of the file instead of using ``TEXT``
+    :param encoding: ``'UTF8'`` or ``'LATIN1'``, instead of guessing from the start of the file
+    :return: number of rows loaded, or ``None`` if the table exists and ``overwrite`` is ``False``
+    """
+    start_time = time.time()
+
+    if table_name in await get_list_of_tables_in_db(uri, debug=debug):
+        if overwrite:
+            print(f'## {table_name} ALREADY EXISTS... DROPPING TABLE CASCADE')
+        else:
+            print(f'## {table_name} ALREADY EXISTS... Will not replace. Aborting.')
+            return None
+
+    csv_info = await _run_in_executor(sniff_csv, csv_filepath, delimiter=delimiter,
+                                      sample_size=CSV_SAMPLE_BYTES, infer_types=infer_types)
+    column_types = csv_info["column_types"]
+
+    if encoding:
+        csv_info["encoding"] = encoding
+
+    if debug:
+        print(f"## Streaming {csv_filepath} into {table_name} as {csv_info['encoding']}")
+
+    pool = await get_pool(uri)
+
+    try:
+        async with pool.acquire() as connection:
+            async with connection.transaction():
+                await connection.execute(f"DROP TABLE IF EXISTS {quote_identifier(table_name)} CASCADE;")
+                for query in csv_table_statements(table_name, column_types):
+                    await connection.execute(query)
+
+                # asyncpg reads the file on the executor, a block at a time
+                with open_csv_file(csv_filepath) as csv_file:
+                    status = await connection.copy_to_table(table_name,
+                                                            source=csv_file,
+                                                            columns=[column for column, _ in column_types],
+                                                            format="csv",
+                                                            header=True,
+                                                            delimiter=delimiter,
+                                                            encoding=csv_info["encoding"])
+
+    except (asyncpg.exceptions.CharacterNotInRepertoireError, asyncpg.exceptions.UntranslatableCharacterError) as error:
+        # The start of the file looked like UTF8, but further in it isn't
+        if csv_info["encoding"] == "LATIN1":
+            raise
+
+        print(f"## -> {error}")
+        print("## -> Retrying as LATIN1")
+
+        return await csv_to_postgis(csv_filepath, table_name, uri, overwrite=True, delimiter=delimiter,
+                                    infer_types=infer_types, debug=debug, encoding="LATIN1")
+
+    except asyncpg.exceptions.DataError as error:
+        if not infer_types:
+            raise
+
+        print(f"## -> {error}")
+        print("## -> Retrying with TEXT columns")
+
+        return await csv_to_postgis(csv_filepath, table_name, uri, overwrite=True, delimiter=delimiter,
+                                    infer_types=False, debug=debug, encoding=csv_info["encoding"])
+
+    invalidate_catalog(uri)
+
+    # The status is 'COPY <number of rows>'
+    n_rows = int(status.split()[-1])
+
+    if debug:
+        runtime = round(time.time() - start_time, 2)
+        rate = int(n_rows / runtime) if runtime else n_rows
+        print(f"## COPY {n_rows} rows into {table_name} in {runtime} seconds ({rate} rows/sec)")
+
+    await _log_activity("pGIS.aio.csv_to_postgis",
+                        uri=uri,
+                        query_text=f"Streamed CSV from {csv_filepath}",
+                        debug=debug)
+
+    return n_rows
+
+
+################################################################################
+# EXPORT DATA FROM THE DATABASE
+################################################################################
+
+
+def _write_shapefile_chunk(
+        gdf: gpd.GeoDataFrame,
+        out_shp: str,
+        append: bool
+):
+    # Convert any boolean column types to strings
+    for c in gdf.columns:
+        if gdf[c].dtype.name == 'bool':
+            gdf[c] = gdf[c].astype(str)
+
+    gdf.to_file(out_shp, mode="a" if append else "w")
+
+
+async def postgis_to_shp(
+        table_name: str,
+        output_folder: str,
+        uri: str,
+        geom_col: str = 'geom',
+        debug: bool = False,
+        chunksize: int = DEFAULT_CHUNKSIZE
+) -> str:
+    """
+    Write a spatial PostGIS table to a shapefile.
+    Rows are read ``chunksize`` at a time and each chunk is written on the executor
+    while the loop carries on with other work.
+
+    :param table_name: 'name_of_the_table'
+    :param output_folder: r'c:\\path\\to\\your\\output\\shapefile\\folder'
+    :param uri: connection string
+    :param geom_col: 'geom' is default spatial column name in postGIS
+    :param chunksize: number of rows to hold in memory at once
+    :return: path to the shapefile
+    """
+
+    print(f'## Creating shapefile from {table_name}')
+
+    out_shp = os.path.join(output_folder, f'{table_name}.shp')
+
+    chunks = await query_geo_table(f'SELECT * FROM {table_name}', uri, geom_col=geom_col,
+                                   chunksize=chunksize, debug=debug)
+
+    chunk_number = 0
+    async for gdf in chunks:
+        await _run_in_executor(_write_shapefile_chunk, gdf, out_shp, append=chunk_number > 0)
+        chunk_number += 1
+
+    await _log_activity("pGIS.aio.postgis_to_shp",
+                        uri=uri,
+                        query_text=f"Saved .SHP from {table_name} to {out_shp}",
+                        debug=debug)
+
+    return out_shp
+
+
+if __name__ == "__main__":
+    pass
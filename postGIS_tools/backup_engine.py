@@ -0,0 +1,780 @@
+"""
+Overview of ``backup_engine.py``
+--------------------------------
+
+Back up databases with ``pg_dump``, run as a managed subprocess.
+
+By default each database is written as a compressed directory-format archive (``pg_dump -Fd``),
+which lets ``pg_dump -j N`` dump several tables at once and ``pg_restore -j N`` load them back
+the same way. Custom-format (``-Fc``) archives and plain ``.sql`` files can be made too.
+
+``back_up_databases()`` dumps many databases concurrently, keeping the total number of
+``pg_dump`` jobs across all of them under a global cap, and records the size and duration
+of every dump in a ``manifest.json`` file in the backup folder.
+
+The manifest also keeps a fingerprint of each database (see ``database_fingerprint()``), so
+incremental runs can skip databases that haven't changed since their last successful backup,
+or dump only the tables that have.
+
+``restore_database()`` loads any of these back: archives with ``pg_restore -j N``, and plain SQL
+files streamed through ``psql`` with ``ON_ERROR_STOP`` set.
+
+A non-zero exit code from ``pg_dump``, ``pg_restore`` or ``psql`` raises ``subprocess.CalledProcessError``
+with whatever the program wrote to stderr, and a failed dump never replaces an earlier one of the same name.
+
+Examples
+--------
+
+    >>> from postGIS_tools.backup_engine import dump_database, back_up_databases, restore_database
+    >>> dump_database("/backups", uri, jobs=4)
+    {'database': 'my_db', 'path': '/backups/my_db_2020_06_01', 'format': 'directory', ...}
+    >>> back_up_databases("/backups", uri, ["my_db", "other_db"], jobs_per_database=2, max_jobs=8)
+    >>> restore_database("/backups/my_db_2020_06_01", new_uri, jobs=8)
+
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Union
+
+import psycopg2.extensions
+
+from postGIS_tools.connections import get_connection
+from postGIS_tools.logs import log_activity
+
+# pg_dump's --format letter and the file extension for each kind of backup
+BACKUP_FORMATS = {
+    "directory": ("d", ""),
+    "custom": ("c", ".dump"),
+    "plain": ("p", ".sql"),
+}
+
+DEFAULT_COMPRESSION = 5
+
+MANIFEST_FILENAME = "manifest.json"
+
+# Plain SQL files are piped into psql in blocks of this many bytes
+RESTORE_BLOCK_BYTES = 1024 * 1024
+
+
+################################################################################
+# RUN THE POSTGRESQL CLIENT PROGRAMS
+################################################################################
+
+
+def pg_program(name: str) -> str:
+    """
+    Find one of the PostgreSQL client programs (``pg_dump``, ``pg_restore``, ``psql``) on the system path.
+
+    :param name: 'pg_dump'
+    :return: full path to the program
+    """
+    path = shutil.which(name)
+    if path is None:
+        raise FileNotFoundError(f"{name} must be installed and on the system path")
+
+    return path
+
+
+def pg_connection_args(uri: str) -> tuple:
+    """
+    Split a URI into a connection string without the password, and an environment that holds it,
+    so the password never shows up in the process list.
+
+    :param uri: connection string
+    :return: tuple of (connection string, environment ``dict``)
+    """
+    values = psycopg2.extensions.parse_dsn(uri)
+
+    env = dict(os.environ)
+    password = values.pop("password", None)
+    if password:
+        env["PGPASSWORD"] = password
+
+    return psycopg2.extensions.make_dsn(**values), env
+
+
+def run_pg_program(
+        args: list,
+        env: dict,
+        debug: bool = False
+) -> subprocess.CompletedProcess:
+    """
+    Run a PostgreSQL client program to completion.
+
+    :param args: the command, e.g. ``['pg_dump', '--format=d', ...]``
+    :param env: environment for the subprocess, from ``pg_connection_args()``
+    :return: ``subprocess.CompletedProcess``
+    :raises subprocess.CalledProcessError: if the program exits with a non-zero code
+    """
+    if debug:
+        print(" ".join(args))
+
+    result = subprocess.run(args, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, args, output=result.stdout, stderr=result.stderr)
+
+    return result
+
+
+def _path_size(path: str) -> int:
+    """ Size of a file, or of every file inside a directory, in bytes """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+
+    return sum(os.path.getsize(os.path.join(folder, f)) for folder, _, files in os.walk(path) for f in files)
+
+
+def _remove_path(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+################################################################################
+# BACK UP ONE DATABASE
+################################################################################
+
+
+def backup_path(
+        backup_folder: str,
+        database: str,
+        dump_format: str = "directory",
+        compression: Union[int, str] = DEFAULT_COMPRESSION,
+        label: str = ""
+) -> str:
+    """
+    Path for today's backup of a database, like '/backups/my_db_2019_02_26.sql'
+
+    :param backup_folder: '/Users/my_name/Desktop/backup_folder'
+    :param database: name of the database
+    :param dump_format: ``'directory'``, ``'custom'`` or ``'plain'``
+    :param compression: compression level. Plain files get a ``.gz`` extension when they're compressed
+    :param label: added after the date, e.g. ``'_tables_093000'``
+    :return: path as ``str``
+    """
+    if dump_format not in BACKUP_FORMATS:
+        raise ValueError(f"dump_format must be one of {list(BACKUP_FORMATS)}, not '{dump_format}'")
+
+    # Get a string for today's date, like '2019_02_26'
+    today = str(datetime.now()).split(' ')[0].replace('-', '_')
+
+    extension = BACKUP_FORMATS[dump_format][1]
+    if dump_format == "plain" and str(compression) not in ["0", "none", "None"]:
+        extension += ".gz"
+
+    return os.path.join(backup_folder, f"{database}_{today}{label}{extension}")
+
+
+def dump_database(
+        backup_folder: str,
+        uri: str,
+        dump_format: str = "directory",
+        jobs: int = 4,
+        compression: Union[int, str] = DEFAULT_COMPRESSION,
+        extra_args: list = None,
+        label: str = "",
+        debug: bool = False
+) -> dict:
+    """
+    Back up one database with ``pg_dump``.
+
+    The dump is written next to its final path and only moved into place once ``pg_dump`` succeeds,
+    so an earlier backup with the same name survives a failed run.
+
+    :param backup_folder: '/Users/my_name/Desktop/backup_folder'
+    :param uri: connection string for the database to back up
+    :param dump_format: ``'directory'`` (the default, needed for parallel jobs), ``'custom'`` or ``'plain'``
+    :param jobs: number of tables to dump at once. Only used for the directory format
+    :param compression: ``pg_dump --compress`` value, e.g. ``5`` or ``'zstd:3'`` (PostgreSQL 16+). ``0`` for none
+    :param extra_args: more arguments to pass to ``pg_dump``, e.g. ``['--table=parcels']``
+    :param label: added to the backup's name after the date
+    :return: dict with the database, path, format, compression, jobs, bytes and seconds
+    :raises subprocess.CalledProcessError: if ``pg_dump`` fails
+    """
+    start_time = time.time()
+
+    connection_string, env = pg_connection_args(uri)
+    database = psycopg2.extensions.parse_dsn(uri)["dbname"]
+
+    os.makedirs(backup_folder, exist_ok=True)
+    path = backup_path(backup_folder, database, dump_format=dump_format, compression=compression, label=label)
+    partial_path = path + ".partial"
+
+    # pg_dump can only run in parallel into a directory
+    if dump_format != "directory":
+        jobs = 1
+
+    args = [pg_program("pg_dump"),
+            f"--dbname={connection_string}",
+            f"--format={BACKUP_FORMATS[dump_format][0]}",
+            f"--compress={compression}",
+            f"--file={partial_path}"]
+
+    if jobs > 1:
+        args.append(f"--jobs={jobs}")
+
+    args += extra_args or []
+
+    if debug:
+        print(f'## Using pg_dump to back up {database} to {path}')
+
+    _remove_path(partial_path)
+
+    try:
+        run_pg_program(args, env, debug=debug)
+    except subprocess.CalledProcessError:
+        _remove_path(partial_path)
+        raise
+
+    _remove_path(path)
+    os.rename(partial_path, path)
+
+    result = {"database": database,
+              "path": path,
+              "format": dump_format,
+              "compression": compression,
+              "jobs": jobs,
+              "bytes": _path_size(path),
+              "seconds": round(time.time() - start_time, 2)}
+
+    if debug:
+        print(f'## -> {round(result["bytes"] / 1024 / 1024, 1)} MB in {result["seconds"]} seconds')
+
+    log_activity('pGIS.dump_database',
+                 uri=uri,
+                 query_text=f"Used pg_dump to create {os.path.basename(path)}",
+                 debug=debug)
+
+    return result
+
+
+################################################################################
+# RESTORE A DATABASE
+################################################################################
+
+
+def detect_dump_format(path: str) -> str:
+    """
+    Work out what kind of backup a file or folder is.
+
+    :param path: path to a backup made by ``pg_dump``
+    :return: ``'directory'``, ``'custom'``, ``'tar'``, ``'plain'`` or ``'plain_gzip'``
+    """
+    if os.path.isdir(path):
+        if not os.path.exists(os.path.join(path, "toc.dat")):
+            raise ValueError(f"{path} is a folder, but not a directory-format backup (there's no toc.dat)")
+        return "directory"
+
+    with open(path, "rb") as f:
+        header = f.read(512)
+
+    if header.startswith(b"PGDMP"):
+        return "custom"
+
+    if header.startswith(b"\x1f\x8b"):
+        return "plain_gzip"
+
+    # tar archives have 'ustar' at byte 257
+    if header[257:262] == b"ustar":
+        return "tar"
+
+    return "plain"
+
+
+def _stream_sql_file(
+        path: str,
+        uri: str,
+        gzipped: bool = False,
+        block_size: int = RESTORE_BLOCK_BYTES,
+        debug: bool = False
+):
+    """
+    Pipe a plain SQL file into ``psql``, stopping at the first error.
+    Progress is printed every 10% of the file when ``debug`` is ``True``.
+    """
+    connection_string, env = pg_connection_args(uri)
+
+    args = [pg_program("psql"), "--no-psqlrc", "--quiet", "--set=ON_ERROR_STOP=1",
+            f"--dbname={connection_string}", "--file=-"]
+
+    if debug:
+        print(" ".join(args))
+
+    total_bytes = os.path.getsize(path)
+    next_report = 0.1
+
+    opener = gzip.open if gzipped else open
+
+    with tempfile.TemporaryFile() as stderr, opener(path, "rb") as sql_file:
+        process = subprocess.Popen(args, env=env, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr)
+
+        try:
+            while True:
+                block = sql_file.read(block_size)
+                if not block:
+                    break
+
+                process.stdin.write(block)
+
+                # Report progress through the file on disk, which for gzipped files is the compressed size
+                progress = (sql_file.fileobj.tell() if gzipped else sql_file.tell()) / max(total_bytes, 1)
+                if debug and progress >= next_report:
+                    print(f'## -> {int(progress * 100)}% of {os.path.basename(path)} sent')
+                    next_report = progress + 0.1
+
+            process.stdin.close()
+
+        except BrokenPipeError:
+            # psql stopped reading, so it has hit an error. Its exit code and message are below.
+            pass
+
+        finally:
+            returncode = process.wait()
+
+        if returncode != 0:
+            stderr.seek(0)
+            raise subprocess.CalledProcessError(returncode, args, stderr=stderr.read().decode("utf-8", "replace"))
+
+
+def restore_database(
+        path: str,
+        uri: str,
+        jobs: int = 4,
+        extra_args: list = None,
+        debug: bool = False
+) -> dict:
+    """
+    Restore a backup made by ``pg_dump`` into an existing database, stopping at the first error.
+
+    Directory, custom and tar archives are restored with ``pg_restore``. Directory and custom ones
+    load ``jobs`` tables at a time, and build the indexes and constraints in parallel once all the data is in.
+    Plain SQL files (gzipped or not) are streamed through ``psql``. ``pg_dump`` writes those with the
+    indexes and constraints at the end, so they're built after the data loads too.
+
+    :param path: path to the backup
+    :param uri: connection string for the database to restore into
+    :param jobs: number of ``pg_restore`` jobs
+    :param extra_args: more arguments to pass to ``pg_restore``, e.g. ``['--no-owner']``
+    :return: dict with the path, format, jobs and seconds
+    :raises subprocess.CalledProcessError: if ``pg_restore`` or ``psql`` fails
+    """
+    start_time = time.time()
+
+    dump_format = detect_dump_format(path)
+
+    if debug:
+        print(f'## Restoring {dump_format} backup {path}')
+
+    if dump_format in ["plain", "plain_gzip"]:
+        jobs = 1
+        _stream_sql_file(path, uri, gzipped=dump_format == "plain_gzip", debug=debug)
+
+    else:
+        # pg_restore can only run in parallel from a file it can seek through
+        if dump_format == "tar":
+            jobs = 1
+
+        connection_string, env = pg_connection_args(uri)
+
+        args = [pg_program("pg_restore"), f"--dbname={connection_string}", "--exit-on-error"]
+        if jobs > 1:
+            args.append(f"--jobs={jobs}")
+        args += extra_args or []
+        args.append(path)
+
+        run_pg_program(args, env, debug=debug)
+
+    result = {"path": path,
+              "format": dump_format,
+              "jobs": jobs,
+              "seconds": round(time.time() - start_time, 2)}
+
+    if debug:
+        print(f'## -> Restored in {result["seconds"]} seconds')
+
+    log_activity('pGIS.restore_database',
+                 uri=uri,
+                 query_text=f"Restored {os.path.basename(path.rstrip(os.sep))}",
+                 debug=debug)
+
+    return result
+
+
+################################################################################
+# FINGERPRINT DATABASES
+################################################################################
+
+# The db_history log table with its key and sequence. Every dump adds a row to it (after the
+# fingerprint has been taken), so it's left out of the fingerprints or nothing would ever be skipped.
+LOG_RELATIONS = ("db_history", "db_history_pkey", "db_history_uid_seq")
+
+_LOG_RELATIONS_SQL = ", ".join(f"'{relation}'" for relation in LOG_RELATIONS)
+
+# Everything that makes up the schema: relations (including indexes and sequences), their columns,
+# view definitions and function bodies. Any DDL changes the hash.
+SCHEMA_FINGERPRINT_QUERY = f"""
+    WITH user_relations AS (
+        SELECT c.oid, c.relkind, c.relname, n.nspname
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname NOT IN ('pg_catalog', 'information_schema')
+          AND n.nspname NOT LIKE 'pg_toast%'
+          AND n.nspname NOT LIKE 'pg_temp%'
+          AND c.relname NOT IN ({_LOG_RELATIONS_SQL})
+    )
+    SELECT md5(coalesce(string_agg(item, ',' ORDER BY item), ''))
+    FROM (
+        SELECT concat_ws(':', r.oid, r.relkind, r.nspname, r.relname) AS item
+        FROM user_relations r
+        UNION ALL
+        SELECT concat_ws(':', a.attrelid, a.attnum, a.attname, a.atttypid, a.atttypmod, a.attnotnull)
+        FROM pg_attribute a
+        JOIN user_relations r ON r.oid = a.attrelid
+        WHERE a.attnum > 0 AND NOT a.attisdropped
+        UNION ALL
+        SELECT concat_ws(':', r.oid, md5(pg_get_viewdef(r.oid)))
+        FROM user_relations r
+        WHERE r.relkind IN ('v', 'm')
+        UNION ALL
+        SELECT concat_ws(':', p.oid, p.proname, md5(p.prosrc))
+        FROM pg_proc p
+        JOIN pg_namespace n ON n.oid = p.pronamespace
+        WHERE n.nspname NOT IN ('pg_catalog', 'information_schema')
+    ) items
+"""
+
+# Cumulative insert/update/delete counters for each table. TRUNCATE, CLUSTER and VACUUM FULL
+# write a new relfilenode, so those count as changes too. The counters start again from zero
+# when the statistics are reset or the server restarts, and could climb back to the values
+# seen last time, so the time of the last reset and of the server start are part of every hash.
+TABLE_COUNTERS_QUERY = f"""
+    SELECT format('%I.%I', s.schemaname, s.relname),
+           md5(concat_ws(':', c.relfilenode, s.n_tup_ins, s.n_tup_upd, s.n_tup_del,
+                         coalesce(d.stats_reset::text, ''), pg_postmaster_start_time()))
+    FROM pg_stat_user_tables s
+    JOIN pg_class c ON c.oid = s.relid
+    CROSS JOIN pg_stat_database d
+    WHERE d.datname = current_database()
+      AND s.relname NOT IN ({_LOG_RELATIONS_SQL})
+"""
+
+
+def _table_checksum_query(table: str) -> str:
+    """ Hash of every row in a table, independent of row order """
+    return f"""
+        SELECT md5(coalesce(string_agg(row_hash, '' ORDER BY row_hash), ''))
+        FROM (SELECT md5(t::text) AS row_hash FROM {table} t) rows"""
+
+
+def database_fingerprint(
+        uri: str,
+        method: str = "counters"
+) -> dict:
+    """
+    Take a fingerprint of a database's schema and the contents of each table, to tell whether
+    anything has changed since it was last backed up.
+
+    With ``method='counters'`` the table fingerprints come from the insert/update/delete
+    counters in ``pg_stat_user_tables``, which is instant. The counters restart after a statistics reset
+    or a server restart, so either one makes every table look changed and the next backup covers them all.
+    The ``db_history`` log table is left out, since every backup writes to it.
+    With ``method='checksum'`` every table is read and hashed, which is exact but costs a full scan.
+
+    :param uri: connection string
+    :param method: ``'counters'`` or ``'checksum'``
+    :return: dict with the ``'schema'`` hash, a ``'tables'`` dict of table -> hash,
+             and a ``'database'`` hash that covers both
+    """
+    if method not in ["counters", "checksum"]:
+        raise ValueError(f"method must be 'counters' or 'checksum', not '{method}'")
+
+    with get_connection(uri) as connection:
+        cursor = connection.cursor()
+
+        cursor.execute(SCHEMA_FINGERPRINT_QUERY)
+        schema_hash = cursor.fetchone()[0]
+
+        cursor.execute(TABLE_COUNTERS_QUERY)
+        tables = dict(cursor.fetchall())
+
+        if method == "checksum":
+            for table in tables:
+                cursor.execute(_table_checksum_query(table))
+                tables[table] = cursor.fetchone()[0]
+
+        cursor.close()
+
+    combined = ",".join([schema_hash] + [f"{table}={tables[table]}" for table in sorted(tables)])
+
+    return {"schema": schema_hash,
+            "tables": tables,
+            "database": hashlib.md5(combined.encode("utf-8")).hexdigest()}
+
+
+def _backup_files_exist(entry: dict) -> bool:
+    """ True if the last full backup in a manifest entry, and every incremental one after it, are still on disk """
+    paths = [entry.get("base")] + [incremental["path"] for incremental in entry.get("incrementals", [])]
+
+    return all(path and os.path.exists(path) for path in paths)
+
+
+def _back_up_one_database(
+        backup_folder: str,
+        uri: str,
+        previous: dict,
+        incremental: str = None,
+        fingerprint_method: str = "counters",
+        debug: bool = False,
+        **dump_kwargs
+) -> dict:
+    """
+    Back up a database in full, or only what's changed since the backup described by ``previous``.
+
+    :return: dict of values to record in the database's manifest entry
+    """
+    if not incremental:
+        result = dump_database(backup_folder, uri, debug=debug, **dump_kwargs)
+        result.update({"status": "ok", "kind": "full", "base": result["path"], "incrementals": []})
+        return result
+
+    # Take the fingerprint before dumping, so changes made during the dump are picked up next time
+    fingerprint = database_fingerprint(uri, method=fingerprint_method)
+    history_is_usable = _backup_files_exist(previous) and previous.get("fingerprint_method") == fingerprint_method
+
+    fingerprints = {"fingerprint": fingerprint["database"],
+                    "schema_fingerprint": fingerprint["schema"],
+                    "table_fingerprints": fingerprint["tables"],
+                    "fingerprint_method": fingerprint_method}
+
+    if history_is_usable and previous.get("fingerprint") == fingerprint["database"]:
+        if debug:
+            print(f'## -> {previous.get("database")} is unchanged since {previous.get("finished")}, skipping it')
+        return {"status": "skipped"}
+
+    changed_tables = [table for table, table_hash in fingerprint["tables"].items()
+                      if previous.get("table_fingerprints", {}).get(table) != table_hash]
+
+    # Only the data in tables can be backed up on its own. Schema changes need a full dump.
+    if (incremental == "table" and history_is_usable and changed_tables
+            and previous.get("schema_fingerprint") == fingerprint["schema"]):
+
+        label = "_tables_" + datetime.now().strftime("%H%M%S")
+        extra_args = ["--data-only"] + [f"--table={table}" for table in changed_tables]
+
+        result = dump_database(backup_folder, uri, extra_args=extra_args, label=label, debug=debug, **dump_kwargs)
+        result.update({"status": "ok", "kind": "tables", "base": previous["base"],
+                       "incrementals": previous.get("incrementals", []) + [{"path": result["path"],
+                                                                            "tables": changed_tables}]})
+        result.update(fingerprints)
+        return result
+
+    result = dump_database(backup_folder, uri, debug=debug, **dump_kwargs)
+    result.update({"status": "ok", "kind": "full", "base": result["path"], "incrementals": []})
+    result.update(fingerprints)
+    return result
+
+
+################################################################################
+# BACK UP MANY DATABASES
+################################################################################
+
+
+def read_manifest(backup_folder: str) -> dict:
+    """
+    Read the ``manifest.json`` in a backup folder.
+
+    :param backup_folder: '/Users/my_name/Desktop/backup_folder'
+    :return: dict with a ``'databases'`` entry keyed on database name. Empty if there's no manifest yet
+    """
+    manifest_file = os.path.join(backup_folder, MANIFEST_FILENAME)
+
+    if not os.path.exists(manifest_file):
+        return {"databases": {}}
+
+    with open(manifest_file) as f:
+        manifest = json.load(f)
+
+    manifest.setdefault("databases", {})
+
+    return manifest
+
+
+def write_manifest(
+        backup_folder: str,
+        manifest: dict
+) -> str:
+    """
+    Save the ``manifest.json`` in a backup folder, replacing the old one in a single step.
+
+    :param backup_folder: '/Users/my_name/Desktop/backup_folder'
+    :param manifest: dict from ``read_manifest()``
+    :return: path to the manifest
+    """
+    manifest_file = os.path.join(backup_folder, MANIFEST_FILENAME)
+
+    with open(manifest_file + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, default=str)
+
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+    return manifest_file
+
+
+def _database_uri(
+        uri: str,
+        database: str
+) -> str:
+    """ Point a connection string at another database on the same cluster """
+    values = psycopg2.extensions.parse_dsn(uri)
+    values["dbname"] = database
+
+    return psycopg2.extensions.make_dsn(**values)
+
+
+def _database_sizes(
+        uri: str,
+        databases: list
+) -> dict:
+    """ Size of each database in bytes, to start the biggest dumps first """
+    with get_connection(uri) as connection:
+        cursor = connection.cursor()
+        cursor.execute("SELECT datname, pg_database_size(datname) FROM pg_database WHERE datname = ANY(%s)",
+                       (list(databases), ))
+        sizes = dict(cursor.fetchall())
+        cursor.close()
+
+    return sizes
+
+
+def back_up_databases(
+        backup_folder: str,
+        uri: str,
+        databases: list,
+        dump_format: str = "directory",
+        jobs_per_database: int = 2,
+        max_jobs: int = 8,
+        compression: Union[int, str] = DEFAULT_COMPRESSION,
+        incremental: str = None,
+        fingerprint_method: str = "counters",
+        raise_errors: bool = False,
+        debug: bool = False
+) -> dict:
+    """
+    Back up many databases on one cluster at once, and record each dump in ``manifest.json``.
+
+    Each database is dumped with ``jobs_per_database`` parallel ``pg_dump`` jobs, and enough
+    databases are dumped at the same time to use up to ``max_jobs`` jobs in total.
+    The biggest databases start first so a large one doesn't end up running alone at the end.
+
+    With ``incremental='database'``, a database whose fingerprint (see ``database_fingerprint()``)
+    matches the one recorded at its last successful backup is skipped.
+    With ``incremental='table'``, a database whose schema hasn't changed only has the data of its
+    changed tables dumped (``pg_dump --data-only --table=...``). To restore one of these, restore
+    the entry's ``base`` backup, then each of its ``incrementals`` in order, truncating the listed
+    tables before loading each one with ``pg_restore --data-only``.
+    Any schema change, or a missing backup file, means a new full backup.
+
+    :param backup_folder: '/Users/my_name/Desktop/backup_folder'
+    :param uri: connection string to any database on the cluster, e.g. the default db
+    :param databases: list of database names
+    :param dump_format: ``'directory'``, ``'custom'`` or ``'plain'``
+    :param jobs_per_database: number of ``pg_dump`` jobs for each directory-format dump
+    :param max_jobs: most ``pg_dump`` jobs to run at once across all databases
+    :param compression: ``pg_dump --compress`` value
+    :param incremental: ``None`` to back up everything, ``'database'`` to skip unchanged databases,
+                        or ``'table'`` to back up only the changed tables in each database
+    :param fingerprint_method: ``'counters'`` or ``'checksum'``, see ``database_fingerprint()``
+    :param raise_errors: raise the first failure after every database has been tried,
+                         instead of only recording it in the manifest
+    :return: the manifest, as a dict
+    """
+    start_time = time.time()
+
+    if incremental not in [None, "database", "table"]:
+        raise ValueError(f"incremental must be None, 'database' or 'table', not '{incremental}'")
+
+    if dump_format != "directory":
+        jobs_per_database = 1
+
+    jobs_per_database = max(1, min(jobs_per_database, max_jobs))
+    workers = max(1, max_jobs // jobs_per_database)
+
+    sizes = _database_sizes(uri, databases)
+    databases = sorted(databases, key=lambda database: sizes.get(database, 0), reverse=True)
+
+    if debug:
+        print(f'## Backing up {len(databases)} databases to {backup_folder}, '
+              f'{workers} at a time with {jobs_per_database} jobs each')
+
+    os.makedirs(backup_folder, exist_ok=True)
+    manifest = read_manifest(backup_folder)
+    manifest["started"] = datetime.now().isoformat(timespec="seconds")
+
+    errors = []
+    skipped = []
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_back_up_one_database, backup_folder, _database_uri(uri, database),
+                                   dict(manifest["databases"].get(database, {})),
+                                   incremental=incremental, fingerprint_method=fingerprint_method,
+                                   dump_format=dump_format, jobs=jobs_per_database,
+                                   compression=compression, debug=debug): database
+                   for database in databases}
+
+        for future in as_completed(futures):
+            database = futures[future]
+            entry = manifest["databases"].setdefault(database, {})
+
+            try:
+                result = future.result()
+            except Exception as error:
+                message = error.stderr.strip() if isinstance(error, subprocess.CalledProcessError) else str(error)
+                print(f'## -> Backing up {database} failed: {message}')
+                entry.update({"status": "failed", "error": message,
+                              "attempted": datetime.now().isoformat(timespec="seconds")})
+                errors.append(error)
+            else:
+                if result["status"] == "skipped":
+                    skipped.append(database)
+                    result["checked"] = datetime.now().isoformat(timespec="seconds")
+                else:
+                    result["finished"] = datetime.now().isoformat(timespec="seconds")
+
+                entry.update(result)
+                entry["error"] = None
+
+            # Keep the manifest current, so it's useful even if the run is interrupted
+            write_manifest(backup_folder, manifest)
+
+    manifest["finished"] = datetime.now().isoformat(timespec="seconds")
+    manifest["seconds"] = round(time.time() - start_time, 2)
+    write_manifest(backup_folder, manifest)
+
+    n_backed_up = len(databases) - len(errors) - len(skipped)
+    summary = f"Backed up {n_backed_up} of {len(databases)} databases ({len(skipped)} unchanged, {len(errors)} failed)"
+
+    print(f'## {summary} in {manifest["seconds"]} seconds')
+
+    log_activity('pGIS.back_up_databases',
+                 uri=uri,
+                 query_text=f"{summary} to {backup_folder}",
+                 debug=debug)
+
+    if raise_errors and errors:
+        raise errors[0]
+
+    return manifest
+
+
+if __name__ == "__main__":
+    pass
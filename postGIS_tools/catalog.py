@@ -0,0 +1,274 @@
+"""
+Overview of ``catalog.py``
+--------------------------
+
+A cached snapshot of what's in a database: tables, columns and their types,
+geometry columns with their type and SRID, estimated row counts, indexes,
+and the list of databases on the cluster.
+
+The snapshot is loaded with a single query and cached per URI for ``CATALOG_TTL_SECONDS``.
+``postGIS_tools`` functions that change the database (``execute_query()``, ``drop_table()``,
+``make_geotable_from_query()``, the ``*_to_postgis()`` loaders, etc.) invalidate the cache
+for that URI, so the next lookup reloads it.
+
+Examples
+--------
+
+    >>> from postGIS_tools.catalog import get_catalog
+    >>> catalog = get_catalog(uri)
+    >>> catalog.spatial_tables()
+    ['bike_lanes', 'parcels']
+    >>> catalog.geometry_columns["parcels"]
+    {'geom': {'type': 'MULTIPOLYGON', 'srid': 2227}}
+
+"""
+import os
+import re
+import threading
+import time
+from typing import Union
+
+from postGIS_tools.connections import get_connection
+
+CATALOG_TTL_SECONDS = 60
+
+POSTGIS_TABLES = ['geography_columns', 'geometry_columns',
+                  'spatial_ref_sys', 'raster_columns', 'raster_overviews']
+
+CATALOG_QUERY = """
+    WITH relations AS (
+        SELECT c.oid, n.nspname AS schema_name, c.relname AS table_name, c.relkind,
+               c.reltuples::BIGINT AS estimated_rows,
+               coalesce(pg_total_relation_size(c.oid), 0) AS total_bytes
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relkind IN ('r', 'p', 'v', 'm', 'f')
+          AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+          AND n.nspname NOT LIKE 'pg_toast%'
+          AND n.nspname NOT LIKE 'pg_temp%'
+    )
+    SELECT json_build_object(
+        'tables', (
+            SELECT coalesce(json_agg(json_build_object(
+                'schema', r.schema_name,
+                'table', r.table_name,
+                'kind', r.relkind,
+                'estimated_rows', r.estimated_rows,
+                'total_bytes', r.total_bytes) ORDER BY r.schema_name <> 'public'), '[]')
+            FROM relations r
+        ),
+        'columns', (
+            SELECT coalesce(json_agg(json_build_object(
+                'schema', r.schema_name,
+                'table', r.table_name,
+                'column', a.attname,
+                'type', format_type(a.atttypid, a.atttypmod),
+                'base_type', t.typname) ORDER BY r.table_name, a.attnum), '[]')
+            FROM relations r
+            JOIN pg_attribute a ON a.attrelid = r.oid AND a.attnum > 0 AND NOT a.attisdropped
+            JOIN pg_type t ON t.oid = a.atttypid
+        ),
+        'indexes', (
+            SELECT coalesce(json_agg(json_build_object(
+                'schema', r.schema_name,
+                'table', r.table_name,
+                'index', ic.relname,
+                'definition', pg_get_indexdef(i.indexrelid),
+                'is_primary', i.indisprimary)), '[]')
+            FROM relations r
+            JOIN pg_index i ON i.indrelid = r.oid
+            JOIN pg_class ic ON ic.oid = i.indexrelid
+        ),
+        'databases', (
+            SELECT coalesce(json_agg(datname), '[]')
+            FROM pg_database
+            WHERE datistemplate = false
+        )
+    )
+"""
+
+# format_type() gives 'geometry(MultiPolygon,2227)' for typed columns and plain 'geometry' otherwise
+_GEOMETRY_TYPMOD = re.compile(r"^geometry\((\w+)(?:,\s*(\d+))?\)$", re.IGNORECASE)
+
+
+class CatalogSnapshot:
+    """
+    Everything ``postGIS_tools`` needs to know about a database's contents, as of ``loaded_at``.
+
+    - ``tables``: dict of table name -> {schema, kind, estimated_rows, total_bytes}
+    - ``columns``: dict of table name -> list of (column, type) tuples, in column order
+    - ``geometry_columns``: dict of table name -> {column: {type, srid}}
+    - ``indexes``: dict of table name -> list of {index, definition, is_primary}
+    - ``databases``: list of the non-template databases on the cluster
+    """
+
+    def __init__(self, raw: dict):
+        self.loaded_at = time.time()
+
+        self.tables = {}
+        self.columns = {}
+        self.geometry_columns = {}
+        self.indexes = {}
+        self.public_tables = []
+
+        for table in raw["tables"]:
+            name = table["table"]
+            self.tables.setdefault(name, {"schema": table["schema"],
+                                          "kind": table["kind"],
+                                          "estimated_rows": max(table["estimated_rows"], 0),
+                                          "total_bytes": table["total_bytes"]})
+            if table["schema"] == "public":
+                self.public_tables.append(name)
+
+        for column in raw["columns"]:
+            name = column["table"]
+
+            # If a table name is used in more than one schema, keep the one in 'public'
+            if column["schema"] != self.tables[name]["schema"]:
+                continue
+
+            self.columns.setdefault(name, []).append((column["column"], column["type"]))
+
+            if column["base_type"] == "geometry":
+                match = _GEOMETRY_TYPMOD.match(column["type"])
+                geom_type = match.group(1).upper() if match else "GEOMETRY"
+                srid = int(match.group(2)) if match and match.group(2) else 0
+
+                self.geometry_columns.setdefault(name, {})[column["column"]] = {"type": geom_type, "srid": srid}
+
+        for index in raw["indexes"]:
+            if index["schema"] != self.tables[index["table"]]["schema"]:
+                continue
+
+            self.indexes.setdefault(index["table"], []).append({"index": index["index"],
+                                                                "definition": index["definition"],
+                                                                "is_primary": index["is_primary"]})
+
+        self.databases = list(raw["databases"])
+
+    def age(self) -> float:
+        return time.time() - self.loaded_at
+
+    def table_names(self, include_postgis_tables: bool = False) -> list:
+        """ Tables and views in the ``public`` schema """
+        if include_postgis_tables:
+            return list(self.public_tables)
+        return [t for t in self.public_tables if t not in POSTGIS_TABLES]
+
+    def column_names(self, table: str) -> list:
+        """ Columns in a table, in order """
+        return [column for column, _ in self.columns.get(table, [])]
+
+    def spatial_tables(self) -> list:
+        """ Tables (in any schema) with at least one geometry column """
+        return [t for t in self.geometry_columns if t not in POSTGIS_TABLES]
+
+    def estimated_rows(self, table: str) -> int:
+        return self.tables.get(table, {}).get("estimated_rows", 0)
+
+    def total_bytes(self, table: str) -> int:
+        return self.tables.get(table, {}).get("total_bytes", 0)
+
+
+_CATALOGS = {}
+_LOCK = threading.Lock()
+
+
+def _after_fork_in_child():
+    """ Another thread may have held the lock when the process forked, so the child gets a new one """
+    global _LOCK
+
+    _LOCK = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def get_catalog(
+        uri: str,
+        max_age: float = None,
+        debug: bool = False
+) -> CatalogSnapshot:
+    """
+    Get the catalog snapshot for a database, loading it if there isn't one younger than ``max_age`` seconds.
+
+    :param uri: connection string
+    :param max_age: seconds before a cached snapshot is reloaded. Defaults to ``CATALOG_TTL_SECONDS``
+    :return: ``CatalogSnapshot``
+    """
+    catalog = cached_catalog(uri, max_age=max_age)
+    if catalog is not None:
+        return catalog
+
+    if debug:
+        print(f'## Loading catalog snapshot for {uri}')
+
+    with get_connection(uri) as connection:
+        cursor = connection.cursor()
+        cursor.execute(CATALOG_QUERY)
+        raw = cursor.fetchone()[0]
+        cursor.close()
+
+    return store_catalog(uri, raw)
+
+
+def cached_catalog(
+        uri: str,
+        max_age: float = None
+) -> Union[CatalogSnapshot, None]:
+    """
+    Get the cached snapshot for a URI without touching the database.
+
+    :param uri: connection string
+    :param max_age: seconds before a cached snapshot counts as stale. Defaults to ``CATALOG_TTL_SECONDS``
+    :return: ``CatalogSnapshot``, or ``None`` if there isn't a fresh one
+    """
+    if max_age is None:
+        max_age = CATALOG_TTL_SECONDS
+
+    with _LOCK:
+        catalog = _CATALOGS.get(uri)
+
+    if catalog is not None and catalog.age() < max_age:
+        return catalog
+
+    return None
+
+
+def store_catalog(
+        uri: str,
+        raw: dict
+) -> CatalogSnapshot:
+    """
+    Build a snapshot from the result of ``CATALOG_QUERY`` and cache it for this URI.
+
+    :param uri: connection string
+    :param raw: the JSON object returned by ``CATALOG_QUERY``
+    :return: ``CatalogSnapshot``
+    """
+    catalog = CatalogSnapshot(raw)
+
+    with _LOCK:
+        _CATALOGS[uri] = catalog
+
+    return catalog
+
+
+def invalidate_catalog(uri: str = None):
+    """
+    Throw away the cached snapshot for a URI so the next lookup reloads it.
+
+    :param uri: connection string. If ``None``, every cached snapshot is dropped
+                (e.g. after ``CREATE DATABASE``, which changes the database list everywhere on the cluster)
+    :return: None
+    """
+    with _LOCK:
+        if uri is None:
+            _CATALOGS.clear()
+        else:
+            _CATALOGS.pop(uri, None)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,343 @@
+"""
+Overview of ``connections.py``
+------------------------------
+
+A process-wide pool of ``psycopg2`` connections keyed on the connection string,
+plus a cache of ``sqlalchemy`` engines keyed the same way.
+
+Every function in ``postGIS_tools.functions`` borrows its connection from here
+instead of calling ``psycopg2.connect()`` itself, so a chain of calls against
+the same URI only pays the TLS and authentication handshake once.
+
+Examples
+--------
+
+    >>> from postGIS_tools.connections import get_connection, get_engine
+    >>> with get_connection(uri) as connection:
+    ...     cursor = connection.cursor()
+    ...     cursor.execute("SELECT 1")
+    >>> df = pd.read_sql("SELECT * FROM my_table", get_engine(uri))
+
+"""
+import atexit
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.pool
+import sqlalchemy
+
+# Pool defaults, which can be changed with ``configure_connection_pool()``
+POOL_MIN_SIZE = 0
+POOL_MAX_SIZE = 8
+POOL_MAX_IDLE_SECONDS = 300
+POOL_HEALTH_CHECK_SECONDS = 30
+POOL_TIMEOUT_SECONDS = 60
+
+
+class URIConnectionPool:
+    """
+    Thread-safe pool of ``psycopg2`` connections to a single URI.
+
+    - At most ``max_size`` connections are open at once. Borrowers wait up to
+      ``timeout`` seconds for one to be returned before raising ``psycopg2.pool.PoolError``.
+    - Connections idle for more than ``max_idle`` seconds are closed, down to ``min_size``.
+    - A connection idle for more than ``health_check_after`` seconds is pinged
+      with ``SELECT 1`` before being handed out, and replaced if the ping fails.
+    """
+
+    def __init__(
+            self,
+            uri: str,
+            min_size: int = POOL_MIN_SIZE,
+            max_size: int = POOL_MAX_SIZE,
+            max_idle: float = POOL_MAX_IDLE_SECONDS,
+            health_check_after: float = POOL_HEALTH_CHECK_SECONDS,
+            timeout: float = POOL_TIMEOUT_SECONDS
+    ):
+        self.uri = uri
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.health_check_after = health_check_after
+        self.timeout = timeout
+
+        self._idle = []  # list of (connection, time it was returned)
+        self._in_use = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def _connect(self):
+        return psycopg2.connect(self.uri)
+
+    def _is_healthy(self, connection, idle_since: float) -> bool:
+        if connection.closed:
+            return False
+
+        if time.time() - idle_since < self.health_check_after:
+            return True
+
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            connection.rollback()
+            return True
+
+        except (Exception, psycopg2.Error):
+            return False
+
+    def _evict_idle(self):
+        """ Close connections that have sat unused for longer than ``max_idle`` seconds. Caller holds the lock. """
+        now = time.time()
+        keep = []
+        for connection, idle_since in self._idle:
+            too_many = len(keep) + self._in_use >= self.min_size
+            if too_many and now - idle_since > self.max_idle:
+                connection.close()
+            else:
+                keep.append((connection, idle_since))
+        self._idle = keep
+
+    def getconn(self):
+        """ Borrow a connection, opening a new one if none are idle and the pool isn't full. """
+        deadline = time.time() + self.timeout
+
+        with self._condition:
+            self._evict_idle()
+
+            while not self._idle and self._in_use >= self.max_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise psycopg2.pool.PoolError(f"Timed out waiting for a connection to {self.uri}")
+                self._condition.wait(remaining)
+
+            # Claim a slot before releasing the lock to check health or connect
+            if self._idle:
+                connection, idle_since = self._idle.pop()
+            else:
+                connection, idle_since = None, None
+            self._in_use += 1
+
+        try:
+            if connection is not None and not self._is_healthy(connection, idle_since):
+                connection.close()
+                connection = None
+
+            if connection is None:
+                connection = self._connect()
+
+        except Exception:
+            with self._condition:
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+
+        return connection
+
+    def putconn(self, connection, discard: bool = False):
+        """ Return a borrowed connection. Anything left in an open transaction is rolled back. """
+        if not discard and not connection.closed:
+            try:
+                if connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+                if connection.autocommit:
+                    connection.autocommit = False
+            except (Exception, psycopg2.Error):
+                discard = True
+
+        with self._condition:
+            self._in_use -= 1
+
+            if discard or self._closed or connection.closed:
+                if not connection.closed:
+                    connection.close()
+            else:
+                self._idle.append((connection, time.time()))
+
+            self._evict_idle()
+            self._condition.notify()
+
+    def closeall(self):
+        """ Close every idle connection. Connections that are borrowed are closed when they come back. """
+        with self._condition:
+            for connection, _ in self._idle:
+                connection.close()
+            self._idle = []
+            self._closed = True
+
+
+_POOLS = {}
+_ENGINES = {}
+_POOL_SETTINGS = {}
+_LOCK = threading.Lock()
+_OWNER_PID = os.getpid()
+
+# Pools and engines a forked process inherited from its parent. They're kept referenced and never closed,
+# because freeing their connections would end the parent's sessions over the sockets they share.
+_INHERITED = []
+
+
+def _check_for_fork():
+    """
+    Forked processes (e.g. a ``ProcessPoolExecutor`` worker) inherit the parent's sockets.
+    Set the parent's pools and engines aside without closing them, so the child opens its own connections.
+    """
+    global _OWNER_PID
+
+    if os.getpid() != _OWNER_PID:
+        _INHERITED.append((dict(_POOLS), dict(_ENGINES)))
+        _POOLS.clear()
+        _ENGINES.clear()
+        _OWNER_PID = os.getpid()
+
+
+def _after_fork_in_child():
+    """ The lock may have been held by another thread of the parent when it forked, so the child gets a new one """
+    global _LOCK
+
+    _LOCK = threading.Lock()
+    _check_for_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def configure_connection_pool(
+        min_size: int = POOL_MIN_SIZE,
+        max_size: int = POOL_MAX_SIZE,
+        max_idle: float = POOL_MAX_IDLE_SECONDS,
+        health_check_after: float = POOL_HEALTH_CHECK_SECONDS,
+        timeout: float = POOL_TIMEOUT_SECONDS
+):
+    """
+    Change the settings used for every connection pool.
+    Pools (and ``sqlalchemy`` engines) that already exist are closed and rebuilt with the new settings on next use.
+
+    :param min_size: number of idle connections to keep open per URI
+    :param max_size: maximum number of open connections per URI
+    :param max_idle: seconds a connection may sit unused before being closed. Engines recycle connections this old
+    :param health_check_after: seconds of idleness after which a connection is pinged before reuse
+    :param timeout: seconds to wait for a free connection before raising ``psycopg2.pool.PoolError``
+    :return: None
+    """
+    with _LOCK:
+        _POOL_SETTINGS.update({"min_size": min_size,
+                               "max_size": max_size,
+                               "max_idle": max_idle,
+                               "health_check_after": health_check_after,
+                               "timeout": timeout})
+
+        for pool in _POOLS.values():
+            pool.closeall()
+        _POOLS.clear()
+
+        for engine in _ENGINES.values():
+            engine.dispose()
+        _ENGINES.clear()
+
+
+def get_pool(uri: str) -> URIConnectionPool:
+    """
+    Get the connection pool for a URI, creating it on first use.
+
+    :param uri: connection string
+    :return: ``URIConnectionPool``
+    """
+    with _LOCK:
+        _check_for_fork()
+
+        if uri not in _POOLS:
+            _POOLS[uri] = URIConnectionPool(uri, **_POOL_SETTINGS)
+
+        return _POOLS[uri]
+
+
+@contextmanager
+def get_connection(
+        uri: str,
+        autocommit: bool = False
+):
+    """
+    Borrow a ``psycopg2`` connection from the pool for this URI.
+
+    The transaction is committed if the block finishes cleanly and rolled back if it raises.
+    Either way the connection goes back to the pool afterwards.
+
+    :param uri: connection string
+    :param autocommit: set to ``True`` for commands like ``CREATE DATABASE`` that can't run in a transaction
+    :return: ``psycopg2`` connection
+    """
+    pool = get_pool(uri)
+    connection = pool.getconn()
+    connection.autocommit = autocommit
+
+    try:
+        yield connection
+
+        if not autocommit:
+            connection.commit()
+
+    except BaseException:
+        discard = connection.closed != 0
+        if not discard:
+            try:
+                connection.rollback()
+            except (Exception, psycopg2.Error):
+                discard = True
+
+        pool.putconn(connection, discard=discard)
+        raise
+
+    pool.putconn(connection)
+
+
+def get_engine(uri: str) -> sqlalchemy.engine.Engine:
+    """
+    Get a cached ``sqlalchemy`` engine for this URI.
+    The engine keeps its own pool of connections, checked with ``pool_pre_ping`` before each use.
+
+    :param uri: connection string
+    :return: ``sqlalchemy.engine.Engine``
+    """
+    with _LOCK:
+        _check_for_fork()
+
+        if uri not in _ENGINES:
+            _ENGINES[uri] = sqlalchemy.create_engine(uri,
+                                                     pool_pre_ping=True,
+                                                     pool_recycle=_POOL_SETTINGS.get("max_idle",
+                                                                                     POOL_MAX_IDLE_SECONDS))
+
+        return _ENGINES[uri]
+
+
+def close_all_connections(uri: str = None):
+    """
+    Close pooled connections and dispose cached engines.
+
+    :param uri: only close connections for this URI. If ``None``, close everything.
+    :return: None
+    """
+    with _LOCK:
+        if os.getpid() != _OWNER_PID:
+            _check_for_fork()
+            return
+
+        uris = [uri] if uri else list(set(_POOLS) | set(_ENGINES))
+
+        for this_uri in uris:
+            if this_uri in _POOLS:
+                _POOLS.pop(this_uri).closeall()
+            if this_uri in _ENGINES:
+                _ENGINES.pop(this_uri).dispose()
+
+
+atexit.register(close_all_connections)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,1469 @@
+"""
+Overview of ``copy_engine.py``
+------------------------------
+
+Bulk-load data into PostgreSQL with ``COPY ... FROM STDIN`` instead of row-by-row ``INSERT`` statements.
+
+The table is created with explicit DDL derived from the ``pandas`` dtypes (using the same type
+choices that ``DataFrame.to_sql()`` makes), and the rows are streamed to the server in chunks,
+either as PostgreSQL's binary ``COPY`` format or as CSV text.
+
+The binary encoder assembles each chunk into a single preallocated byte buffer. Row layout, field
+lengths and fixed-width values are written with ``numpy`` array operations. Text, bytea and geometry
+values are copied in one slice per value, which keeps memory use to the size of the output.
+
+Arrow record batches (e.g. row groups of a GeoParquet file) are encoded straight from their
+buffers by ``encode_arrow_batch()``, with WKB geometries turned into EWKB on the way through.
+
+``copy_between_databases()`` pipes ``COPY ... TO STDOUT`` on one database straight into
+``COPY ... FROM STDIN`` on another, through a bounded in-memory buffer.
+
+Examples
+--------
+
+    >>> from postGIS_tools.copy_engine import write_dataframe
+    >>> write_dataframe(df, "my_table", uri, copy_format="binary", debug=True)
+    ## COPY 1000000 rows into my_table in 3.21 seconds (311526 rows/sec)
+
+"""
+import codecs
+import csv
+import gzip
+import io
+import queue
+import re
+import struct
+import threading
+import time
+import zipfile
+from typing import Union
+
+import numpy as np
+import pandas as pd
+import psycopg2
+import psycopg2.errors
+import shapely
+
+from postGIS_tools.catalog import invalidate_catalog
+from postGIS_tools.connections import get_connection
+
+# PostgreSQL's binary COPY format stores dates and timestamps relative to 2000-01-01
+PG_EPOCH_DAYS = 10957
+PG_EPOCH_MICROSECONDS = PG_EPOCH_DAYS * 86400 * 1000000
+
+BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+BINARY_TRAILER = struct.pack(">h", -1)
+
+DEFAULT_CHUNKSIZE = 100000
+
+# CSV files are read in blocks of this many bytes, both to sniff them and to stream them
+CSV_SAMPLE_BYTES = 1024 * 1024
+CSV_BLOCK_BYTES = 1024 * 1024
+
+# Raised by COPY when the file has bytes that aren't valid in the encoding it was read as
+CSV_ENCODING_ERRORS = (psycopg2.errors.CharacterNotInRepertoire, psycopg2.errors.UntranslatableCharacter)
+
+# Database-to-database COPY passes data along in blocks, with at most this many waiting at once
+COPY_PIPE_BLOCK_BYTES = 1024 * 1024
+COPY_PIPE_MAX_BLOCKS = 16
+
+# Fixed-width binary representation for each SQL type
+_FIXED_WIDTH_TYPES = {
+    "SMALLINT": ">i2",
+    "INTEGER": ">i4",
+    "BIGINT": ">i8",
+    "REAL": ">f4",
+    "DOUBLE PRECISION": ">f8",
+    "BOOLEAN": "u1",
+    "DATE": ">i4",
+    "TIME WITHOUT TIME ZONE": ">i8",
+    "TIMESTAMP WITHOUT TIME ZONE": ">i8",
+    "TIMESTAMP WITH TIME ZONE": ">i8",
+}
+
+
+def quote_identifier(name: str) -> str:
+    """
+    Wrap a table or column name in double quotes, the same way ``DataFrame.to_sql()`` does.
+
+    :param name: 'Column Name'
+    :return: '"Column Name"'
+    """
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def quote_table_name(name: str) -> str:
+    """
+    Quote a table name that may include its schema, one part at a time.
+
+    :param name: 'gis.parcels'
+    :return: '"gis"."parcels"'
+    """
+    return ".".join(quote_identifier(part) for part in str(name).split("."))
+
+
+def libpq_uri(uri: str) -> str:
+    """
+    Drop a SQLAlchemy-style driver name like 'postgresql+psycopg2://', which libpq doesn't understand.
+
+    :param uri: connection string
+    :return: connection string starting with 'postgresql://'
+    """
+    return re.sub(r"^postgres(ql)?\+\w+://", "postgresql://", uri)
+
+
+def is_postgres_uri(uri: str) -> bool:
+    """
+    Check if a connection string points at PostgreSQL.
+
+    :param uri: connection string
+    :return: True or False bool
+    """
+    return uri.split("://")[0].split("+")[0] in ["postgresql", "postgres"]
+
+
+################################################################################
+# MAP PANDAS DTYPES TO SQL TYPES
+################################################################################
+
+
+def sql_type_for_series(series: pd.Series) -> str:
+    """
+    Pick the PostgreSQL type for a column, following the choices made by ``DataFrame.to_sql()``.
+
+    :param series: ``pandas.Series``
+    :return: SQL type as ``str``, e.g. ``'BIGINT'``
+    """
+    dtype = series.dtype
+
+    if pd.api.types.is_bool_dtype(dtype):
+        return "BOOLEAN"
+
+    if pd.api.types.is_integer_dtype(dtype):
+        if str(dtype).lower() in ["int8", "uint8", "int16"]:
+            return "SMALLINT"
+        if str(dtype).lower() in ["int32", "uint16"]:
+            return "INTEGER"
+        return "BIGINT"
+
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL" if str(dtype).lower() == "float32" else "DOUBLE PRECISION"
+
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        return "TIMESTAMP WITH TIME ZONE"
+
+    if pd.api.types.is_datetime64_dtype(dtype):
+        return "TIMESTAMP WITHOUT TIME ZONE"
+
+    if pd.api.types.is_timedelta64_dtype(dtype):
+        return "BIGINT"
+
+    # Object columns (and anything else) are typed by what they hold
+    inferred = pd.api.types.infer_dtype(series, skipna=True)
+
+    object_types = {
+        "boolean": "BOOLEAN",
+        "integer": "BIGINT",
+        "floating": "DOUBLE PRECISION",
+        "mixed-integer-float": "DOUBLE PRECISION",
+        "decimal": "DOUBLE PRECISION",
+        "datetime64": "TIMESTAMP WITHOUT TIME ZONE",
+        "datetime": "TIMESTAMP WITHOUT TIME ZONE",
+        "date": "DATE",
+        "time": "TIME WITHOUT TIME ZONE",
+        "bytes": "BYTEA",
+    }
+
+    sql_type = object_types.get(inferred, "TEXT")
+
+    if sql_type == "TIMESTAMP WITHOUT TIME ZONE":
+        sample = series.dropna()
+        if len(sample) and getattr(sample.iloc[0], "tzinfo", None) is not None:
+            sql_type = "TIMESTAMP WITH TIME ZONE"
+
+    return sql_type
+
+
+def frame_sql_types(
+        frame: pd.DataFrame,
+        sql_types: dict = None
+) -> list:
+    """
+    Get a list of ``(column, sql_type)`` pairs for every column in a ``DataFrame``.
+
+    :param frame: ``pandas.DataFrame``
+    :param sql_types: optional dict of SQL types that override the ones inferred from the data
+    :return: list of tuples
+    """
+    sql_types = sql_types or {}
+
+    return [(column, sql_types.get(column) or sql_type_for_series(frame[column]))
+            for column in frame.columns]
+
+
+def create_table_sql(
+        table_name: str,
+        column_types: list,
+        unlogged: bool = False
+) -> str:
+    """
+    Build a ``CREATE TABLE`` statement.
+
+    :param table_name: 'name_of_the_table'
+    :param column_types: list of ``(column, sql_type)`` tuples
+    :param unlogged: make an ``UNLOGGED`` table
+    :return: SQL as ``str``
+    """
+    columns = ",\n    ".join(f"{quote_identifier(column)} {sql_type}" for column, sql_type in column_types)
+    table_kind = "UNLOGGED TABLE" if unlogged else "TABLE"
+
+    return f"CREATE {table_kind} {quote_identifier(table_name)} (\n    {columns}\n);"
+
+
+def geometry_sql_type(
+        geom_type: str,
+        srid: int
+) -> str:
+    """
+    Build a typed PostGIS column definition.
+
+    :param geom_type: 'MULTIPOLYGON'
+    :param srid: 2227
+    :return: 'geometry(MULTIPOLYGON, 2227)'
+    """
+    return f"geometry({geom_type.upper()}, {srid})"
+
+
+def geometry_to_ewkb(
+        geometries,
+        srid: int
+) -> np.ndarray:
+    """
+    Encode an array of ``shapely`` geometries as EWKB (WKB with the SRID embedded) in one vectorized call.
+    PostGIS reads these bytes directly in a binary ``COPY``, with no WKT parsing on the server.
+
+    :param geometries: ``geopandas.GeoSeries``, ``GeometryArray`` or array of ``shapely`` geometries
+    :param srid: EPSG code to embed in each geometry
+    :return: ``numpy`` object array of ``bytes``, with ``None`` for missing geometries
+    """
+    geometries = shapely.set_srid(np.asarray(geometries, dtype=object), srid)
+
+    return shapely.to_wkb(geometries, include_srid=True)
+
+
+################################################################################
+# ENCODE CHUNKS OF ROWS
+################################################################################
+
+
+def _null_mask(series: pd.Series) -> np.ndarray:
+    return series.isna().to_numpy(dtype=bool)
+
+
+def _fixed_width_values(
+        series: pd.Series,
+        sql_type: str,
+        mask: np.ndarray
+) -> np.ndarray:
+    """ Convert a column to the numpy array whose big-endian bytes are the binary COPY representation. """
+
+    if sql_type in ["TIMESTAMP WITHOUT TIME ZONE", "TIMESTAMP WITH TIME ZONE", "DATE"]:
+        values = pd.to_datetime(series)
+        if getattr(values.dt, "tz", None) is not None:
+            values = values.dt.tz_convert("UTC").dt.tz_localize(None)
+
+        if sql_type == "DATE":
+            days = values.to_numpy(dtype="datetime64[ns]").astype("datetime64[D]").astype(np.int64)
+            values = days - PG_EPOCH_DAYS
+        else:
+            micros = values.to_numpy(dtype="datetime64[ns]").astype("datetime64[us]").astype(np.int64)
+            values = micros - PG_EPOCH_MICROSECONDS
+
+    elif sql_type == "TIME WITHOUT TIME ZONE":
+        values = np.array([0 if is_null else
+                           ((t.hour * 60 + t.minute) * 60 + t.second) * 1000000 + t.microsecond
+                           for t, is_null in zip(series, mask)], dtype=np.int64)
+
+    elif pd.api.types.is_timedelta64_dtype(series.dtype):
+        values = series.to_numpy(dtype="timedelta64[ns]").view(np.int64)
+
+    elif sql_type == "BOOLEAN":
+        values = series.to_numpy(dtype=object, na_value=False).astype(bool)
+
+    elif sql_type in ["REAL", "DOUBLE PRECISION"]:
+        values = series.to_numpy(dtype=np.float64, na_value=0.0)
+
+    elif pd.api.types.is_float_dtype(series.dtype):
+        # Integers that picked up NULLs come through as floats. Refuse anything that isn't a whole number
+        floats = series.to_numpy(dtype=np.float64, na_value=0.0)
+        if not (np.isfinite(floats).all() and np.array_equal(floats, np.trunc(floats))):
+            raise ValueError(f"Column {series.name} has values that aren't whole numbers, so it can't be {sql_type}")
+        values = floats.astype(np.int64)
+
+    else:
+        values = series.to_numpy(dtype=np.int64, na_value=0)
+
+    return np.asarray(values).astype(_FIXED_WIDTH_TYPES[sql_type])
+
+
+def _variable_width_values(
+        series: pd.Series,
+        sql_type: str,
+        mask: np.ndarray
+) -> list:
+    """ Get a list of ``bytes`` for each non-null value of a text, bytea or geometry column. """
+    values = series.to_numpy(dtype=object)[~mask]
+
+    if sql_type == "TEXT":
+        return [v.encode("utf-8") if isinstance(v, str) else str(v).encode("utf-8") for v in values]
+
+    return [v if isinstance(v, bytes) else bytes(v) for v in values]
+
+
+def _scatter_fixed(out, positions, values, mask):
+    """ Write a fixed-width column's values into ``out`` at each row's field position. """
+    valid = ~mask
+    width = values.dtype.itemsize
+    raw = np.ascontiguousarray(values[valid]).view(np.uint8).reshape(-1, width)
+    out[(positions[valid] + 4)[:, None] + np.arange(width)] = raw
+
+
+def _scatter_variable(out, positions, data, source_starts, lengths, mask):
+    """
+    Copy a variable-width column's values into ``out`` at each row's field position, one slice per value.
+    ``data`` holds the values' bytes and ``source_starts`` is where each non-null value starts in it.
+    """
+    out = memoryview(out)
+    data = memoryview(data)
+
+    destinations = (positions[~mask] + 4).tolist()
+    valid_lengths = lengths[~mask].tolist()
+
+    for destination, start, length in zip(destinations, source_starts.tolist(), valid_lengths):
+        out[destination:destination + length] = data[start:start + length]
+
+
+def _assemble_binary_rows(
+        lengths: np.ndarray,
+        fields: list
+) -> bytes:
+    """
+    Lay out rows of binary ``COPY`` data from prepared columns.
+
+    Each row is a 16-bit field count followed by each field as a 32-bit length
+    (``-1`` for NULL) and the field's bytes. All positions are computed up front
+    so every column can be written straight into one preallocated buffer:
+    fixed-width values with ``numpy`` indexing, variable-width values as slice copies.
+
+    :param lengths: (rows x fields) array of field lengths, ``-1`` for NULL
+    :param fields: list of ``("fixed", values, mask)`` or ``("variable", (data, source_starts), mask)`` tuples
+    :return: ``bytes``
+    """
+    n_fields = lengths.shape[1]
+
+    # Work out where every row and field starts
+    field_sizes = 4 + np.maximum(lengths, 0)
+    row_sizes = 2 + field_sizes.sum(axis=1)
+    row_starts = np.cumsum(row_sizes) - row_sizes
+    field_starts = row_starts[:, None] + 2 + (np.cumsum(field_sizes, axis=1) - field_sizes)
+
+    out = np.zeros(int(row_sizes.sum()), dtype=np.uint8)
+
+    # 16-bit field count at the start of each row
+    out[row_starts[:, None] + np.arange(2)] = np.frombuffer(struct.pack(">h", n_fields), dtype=np.uint8)
+
+    for i, (kind, payload, mask) in enumerate(fields):
+        positions = field_starts[:, i]
+
+        # 32-bit length for each field
+        length_bytes = lengths[:, i].astype(">i4").view(np.uint8).reshape(-1, 4)
+        out[positions[:, None] + np.arange(4)] = length_bytes
+
+        if kind == "fixed":
+            _scatter_fixed(out, positions, payload, mask)
+        else:
+            data, source_starts = payload
+            _scatter_variable(out, positions, data, source_starts, lengths[:, i], mask)
+
+    return out.tobytes()
+
+
+def encode_binary_rows(
+        frame: pd.DataFrame,
+        column_types: list
+) -> bytes:
+    """
+    Encode a chunk of rows in PostgreSQL's binary ``COPY`` format (without the file header or trailer).
+
+    :param frame: ``pandas.DataFrame`` holding the rows
+    :param column_types: list of ``(column, sql_type)`` tuples
+    :return: ``bytes``
+    """
+    n_rows = len(frame)
+
+    # Gather per-column payloads and per-row field lengths
+    fields = []
+    lengths = np.zeros((n_rows, len(column_types)), dtype=np.int64)
+
+    for i, (column, sql_type) in enumerate(column_types):
+        series = frame[column]
+        mask = _null_mask(series)
+
+        if sql_type in _FIXED_WIDTH_TYPES:
+            values = _fixed_width_values(series, sql_type, mask)
+            lengths[:, i] = np.where(mask, -1, values.dtype.itemsize)
+            fields.append(("fixed", values, mask))
+        else:
+            chunks = _variable_width_values(series, sql_type, mask)
+            valid_lengths = np.fromiter((len(c) for c in chunks), dtype=np.int64, count=len(chunks))
+            lengths[:, i] = -1
+            lengths[~mask, i] = valid_lengths
+
+            data = np.frombuffer(b"".join(chunks), dtype=np.uint8)
+            fields.append(("variable", (data, np.cumsum(valid_lengths) - valid_lengths), mask))
+
+    return _assemble_binary_rows(lengths, fields)
+
+
+def encode_csv_rows(
+        frame: pd.DataFrame,
+        column_types: list
+) -> bytes:
+    """
+    Encode a chunk of rows as CSV text for ``COPY ... WITH (FORMAT csv)``.
+
+    :param frame: ``pandas.DataFrame`` holding the rows
+    :param column_types: list of ``(column, sql_type)`` tuples
+    :return: ``bytes``
+    """
+    frame = frame[[column for column, _ in column_types]].copy()
+
+    for column, sql_type in column_types:
+        series = frame[column]
+
+        if pd.api.types.is_timedelta64_dtype(series.dtype):
+            frame[column] = series.to_numpy(dtype="timedelta64[ns]").view(np.int64)
+            frame.loc[series.isna(), column] = None
+
+        elif sql_type == "BYTEA":
+            frame[column] = [None if pd.isna(v) else "\\x" + bytes(v).hex() for v in series]
+
+        elif sql_type.upper().startswith("GEOMETRY"):
+            # PostGIS reads plain hex EWKB, without the \x prefix that bytea needs
+            frame[column] = [None if pd.isna(v) else bytes(v).hex() for v in series]
+
+    buffer = io.StringIO()
+    frame.to_csv(buffer, header=False, index=False, na_rep="")
+
+    return buffer.getvalue().encode("utf-8")
+
+
+class IteratorFile(io.RawIOBase):
+    """
+    File-like wrapper around an iterator of ``bytes``, so a generator can be handed
+    to ``cursor.copy_expert()`` and consumed a block at a time.
+    """
+
+    def __init__(self, iterator):
+        self._iterator = iterator
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._iterator)
+            except StopIteration:
+                break
+
+        if size < 0:
+            size = len(self._buffer)
+
+        result, self._buffer = self._buffer[:size], self._buffer[size:]
+        return result
+
+
+def iterate_encoded_chunks(
+        frames,
+        column_types: list,
+        copy_format: str,
+        row_counter: list
+):
+    """ Yield the encoded bytes for each chunk of rows, bracketed by the binary header and trailer. """
+    if copy_format == "binary":
+        yield BINARY_HEADER
+
+    for frame in frames:
+        row_counter[0] += len(frame)
+
+        if copy_format == "binary":
+            yield encode_binary_rows(frame, column_types)
+        else:
+            yield encode_csv_rows(frame, column_types)
+
+    if copy_format == "binary":
+        yield BINARY_TRAILER
+
+
+def iterate_chunks(
+        frame: pd.DataFrame,
+        chunksize: int
+):
+    """ Yield consecutive slices of ``chunksize`` rows from a ``DataFrame``. """
+    for start in range(0, len(frame), chunksize):
+        yield frame.iloc[start:start + chunksize]
+
+
+################################################################################
+# COPY INTO THE DATABASE
+################################################################################
+
+
+def copy_frames_to_table(
+        frames,
+        table_name: str,
+        column_types: list,
+        cursor,
+        copy_format: str = "binary"
+) -> int:
+    """
+    Stream an iterable of ``DataFrame`` chunks into an existing table with a single ``COPY``.
+
+    :param frames: iterable of ``pandas.DataFrame`` objects that all have the same columns
+    :param table_name: 'name_of_the_table'
+    :param column_types: list of ``(column, sql_type)`` tuples, in the order they appear in the COPY
+    :param cursor: open ``psycopg2`` cursor
+    :param copy_format: ``'binary'`` or ``'csv'``
+    :return: number of rows copied
+    """
+    if copy_format not in ["binary", "csv"]:
+        raise ValueError(f"copy_format must be 'binary' or 'csv', not '{copy_format}'")
+
+    columns = ", ".join(quote_identifier(column) for column, _ in column_types)
+    copy_query = f"COPY {quote_identifier(table_name)} ({columns}) FROM STDIN WITH (FORMAT {copy_format})"
+
+    row_counter = [0]
+    stream = IteratorFile(iterate_encoded_chunks(frames, column_types, copy_format, row_counter))
+    cursor.copy_expert(copy_query, stream, size=1024 * 1024)
+
+    return row_counter[0]
+
+
+def prepare_frame_for_copy(
+        frame: pd.DataFrame,
+        index: bool = True,
+        index_label: str = None,
+        sql_types: dict = None
+) -> tuple:
+    """
+    Move the ``DataFrame`` index into columns (if it's being written) and work out the SQL type of every column.
+
+    :param frame: ``pandas.DataFrame``
+    :param index: write the ``DataFrame`` index as a column
+    :param index_label: name for the index column. Defaults to the index name, or ``'index'``
+    :param sql_types: optional dict of SQL types keyed on column name, overriding the inferred types
+    :return: tuple of (frame, list of ``(column, sql_type)`` tuples, list of index columns)
+    """
+    index_columns = []
+    if index:
+        n_levels = frame.index.nlevels
+        if index_label:
+            frame = frame.rename_axis(index_label)
+        frame = frame.reset_index()
+        index_columns = list(frame.columns[:n_levels])
+
+    return frame, frame_sql_types(frame, sql_types), index_columns
+
+
+def create_table_statements(
+        table_name: str,
+        column_types: list,
+        index_columns: list = None
+) -> list:
+    """
+    SQL to create a table, plus the ``ix_{table}_{column}`` indexes that ``DataFrame.to_sql()`` puts on index columns.
+
+    :param table_name: 'name_of_the_table'
+    :param column_types: list of ``(column, sql_type)`` tuples
+    :param index_columns: list of columns to index
+    :return: list of SQL statements
+    """
+    statements = [create_table_sql(table_name, column_types)]
+
+    for column in index_columns or []:
+        index_name = quote_identifier(f"ix_{table_name}_{column}")
+        statements.append(f"CREATE INDEX {index_name} ON {quote_identifier(table_name)} ({quote_identifier(column)});")
+
+    return statements
+
+
+def table_column_types_sql(table_name: str) -> str:
+    """ SQL that lists the columns of an existing table with their ``format_type()`` names, as (column, type) rows """
+    table_literal = quote_identifier(table_name).replace("'", "''")
+
+    return f"""
+        SELECT attname, format_type(atttypid, atttypmod)
+        FROM pg_attribute
+        WHERE attrelid = to_regclass('{table_literal}') AND attnum > 0 AND NOT attisdropped
+        ORDER BY attnum"""
+
+
+def _encoder_type(pg_type: str) -> Union[str, None]:
+    """
+    The name the encoders use for a column type from ``format_type()``, e.g. 'bigint' -> 'BIGINT',
+    or ``None`` if rows can't be encoded for it.
+    """
+    if pg_type.lower().startswith("geometry"):
+        return pg_type
+
+    base_type = re.sub(r"\(\d+(,\d+)?\)", "", pg_type).upper()
+
+    if base_type in _FIXED_WIDTH_TYPES or base_type in ["TEXT", "BYTEA"]:
+        return base_type
+
+    # varchar and char take the same binary input as text
+    if base_type in ["CHARACTER VARYING", "CHARACTER"]:
+        return "TEXT"
+
+    return None
+
+
+def match_table_column_types(
+        column_types: list,
+        table_types: list,
+        table_name: str
+) -> list:
+    """
+    Swap the types inferred from a chunk of rows for the types of the table they're being appended to,
+    so every chunk is encoded the way the table expects no matter how its dtypes came out.
+
+    :param column_types: list of ``(column, sql_type)`` tuples inferred from the rows
+    :param table_types: list of ``(column, format_type)`` rows from ``table_column_types_sql()``
+    :param table_name: 'name_of_the_table', for error messages
+    :return: list of ``(column, sql_type)`` tuples
+    """
+    table_types = dict(table_types)
+    matched = []
+
+    for column, _ in column_types:
+        if column not in table_types:
+            raise ValueError(f"{table_name} has no column named {column}")
+
+        sql_type = _encoder_type(table_types[column])
+        if sql_type is None:
+            raise ValueError(f"Can't COPY rows into {table_name}.{column}, which is {table_types[column]}")
+
+        matched.append((column, sql_type))
+
+    return matched
+
+
+def write_dataframe(
+        frame: pd.DataFrame,
+        table_name: str,
+        uri: str,
+        if_exists: str = "replace",
+        index: bool = True,
+        index_label: str = None,
+        sql_types: dict = None,
+        copy_format: str = "binary",
+        chunksize: int = DEFAULT_CHUNKSIZE,
+        debug: bool = False
+) -> int:
+    """
+    Write a ``pandas.DataFrame`` to PostgreSQL with ``COPY``.
+    The resulting table matches what ``DataFrame.to_sql()`` would have made,
+    including the indexed column that holds the ``DataFrame`` index.
+
+    :param frame: ``pandas.DataFrame``
+    :param table_name: 'name_of_the_table'
+    :param uri: connection string
+    :param if_exists: ``'replace'`` drops and recreates the table, ``'append'`` adds rows to it (creating it if needed)
+    :param index: write the ``DataFrame`` index as a column
+    :param index_label: name for the index column. Defaults to the index name, or ``'index'``
+    :param sql_types: optional dict of SQL types keyed on column name, overriding the inferred types
+    :param copy_format: ``'binary'`` or ``'csv'``
+    :param chunksize: number of rows encoded and sent at a time
+    :return: number of rows written
+    """
+    start_time = time.time()
+
+    if if_exists not in ["replace", "append"]:
+        raise ValueError(f"if_exists must be 'replace' or 'append', not '{if_exists}'")
+
+    frame, column_types, index_columns = prepare_frame_for_copy(frame, index=index, index_label=index_label,
+                                                                sql_types=sql_types)
+
+    with get_connection(uri) as connection:
+        cursor = connection.cursor()
+
+        if if_exists == "replace":
+            cursor.execute(f"DROP TABLE IF EXISTS {quote_identifier(table_name)};")
+
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (quote_identifier(table_name), ))
+        table_exists = cursor.fetchone()[0]
+
+        if not table_exists:
+            for query in create_table_statements(table_name, column_types, index_columns):
+                cursor.execute(query)
+        else:
+            cursor.execute(table_column_types_sql(table_name))
+            column_types = match_table_column_types(column_types, cursor.fetchall(), table_name)
+
+        n_rows = copy_frames_to_table(iterate_chunks(frame, chunksize), table_name, column_types, cursor,
+                                      copy_format=copy_format)
+
+        cursor.close()
+
+    invalidate_catalog(uri)
+
+    if debug:
+        runtime = round(time.time() - start_time, 2)
+        rate = int(n_rows / runtime) if runtime else n_rows
+        print(f"## COPY {n_rows} rows into {table_name} in {runtime} seconds ({rate} rows/sec)")
+
+    return n_rows
+
+
+################################################################################
+# COPY STRAIGHT FROM ONE DATABASE INTO ANOTHER
+################################################################################
+
+
+class CopyPipe(io.RawIOBase):
+    """
+    Bounded, thread-safe pipe between ``COPY ... TO STDOUT`` on one connection
+    and ``COPY ... FROM STDIN`` on another.
+
+    The source side calls ``write()`` (from a background thread) and the destination side calls ``read()``.
+    Data is passed along in blocks of about ``block_size`` bytes, and the writer waits whenever
+    ``max_blocks`` blocks are queued up, so memory use is capped no matter how big the table is.
+    """
+
+    def __init__(
+            self,
+            block_size: int = COPY_PIPE_BLOCK_BYTES,
+            max_blocks: int = COPY_PIPE_MAX_BLOCKS
+    ):
+        self.block_size = block_size
+        self.bytes_transferred = 0
+
+        self._queue = queue.Queue(maxsize=max_blocks)
+        self._pending = bytearray()  # written, but not a full block yet
+        self._buffer = b""  # taken off the queue, but not read yet
+        self._finished = False
+        self._aborted = False
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def _put(self, item):
+        # Wait for room in the queue, unless the reader has given up
+        while True:
+            if self._aborted:
+                raise IOError("The destination stopped reading from the COPY pipe")
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def write(self, data):
+        self._pending += data
+
+        if len(self._pending) >= self.block_size:
+            self._put(bytes(self._pending))
+            self._pending = bytearray()
+
+        return len(data)
+
+    def finish(self, error: BaseException = None):
+        """ Called by the writer when it's done. If it failed, the reader raises ``error``. """
+        try:
+            if error is None and self._pending:
+                self._put(bytes(self._pending))
+            self._put(error)
+        except IOError:
+            pass
+
+        self._pending = bytearray()
+
+    def abort(self):
+        """ Called by the reader if it fails, so the writer stops instead of waiting forever. """
+        self._aborted = True
+
+    def read(self, size=-1):
+        while not self._buffer and not self._finished:
+            item = self._queue.get()
+
+            if isinstance(item, BaseException):
+                self._finished = True
+                raise item
+            elif item is None:
+                self._finished = True
+            else:
+                self._buffer = item
+
+        if size is None or size < 0:
+            size = len(self._buffer)
+
+        result, self._buffer = self._buffer[:size], self._buffer[size:]
+        self.bytes_transferred += len(result)
+        return result
+
+
+def copy_between_databases(
+        source_query: str,
+        source_uri: str,
+        table_name: str,
+        destination_uri: str,
+        columns: list,
+        setup_statements: list = None,
+        finish_statements: list = None,
+        copy_format: str = "binary",
+        debug: bool = False
+) -> int:
+    """
+    Pipe the result of a query on one database straight into a table on another.
+
+    ``COPY (<source_query>) TO STDOUT`` runs on a pooled source connection in a background thread,
+    and its output is fed through a ``CopyPipe`` into ``COPY <table_name> FROM STDIN``
+    on the destination. Rows are never parsed or held in Python.
+
+    With ``copy_format='binary'`` the destination columns must have exactly the types the query returns.
+
+    :param source_query: 'SELECT a, b, geom FROM my_table'
+    :param source_uri: connection string for the source database
+    :param table_name: name of the destination table
+    :param destination_uri: connection string for the destination database
+    :param columns: destination column names, in the same order as the query's columns
+    :param setup_statements: SQL to run on the destination first, in the same transaction (e.g. to create the table)
+    :param finish_statements: SQL to run on the destination once the rows have landed (e.g. to build indexes)
+    :param copy_format: ``'binary'``, ``'csv'`` or ``'text'``
+    :return: number of rows copied
+    """
+    start_time = time.time()
+
+    pipe = CopyPipe()
+
+    def read_from_source():
+        try:
+            with get_connection(source_uri) as source_connection:
+                source_cursor = source_connection.cursor()
+                source_cursor.copy_expert(f"COPY ({source_query}) TO STDOUT WITH (FORMAT {copy_format})", pipe)
+                source_cursor.close()
+        except BaseException as error:
+            pipe.finish(error)
+        else:
+            pipe.finish()
+
+    quoted_columns = ", ".join(quote_identifier(column) for column in columns)
+    copy_query = f"COPY {quote_identifier(table_name)} ({quoted_columns}) FROM STDIN WITH (FORMAT {copy_format})"
+
+    with get_connection(destination_uri) as connection:
+        cursor = connection.cursor()
+
+        for query in setup_statements or []:
+            cursor.execute(query)
+
+        reader = threading.Thread(target=read_from_source, name=f"pgis-copy-{table_name}", daemon=True)
+        reader.start()
+
+        try:
+            cursor.copy_expert(copy_query, pipe, size=pipe.block_size)
+        except BaseException:
+            pipe.abort()
+            raise
+        finally:
+            reader.join()
+
+        n_rows = cursor.rowcount
+
+        # Indexes are much cheaper to build in one go than to keep up to date row by row
+        for query in finish_statements or []:
+            cursor.execute(query)
+
+        cursor.close()
+
+    invalidate_catalog(destination_uri)
+
+    if debug:
+        runtime = round(time.time() - start_time, 2)
+        rate = int(n_rows / runtime) if runtime else n_rows
+        megabytes = round(pipe.bytes_transferred / 1024 / 1024, 1)
+        print(f"## COPY {n_rows} rows ({megabytes} MB) into {table_name} in {runtime} seconds ({rate} rows/sec)")
+
+    return n_rows
+
+
+################################################################################
+# STREAM CSV FILES STRAIGHT INTO THE DATABASE
+################################################################################
+
+
+def sanitize_column_names(columns: list) -> list:
+    """
+    Clean up column names so they're easy to use in SQL.
+    Duplicates and blank names are handled the way ``pandas.read_csv()`` does.
+
+    - 'Column Name' becomes 'column_name'
+    - 'geo.display-label' becomes 'geodisplaylabel'
+
+    :param columns: list of column names
+    :return: list of column names
+    """
+    seen = {}
+    unique_columns = []
+
+    for i, column in enumerate(columns):
+        column = str(column) if column not in [None, ""] else f"Unnamed: {i}"
+
+        # Repeated names get a '.1', '.2', etc. suffix
+        if column in seen:
+            seen[column] += 1
+            column = f"{column}.{seen[column]}"
+        else:
+            seen[column] = 0
+
+        unique_columns.append(column)
+
+    clean_columns = []
+    for column in unique_columns:
+        column = column.replace(' ', '_').lower()
+
+        for character in ['.', '-', '(', ')', '+']:
+            column = column.replace(character, '')
+
+        clean_columns.append(column)
+
+    return clean_columns
+
+
+def open_csv_file(csv_filepath: str):
+    """
+    Open a CSV file for reading raw bytes, unpacking ``.gz`` and ``.zip`` files on the fly.
+
+    :param csv_filepath: path to a .csv, .csv.gz or .zip file
+    :return: binary file object
+    """
+    with open(csv_filepath, "rb") as raw_file:
+        magic = raw_file.read(4)
+
+    if magic[:2] == b"\x1f\x8b":
+        return gzip.open(csv_filepath, "rb")
+
+    if magic == b"PK\x03\x04":
+        archive = zipfile.ZipFile(csv_filepath)
+        members = [name for name in archive.namelist() if not name.endswith("/")]
+        csv_members = [name for name in members if name.lower().endswith(".csv")] or members
+        return archive.open(csv_members[0])
+
+    return open(csv_filepath, "rb")
+
+
+_INTEGER_PATTERN = re.compile(r"^[+-]?\d+$")
+_FLOAT_PATTERN = re.compile(r"^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$|^[+-]?(inf|nan)$", re.IGNORECASE)
+_BOOLEAN_VALUES = {"true", "false"}
+
+
+def _sql_type_for_csv_values(values: list) -> str:
+    """ Pick the narrowest SQL type that can hold every non-blank value in a sample. """
+    values = [v for v in values if v != ""]
+
+    if not values:
+        return "TEXT"
+    if all(_INTEGER_PATTERN.match(v) for v in values):
+        return "BIGINT"
+    if all(_FLOAT_PATTERN.match(v) for v in values):
+        return "DOUBLE PRECISION"
+    if all(v.lower() in _BOOLEAN_VALUES for v in values):
+        return "BOOLEAN"
+
+    return "TEXT"
+
+
+def sniff_csv(
+        csv_filepath: str,
+        delimiter: str = ",",
+        sample_size: int = CSV_SAMPLE_BYTES,
+        infer_types: bool = True
+) -> dict:
+    """
+    Read the start of a CSV file to get its encoding, header and column types.
+
+    The encoding is ``UTF8`` if the sample decodes cleanly, otherwise ``LATIN1`` (ISO-8859-1).
+    Column types are inferred from the rows in the sample. Values further into the file
+    that don't fit will make the ``COPY`` fail, so pass ``infer_types=False`` to load everything as ``TEXT``.
+
+    :param csv_filepath: path to a .csv, .csv.gz or .zip file
+    :param delimiter: column separator
+    :param sample_size: number of bytes to read
+    :param infer_types: pick column types from the sample, instead of using ``TEXT`` for everything
+    :return: dict with keys ``encoding``, ``columns`` (the raw header) and ``column_types`` (sanitized names and types)
+    """
+    with open_csv_file(csv_filepath) as csv_file:
+        sample = csv_file.read(sample_size)
+        reached_end = len(csv_file.read(1)) == 0
+
+    # Decode incrementally so a multi-byte character cut off at the end of the sample doesn't count as an error
+    try:
+        text = codecs.getincrementaldecoder("utf-8-sig")().decode(sample, final=reached_end)
+        encoding = "UTF8"
+    except UnicodeDecodeError:
+        text = sample.decode("ISO-8859-1")
+        encoding = "LATIN1"
+
+    # Only use complete lines
+    lines = text.splitlines(keepends=True)
+    if not reached_end and len(lines) > 1:
+        lines = lines[:-1]
+
+    rows = list(csv.reader(lines, delimiter=delimiter))
+    header, sample_rows = rows[0], rows[1:]
+
+    columns = sanitize_column_names(header)
+
+    column_types = []
+    for i, column in enumerate(columns):
+        if infer_types:
+            values = [row[i] for row in sample_rows if i < len(row)]
+            column_types.append((column, _sql_type_for_csv_values(values)))
+        else:
+            column_types.append((column, "TEXT"))
+
+    return {"encoding": encoding, "columns": header, "column_types": column_types}
+
+
+def csv_table_statements(
+        table_name: str,
+        column_types: list
+) -> list:
+    """
+    SQL to create the table for a CSV file, with an indexed identity column
+    that numbers the rows from zero like the index written by ``DataFrame.to_sql()``.
+
+    :param table_name: 'name_of_the_table'
+    :param column_types: list of ``(column, sql_type)`` tuples from ``sniff_csv()``
+    :return: list of SQL statements
+    """
+    index_column = "level_0" if "index" in [column for column, _ in column_types] else "index"
+    index_type = "BIGINT GENERATED BY DEFAULT AS IDENTITY (MINVALUE 0 START WITH 0)"
+
+    return create_table_statements(table_name, [(index_column, index_type)] + column_types, [index_column])
+
+
+def copy_csv_file(
+        csv_filepath: str,
+        table_name: str,
+        uri: str,
+        delimiter: str = ",",
+        infer_types: bool = True,
+        block_size: int = CSV_BLOCK_BYTES,
+        debug: bool = False,
+        encoding: str = None
+) -> int:
+    """
+    Load a CSV file into a new table by piping the file through ``COPY ... FROM STDIN``.
+
+    The file is never parsed in Python: its bytes are sent to the server a block at a time,
+    so memory use stays flat and the load runs as fast as the file can be read.
+    The table gets the same sanitized column names as ``csv_to_postgis()`` has always used,
+    plus the indexed ``index`` column that ``DataFrame.to_sql()`` would have added.
+
+    If a character later in the file isn't valid ``UTF8``, the file is loaded again as ``LATIN1``.
+    If a value later in the file doesn't fit a type inferred from the sample,
+    the table is rebuilt with ``TEXT`` columns and the file is loaded again.
+
+    :param csv_filepath: path to a .csv, .csv.gz or .zip file
+    :param table_name: name of the table to create
+    :param uri: connection string
+    :param delimiter: column separator
+    :param infer_types: pick column types from a sample of the file, instead of using ``TEXT`` for everything
+    :param block_size: number of bytes sent to the server at a time
+    :param encoding: ``'UTF8'`` or ``'LATIN1'``, instead of guessing from the start of the file
+    :return: number of rows loaded
+    """
+    start_time = time.time()
+
+    csv_info = sniff_csv(csv_filepath, delimiter=delimiter, infer_types=infer_types)
+    column_types = csv_info["column_types"]
+
+    if encoding:
+        csv_info["encoding"] = encoding
+
+    if debug:
+        print(f"## Streaming {csv_filepath} into {table_name} as {csv_info['encoding']}")
+        print(f"## -> {column_types}")
+
+    quoted_table = quote_identifier(table_name)
+    columns = ", ".join(quote_identifier(column) for column, _ in column_types)
+
+    copy_query = f"""
+        COPY {quoted_table} ({columns}) FROM STDIN
+        WITH (FORMAT csv, HEADER true, DELIMITER '{delimiter}', ENCODING '{csv_info["encoding"]}')"""
+
+    try:
+        with get_connection(uri) as connection:
+            cursor = connection.cursor()
+
+            cursor.execute(f"DROP TABLE IF EXISTS {quoted_table};")
+            for query in csv_table_statements(table_name, column_types):
+                cursor.execute(query)
+
+            with open_csv_file(csv_filepath) as csv_file:
+                cursor.copy_expert(copy_query, csv_file, size=block_size)
+
+            n_rows = cursor.rowcount
+            cursor.close()
+
+        invalidate_catalog(uri)
+
+    except CSV_ENCODING_ERRORS as error:
+        if csv_info["encoding"] == "LATIN1":
+            raise
+
+        print(f"## -> {error}")
+        print("## -> Retrying as LATIN1")
+
+        return copy_csv_file(csv_filepath, table_name, uri, delimiter=delimiter, infer_types=infer_types,
+                             block_size=block_size, debug=debug, encoding="LATIN1")
+
+    except psycopg2.DataError as error:
+        if not infer_types:
+            raise
+
+        print(f"## -> {error}")
+        print("## -> Retrying with TEXT columns")
+
+        return copy_csv_file(csv_filepath, table_name, uri, delimiter=delimiter, infer_types=False,
+                             block_size=block_size, debug=debug, encoding=csv_info["encoding"])
+
+    if debug:
+        runtime = round(time.time() - start_time, 2)
+        rate = int(n_rows / runtime) if runtime else n_rows
+        print(f"## COPY {n_rows} rows into {table_name} in {runtime} seconds ({rate} rows/sec)")
+
+    return n_rows
+
+
+################################################################################
+# ENCODE ARROW DATA
+################################################################################
+
+
+def arrow_sql_type(arrow_type) -> str:
+    """
+    Pick the PostgreSQL type for an Arrow column, matching the choices ``sql_type_for_series()`` makes for ``pandas``.
+
+    :param arrow_type: ``pyarrow.DataType``
+    :return: SQL type as ``str``, e.g. ``'BIGINT'``
+    """
+    import pyarrow as pa
+
+    types = pa.types
+
+    if types.is_dictionary(arrow_type):
+        return arrow_sql_type(arrow_type.value_type)
+
+    if types.is_boolean(arrow_type):
+        return "BOOLEAN"
+
+    if types.is_int8(arrow_type) or types.is_int16(arrow_type) or types.is_uint8(arrow_type):
+        return "SMALLINT"
+
+    if types.is_int32(arrow_type) or types.is_uint16(arrow_type):
+        return "INTEGER"
+
+    if types.is_integer(arrow_type):
+        return "BIGINT"
+
+    if types.is_float16(arrow_type) or types.is_float32(arrow_type):
+        return "REAL"
+
+    if types.is_floating(arrow_type) or types.is_decimal(arrow_type):
+        return "DOUBLE PRECISION"
+
+    if types.is_timestamp(arrow_type):
+        return "TIMESTAMP WITH TIME ZONE" if arrow_type.tz else "TIMESTAMP WITHOUT TIME ZONE"
+
+    if types.is_date(arrow_type):
+        return "DATE"
+
+    if types.is_time(arrow_type):
+        return "TIME WITHOUT TIME ZONE"
+
+    if types.is_duration(arrow_type):
+        return "BIGINT"
+
+    if types.is_binary(arrow_type) or types.is_large_binary(arrow_type) or types.is_fixed_size_binary(arrow_type):
+        return "BYTEA"
+
+    return "TEXT"
+
+
+def _arrow_null_mask(array) -> np.ndarray:
+    if array.null_count == 0:
+        return np.zeros(len(array), dtype=bool)
+
+    return array.is_null().to_numpy(zero_copy_only=False)
+
+
+def _arrow_fixed_width_values(
+        array,
+        sql_type: str
+) -> np.ndarray:
+    """ Convert a fixed-width Arrow column to big-endian values, with NULLs zero-filled """
+    import pyarrow as pa
+
+    arrow_type = array.type
+
+    if pa.types.is_boolean(arrow_type):
+        values = array.fill_null(False).to_numpy(zero_copy_only=False)
+
+    elif pa.types.is_timestamp(arrow_type):
+        micros = array.cast(pa.timestamp("us", tz=arrow_type.tz), safe=False).cast(pa.int64())
+        values = micros.fill_null(0).to_numpy() - PG_EPOCH_MICROSECONDS
+
+    elif pa.types.is_date(arrow_type):
+        values = array.cast(pa.date32()).cast(pa.int32()).fill_null(0).to_numpy() - PG_EPOCH_DAYS
+
+    elif pa.types.is_time(arrow_type):
+        values = array.cast(pa.time64("us"), safe=False).cast(pa.int64()).fill_null(0).to_numpy()
+
+    elif pa.types.is_duration(arrow_type):
+        values = array.cast(pa.int64()).fill_null(0).to_numpy()
+
+    elif pa.types.is_decimal(arrow_type):
+        values = array.cast(pa.float64()).fill_null(0).to_numpy()
+
+    else:
+        values = array.fill_null(0).to_numpy()
+
+    return np.asarray(values).astype(_FIXED_WIDTH_TYPES[sql_type])
+
+
+def _arrow_variable_width_values(
+        array,
+        mask: np.ndarray
+) -> tuple:
+    """
+    Get the bytes of a string or binary Arrow column straight from its buffers.
+
+    :return: tuple of (data, source_starts, lengths) for the non-null values
+    """
+    import pyarrow as pa
+
+    arrow_type = array.type
+    types = pa.types
+
+    if types.is_fixed_size_binary(arrow_type) or not (types.is_string(arrow_type) or types.is_binary(arrow_type)
+                                                      or types.is_large_string(arrow_type)
+                                                      or types.is_large_binary(arrow_type)):
+        binary_like = types.is_fixed_size_binary(arrow_type) or "binary" in str(arrow_type)
+        array = array.cast(pa.large_binary() if binary_like else pa.large_string())
+        arrow_type = array.type
+
+    offset_dtype = np.int64 if types.is_large_string(arrow_type) or types.is_large_binary(arrow_type) else np.int32
+
+    _, offset_buffer, data_buffer = array.buffers()
+    offsets = np.frombuffer(offset_buffer, dtype=offset_dtype)[array.offset:array.offset + len(array) + 1]
+    offsets = offsets.astype(np.int64)
+
+    data = np.frombuffer(data_buffer, dtype=np.uint8) if data_buffer is not None else np.zeros(0, dtype=np.uint8)
+
+    starts = offsets[:-1][~mask]
+    lengths = (offsets[1:] - offsets[:-1])[~mask]
+
+    return data, starts, lengths
+
+
+def wkb_to_ewkb(
+        data: np.ndarray,
+        source_starts: np.ndarray,
+        lengths: np.ndarray,
+        srid: int
+) -> tuple:
+    """
+    Turn WKB geometries into EWKB by setting the SRID flag in each type word
+    and inserting the 4-byte SRID after it.
+
+    :param data: ``uint8`` array holding the WKB values
+    :param source_starts: where each geometry starts in ``data``
+    :param lengths: number of bytes in each geometry
+    :param srid: EPSG code to embed in each geometry
+    :return: tuple of (data, source_starts, lengths) for the EWKB values
+    """
+    lengths = lengths.astype(np.int64)
+    new_lengths = lengths + 4
+    new_starts = np.cumsum(new_lengths) - new_lengths
+
+    out = np.zeros(int(new_lengths.sum()), dtype=np.uint8)
+    out_view = memoryview(out)
+    data_view = memoryview(data)
+
+    # Copy each geometry across in two slices, leaving a 4-byte gap after the byte-order mark and type word
+    for destination, start, length in zip(new_starts.tolist(), source_starts.tolist(), lengths.tolist()):
+        out_view[destination:destination + 5] = data_view[start:start + 5]
+        out_view[destination + 9:destination + length + 4] = data_view[start + 5:start + length]
+
+    # The SRID flag (0x20000000) lands in the type word's high byte, which depends on the byte order
+    little_endian = data[source_starts] == 1
+    out[new_starts + np.where(little_endian, 4, 1)] |= 0x20
+
+    srid_bytes = np.where(little_endian[:, None],
+                          np.frombuffer(struct.pack("<I", srid), dtype=np.uint8),
+                          np.frombuffer(struct.pack(">I", srid), dtype=np.uint8))
+    out[(new_starts + 5)[:, None] + np.arange(4)] = srid_bytes
+
+    return out, new_starts, new_lengths
+
+
+def encode_arrow_batch(
+        batch,
+        column_types: list,
+        geometry_srids: dict = None
+) -> bytes:
+    """
+    Encode an Arrow record batch in PostgreSQL's binary ``COPY`` format (without the file header or trailer).
+
+    Values are read straight from the Arrow buffers, never as Python objects.
+    WKB geometry columns listed in ``geometry_srids`` get their SRID embedded on the way through.
+
+    :param batch: ``pyarrow.RecordBatch``
+    :param column_types: list of ``(column, sql_type)`` tuples, naming columns in the batch
+    :param geometry_srids: dict of geometry column -> SRID
+    :return: ``bytes``
+    """
+    import pyarrow as pa
+
+    geometry_srids = geometry_srids or {}
+    n_rows = batch.num_rows
+
+    fields = []
+    lengths = np.zeros((n_rows, len(column_types)), dtype=np.int64)
+
+    for i, (column, sql_type) in enumerate(column_types):
+        array = batch.column(batch.schema.get_field_index(column))
+        if pa.types.is_dictionary(array.type):
+            array = array.dictionary_decode()
+
+        mask = _arrow_null_mask(array)
+
+        if sql_type in _FIXED_WIDTH_TYPES:
+            values = _arrow_fixed_width_values(array, sql_type)
+            lengths[:, i] = np.where(mask, -1, values.dtype.itemsize)
+            fields.append(("fixed", values, mask))
+        else:
+            data, source_starts, valid_lengths = _arrow_variable_width_values(array, mask)
+
+            if geometry_srids.get(column):
+                data, source_starts, valid_lengths = wkb_to_ewkb(data, source_starts, valid_lengths,
+                                                                 geometry_srids[column])
+
+            lengths[:, i] = -1
+            lengths[~mask, i] = valid_lengths
+            fields.append(("variable", (data, source_starts), mask))
+
+    return _assemble_binary_rows(lengths, fields)
+
+
+def geoparquet_metadata(schema) -> dict:
+    """
+    Read the geometry columns, with their type and SRID, from the GeoParquet ``geo`` metadata on an Arrow schema.
+
+    A column with no ``crs`` is OGC:CRS84 (longitude/latitude, so SRID 4326), one with a ``null`` CRS has SRID 0.
+    Columns holding more than one kind of geometry (or that don't say) are typed ``GEOMETRY``.
+
+    :param schema: ``pyarrow.Schema``
+    :return: dict of column -> {type, srid}, with the primary geometry column first. Empty if there's no metadata.
+    """
+    raw = (schema.metadata or {}).get(b"geo")
+    if raw is None:
+        return {}
+
+    import json
+    import pyproj
+
+    geo = json.loads(raw)
+    primary_column = geo.get("primary_column")
+    names = sorted(geo["columns"], key=lambda name: name != primary_column)
+
+    geometry_columns = {}
+    for column in names:
+        info = geo["columns"][column]
+
+        encoding = info.get("encoding", "WKB")
+        if encoding.upper() != "WKB":
+            raise ValueError(f"Only WKB geometry columns can be loaded, but {column} is encoded as '{encoding}'")
+
+        if "crs" not in info:
+            srid = 4326
+        elif info["crs"] is None:
+            srid = 0
+        else:
+            crs = info["crs"]
+            crs = pyproj.CRS.from_json_dict(crs) if isinstance(crs, dict) else pyproj.CRS.from_user_input(crs)
+            srid = crs.to_epsg() or (4326 if crs.equals("OGC:CRS84") else 0)
+
+        geometry_types = {geometry_type.replace(" ", "").upper() for geometry_type in info.get("geometry_types", [])}
+        geom_type = geometry_types.pop() if len(geometry_types) == 1 else "GEOMETRY"
+
+        geometry_columns[column] = {"type": geom_type, "srid": srid}
+
+    return geometry_columns
+
+
+def copy_encoded_rows(
+        encoded_chunks,
+        table_name: str,
+        uri: str,
+        column_types: list,
+        index_columns: list = None
+) -> int:
+    """
+    Replace a table and fill it with a single binary ``COPY`` of rows that are already encoded,
+    building the ``index_columns`` indexes after the load.
+
+    :param encoded_chunks: iterable of ``bytes`` from ``encode_binary_rows()`` or ``encode_arrow_batch()``
+    :param table_name: 'name_of_the_table'
+    :param uri: connection string
+    :param column_types: list of ``(column, sql_type)`` tuples, in the order they were encoded
+    :param index_columns: list of columns to index
+    :return: number of rows copied
+    """
+    create_table, *create_indexes = create_table_statements(table_name, column_types, index_columns)
+
+    columns = ", ".join(quote_identifier(column) for column, _ in column_types)
+    copy_query = f"COPY {quote_identifier(table_name)} ({columns}) FROM STDIN WITH (FORMAT binary)"
+
+    def stream():
+        yield BINARY_HEADER
+        yield from encoded_chunks
+        yield BINARY_TRAILER
+
+    with get_connection(uri) as connection:
+        cursor = connection.cursor()
+
+        cursor.execute(f"DROP TABLE IF EXISTS {quote_identifier(table_name)};")
+        cursor.execute(create_table)
+
+        cursor.copy_expert(copy_query, IteratorFile(stream()), size=1024 * 1024)
+        n_rows = cursor.rowcount
+
+        for query in create_indexes:
+            cursor.execute(query)
+
+        cursor.close()
+
+    invalidate_catalog(uri)
+
+    return n_rows
+
+
+if __name__ == "__main__":
+    pass
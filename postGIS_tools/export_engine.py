@@ -0,0 +1,337 @@
+"""
+Overview of ``export_engine.py``
+--------------------------------
+
+Stream a PostGIS table or query out to a GeoPackage, FlatGeobuf or GeoParquet file.
+
+Rows are read ``chunksize`` at a time from a server-side cursor and appended to a single
+open file, so memory use depends on the chunk size and not on the size of the table.
+Unlike shapefiles, these formats have no 2 GB limit, keep full-length column names,
+and store booleans as booleans.
+
+- GeoPackage and FlatGeobuf are written through GDAL (``pyogrio`` if it's installed, otherwise ``fiona``).
+  GDAL builds their spatial index in one pass when the file is closed.
+- GeoParquet is written with ``pyarrow``, one row group per chunk, with a ``bbox`` covering column
+  so readers can skip row groups that fall outside an area of interest.
+
+Examples
+--------
+
+    >>> from postGIS_tools.export_engine import postgis_to_file
+    >>> postgis_to_file("parcels", "/data/parcels.gpkg", uri)
+    >>> postgis_to_file("SELECT * FROM parcels WHERE acres > 10", "/data/big_parcels.fgb", uri)
+    >>> postgis_to_file("parcels", "/data/parcels.parquet", uri, driver="GeoParquet")
+
+"""
+import importlib.util
+import json
+import os
+import time
+from typing import Union
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+from postGIS_tools.catalog import get_catalog
+from postGIS_tools.copy_engine import DEFAULT_CHUNKSIZE
+from postGIS_tools.functions import query_geo_table
+from postGIS_tools.logs import log_activity
+
+# Drivers picked from the file extension when none is given
+EXPORT_DRIVERS = {
+    ".gpkg": "GPKG",
+    ".fgb": "FlatGeobuf",
+    ".parquet": "GeoParquet",
+    ".geoparquet": "GeoParquet",
+}
+
+GEOPARQUET_VERSION = "1.1.0"
+
+# PostGIS type names, as they come out of the catalog, mapped to the names used by OGR and GeoParquet
+_GEOMETRY_TYPE_NAMES = {name.upper(): name for name in ["Point", "LineString", "Polygon", "MultiPoint",
+                                                         "MultiLineString", "MultiPolygon", "GeometryCollection"]}
+
+
+def _query_for(table_or_query: str) -> str:
+    """ Treat anything that looks like SQL as a query, and anything else as a table name """
+    if len(table_or_query.split()) > 1:
+        return table_or_query
+
+    return f"SELECT * FROM {table_or_query}"
+
+
+def _declared_geometry_type(
+        table_or_query: str,
+        uri: str,
+        geom_col: str
+) -> Union[str, None]:
+    """ Get the geometry type of a table's typed geometry column, e.g. 'MultiPolygon' """
+    if len(table_or_query.split()) > 1:
+        return None
+
+    geom_info = get_catalog(uri).geometry_columns.get(table_or_query, {}).get(geom_col)
+    if geom_info is None:
+        return None
+
+    return _GEOMETRY_TYPE_NAMES.get(geom_info["type"])
+
+
+def _chunk_to_arrow(
+        gdf: gpd.GeoDataFrame,
+        geom_col: str,
+        with_bbox: bool = False
+):
+    """
+    Convert a chunk to a ``pyarrow.Table`` with the geometries as ISO WKB,
+    plus a ``bbox`` struct column of each geometry's extent if ``with_bbox`` is ``True``.
+    """
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(pd.DataFrame(gdf.drop(columns=geom_col)), preserve_index=False)
+
+    geometries = np.asarray(gdf[geom_col].values, dtype=object)
+    table = table.append_column(geom_col, pa.array(shapely.to_wkb(geometries, flavor="iso"), type=pa.binary()))
+
+    if with_bbox:
+        bounds = shapely.bounds(geometries)
+        table = table.append_column("bbox", pa.StructArray.from_arrays(
+            [pa.array(bounds[:, i]) for i in range(4)], names=["xmin", "ymin", "xmax", "ymax"]))
+
+    return table
+
+
+def _arrow_schema(first_table):
+    """ Columns that are all NULL in the first chunk have no type yet, so make them strings """
+    import pyarrow as pa
+
+    return pa.schema([field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                      for field in first_table.schema])
+
+
+################################################################################
+# WRITERS
+################################################################################
+
+
+def _write_geoparquet(
+        chunks,
+        path: str,
+        geom_col: str,
+        geometry_type: str = None,
+        compression: str = "snappy"
+) -> int:
+    """ Write each chunk as a row group of a GeoParquet file """
+    import pyarrow.parquet as pq
+
+    writer = None
+    n_rows = 0
+
+    try:
+        for gdf in chunks:
+            table = _chunk_to_arrow(gdf, geom_col, with_bbox=True)
+
+            if writer is None:
+                geo_metadata = {
+                    "version": GEOPARQUET_VERSION,
+                    "primary_column": geom_col,
+                    "columns": {
+                        geom_col: {
+                            "encoding": "WKB",
+                            # An empty list means the types aren't known up front
+                            "geometry_types": [geometry_type] if geometry_type else [],
+                            "crs": gdf.crs.to_json_dict() if gdf.crs else None,
+                            "covering": {"bbox": {"xmin": ["bbox", "xmin"], "ymin": ["bbox", "ymin"],
+                                                  "xmax": ["bbox", "xmax"], "ymax": ["bbox", "ymax"]}},
+                        }
+                    },
+                }
+
+                schema = _arrow_schema(table).with_metadata({b"geo": json.dumps(geo_metadata).encode("utf-8")})
+                writer = pq.ParquetWriter(path, schema, compression=compression)
+
+            writer.write_table(table.cast(schema), row_group_size=max(len(table), 1))
+            n_rows += len(table)
+
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return n_rows
+
+
+def _write_with_pyogrio(
+        chunks,
+        path: str,
+        driver: str,
+        layer: str,
+        geom_col: str,
+        geometry_type: str,
+        spatial_index: bool
+) -> int:
+    """ Stream every chunk through one GDAL write session with ``pyogrio.write_arrow()`` """
+    import pyarrow as pa
+    import pyogrio
+
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None:
+        return 0
+
+    first_table = _chunk_to_arrow(first, geom_col)
+    schema = _arrow_schema(first_table)
+    n_rows = [0]
+
+    def batches():
+        n_rows[0] += len(first_table)
+        yield from first_table.cast(schema).to_batches()
+
+        for gdf in chunks:
+            table = _chunk_to_arrow(gdf, geom_col).cast(schema)
+            n_rows[0] += len(table)
+            yield from table.to_batches()
+
+    pyogrio.write_arrow(pa.RecordBatchReader.from_batches(schema, batches()),
+                        path,
+                        layer=layer,
+                        driver=driver,
+                        geometry_name=geom_col,
+                        geometry_type=geometry_type or "Unknown",
+                        crs=first.crs.to_wkt() if first.crs else None,
+                        layer_options={"SPATIAL_INDEX": "YES" if spatial_index else "NO"})
+
+    return n_rows[0]
+
+
+def _write_with_fiona(
+        chunks,
+        path: str,
+        driver: str,
+        layer: str,
+        geom_col: str,
+        geometry_type: str,
+        spatial_index: bool
+) -> int:
+    """ Stream every chunk through one ``fiona`` write session """
+    import fiona
+    from geopandas.io.file import infer_schema
+
+    sink = None
+    n_rows = 0
+
+    try:
+        for gdf in chunks:
+            if sink is None:
+                schema = infer_schema(gdf)
+                if geometry_type:
+                    schema["geometry"] = geometry_type
+
+                sink = fiona.open(path, "w", driver=driver, schema=schema, layer=layer,
+                                  crs_wkt=gdf.crs.to_wkt() if gdf.crs else None,
+                                  SPATIAL_INDEX="YES" if spatial_index else "NO")
+
+            sink.writerecords(gdf.iterfeatures(drop_id=True))
+            n_rows += len(gdf)
+
+    finally:
+        if sink is not None:
+            sink.close()
+
+    return n_rows
+
+
+def _gdal_writer():
+    """ Use ``pyogrio`` (0.8 or newer, with ``pyarrow``) to stream Arrow batches into GDAL, otherwise ``fiona`` """
+    if importlib.util.find_spec("pyarrow") is None:
+        return _write_with_fiona
+
+    try:
+        import pyogrio
+    except ImportError:
+        return _write_with_fiona
+
+    return _write_with_pyogrio if hasattr(pyogrio, "write_arrow") else _write_with_fiona
+
+
+################################################################################
+# EXPORT
+################################################################################
+
+
+def postgis_to_file(
+        table_or_query: str,
+        path: str,
+        uri: str,
+        driver: str = None,
+        layer: str = None,
+        geom_col: str = 'geom',
+        chunksize: int = DEFAULT_CHUNKSIZE,
+        spatial_index: bool = True,
+        compression: str = "snappy",
+        debug: bool = False
+) -> str:
+    """
+    Stream a spatial table or query into a GeoPackage, FlatGeobuf or GeoParquet file.
+
+    Rows are read ``chunksize`` at a time from a server-side cursor and appended to the file,
+    so the whole result is never in memory. Any existing file at ``path`` is replaced.
+
+    :param table_or_query: 'name_of_the_table', or a query like 'SELECT * FROM my_table WHERE ...'
+    :param path: output file, e.g. '/data/my_table.gpkg'
+    :param uri: connection string
+    :param driver: ``'GPKG'``, ``'FlatGeobuf'`` or ``'GeoParquet'``. Picked from the file extension if ``None``.
+                   Any other GDAL vector driver that can write in one pass also works.
+    :param layer: name of the layer, for GeoPackages. Defaults to the file name
+    :param geom_col: the name of the geometry column
+    :param chunksize: number of rows to hold in memory at once
+    :param spatial_index: build a spatial index, for formats that have one (GeoPackage and FlatGeobuf)
+    :param compression: Parquet compression codec, for GeoParquet
+    :return: path to the file
+    """
+    start_time = time.time()
+
+    if driver is None:
+        extension = os.path.splitext(path)[1].lower()
+        if extension not in EXPORT_DRIVERS:
+            raise ValueError(f"Can't tell which driver to use for '{extension}' files. Pass driver= explicitly.")
+        driver = EXPORT_DRIVERS[extension]
+
+    if layer is None:
+        layer = os.path.splitext(os.path.basename(path))[0]
+
+    if debug:
+        print(f'## Streaming {table_or_query} to {path} as {driver}')
+
+    geometry_type = _declared_geometry_type(table_or_query, uri, geom_col)
+
+    chunks = query_geo_table(_query_for(table_or_query), uri, geom_col=geom_col, chunksize=chunksize, debug=debug)
+
+    if os.path.exists(path):
+        os.remove(path)
+
+    if driver.lower() in ["geoparquet", "parquet"]:
+        n_rows = _write_geoparquet(chunks, path, geom_col, geometry_type=geometry_type, compression=compression)
+
+    else:
+        writer = _gdal_writer()
+        n_rows = writer(chunks, path, driver, layer, geom_col, geometry_type, spatial_index)
+
+    if n_rows == 0:
+        print(f'## -> {table_or_query} has no rows, so no file was written')
+
+    if debug:
+        runtime = round(time.time() - start_time, 2)
+        rate = int(n_rows / runtime) if runtime else n_rows
+        print(f'## -> Wrote {n_rows} rows in {runtime} seconds ({rate} rows/sec)')
+
+    log_activity("pGIS.postgis_to_file",
+                 uri=uri,
+                 query_text=f"Saved {driver} from {table_or_query} to {path}",
+                 debug=debug)
+
+    return path
+
+
+if __name__ == "__main__":
+    pass
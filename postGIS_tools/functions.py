@@ -1,20 +1,37 @@
+import collections
+import itertools
+import multiprocessing
 import os
 import sys
+import threading
 import time
-from datetime import datetime
-from typing import Union
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Union, Iterator
 
+import numpy as np
 import pandas as pd
 import geopandas as gpd
+import pyproj
+import shapely
 
-import psycopg2
-import sqlalchemy
 from geoalchemy2 import Geometry, WKTElement
 
 
 from postGIS_tools.configurations import THIS_SYSTEM, deconstruct_uri
+from postGIS_tools.connections import get_connection, get_engine, get_pool
+from postGIS_tools.catalog import get_catalog, invalidate_catalog
+from postGIS_tools.copy_engine import write_dataframe, is_postgres_uri, DEFAULT_CHUNKSIZE, \
+    geometry_to_ewkb, geometry_sql_type, copy_csv_file, sanitize_column_names, arrow_sql_type, \
+    encode_arrow_batch, geoparquet_metadata, copy_encoded_rows
 from postGIS_tools.queries.hexagon_grid import hex_grid_function
-from postGIS_tools.logs import log_activity
+from postGIS_tools.queries.spatial_table import sql_to_finalize_spatial_table, DEFAULT_MAINTENANCE_WORK_MEM, \
+    DEFAULT_PARALLEL_MAINTENANCE_WORKERS, sql_for_blocking_dependents, sql_for_integer_primary_key, \
+    sql_for_table_indexes, sql_for_owned_sequences, primary_key_ranges, sql_to_copy_reprojected_rows, \
+    sql_to_rebuild_index, sql_to_swap_in_shadow_table, sql_to_make_geotable, sql_for_foreign_keys, \
+    sql_to_add_foreign_key, sql_for_table_privileges
+from postGIS_tools.logs import log_activity, flush_logs
+from postGIS_tools.backup_engine import dump_database, restore_database
 
 ################################################################################
 # GET BASIC THINGS OUT OF THE DATABASE
@@ -40,14 +57,13 @@ def fetch_things_from_database(
         print(f'## Fetching ALL from {uri}')
         print(query)
 
-    connection = psycopg2.connect(uri)
-    cursor = connection.cursor()
+    with get_connection(uri) as connection:
+        cursor = connection.cursor()
 
-    cursor.execute(query)
-    result = cursor.fetchall()
+        cursor.execute(query)
+        result = cursor.fetchall()
 
-    cursor.close()
-    connection.close()
+        cursor.close()
 
     return result
 
@@ -58,23 +74,14 @@ def get_list_of_tables_in_db(
 ) -> list:
     """
     Return a list of all tables that exist in a given database.
+    Read from the cached catalog snapshot (see ``postGIS_tools.catalog``).
 
     :param uri: connection string
 
     :return: list of all tables in database
     """
 
-    # Get a list of all tables that are currently in the database
-    q = """SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'"""
-
-    tables = fetch_things_from_database(q, uri=uri, debug=debug)
-
-    tables_to_ignore = ['geography_columns', 'geometry_columns',
-                        'spatial_ref_sys', 'raster_columns', 'raster_overviews']
-
-    table_names = [t[0] for t in tables if t[0] not in tables_to_ignore]
-
-    return table_names
+    return get_catalog(uri, debug=debug).table_names()
 
 
 def get_full_list_of_tables_in_db(
@@ -95,14 +102,7 @@ def get_full_list_of_tables_in_db(
     :return: list of all tables in database
     """
 
-    # Get a list of all tables that are currently in the database
-    q = """SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'"""
-
-    tables = fetch_things_from_database(q, uri=uri, debug=debug)
-
-    table_names = [t[0] for t in tables]
-
-    return table_names
+    return get_catalog(uri, debug=debug).table_names(include_postgis_tables=True)
 
 
 def get_list_of_columns_in_table(
@@ -119,16 +119,7 @@ def get_list_of_columns_in_table(
     :return: list of columns
     """
 
-    q = """ SELECT column_name
-            FROM information_schema.columns
-            WHERE table_schema = 'public'
-            AND table_name = '{}' """.format(table)
-
-    raw_result = fetch_things_from_database(q, uri=uri, debug=debug)
-
-    result = [t[0] for t in raw_result]
-
-    return result
+    return get_catalog(uri, debug=debug).column_names(table)
 
 
 def get_list_of_spatial_tables_in_db(
@@ -143,14 +134,7 @@ def get_list_of_spatial_tables_in_db(
     :return: list of all spatial tables in database
     """
 
-    # Get a list of all tables that are currently in the database
-    q = """SELECT f_table_name AS tblname FROM geometry_columns"""
-
-    spatial_tables = fetch_things_from_database(q, uri=uri, debug=debug)
-
-    spatial_table_names = [t[0] for t in spatial_tables]
-
-    return spatial_table_names
+    return get_catalog(uri, debug=debug).spatial_tables()
 
 
 def get_database_list(
@@ -166,13 +150,7 @@ def get_database_list(
     """
 
     # Get a list of databases that aren't the default_db
-    q = f""" SELECT datname FROM pg_database
-            WHERE datistemplate = false
-                AND datname != '{default_db}'; """
-
-    # Run this query from within the default_db
-    query_result = fetch_things_from_database(q, uri=uri, debug=debug)
-    db_list = [x[0] for x in query_result]
+    db_list = [db for db in get_catalog(uri, debug=debug).databases if db != default_db]
 
     return db_list
 
@@ -231,18 +209,90 @@ def spatial_table_exists(
 ################################################################################
 
 
+def _iterate_query_chunks(
+        query: str,
+        uri: str,
+        chunksize: int
+):
+    """
+    Run a query through a named (server-side) cursor and yield the rows ``chunksize`` at a time.
+    Only one chunk of rows is ever held in client memory.
+
+    :param query: 'SELECT * FROM my_table'
+    :param uri: connection string
+    :param chunksize: number of rows per chunk
+    :return: yields tuples of (list of column names, list of row tuples, index of the first row)
+    """
+    with get_connection(uri) as connection:
+        cursor = connection.cursor(name=f"pgis_{uuid.uuid4().hex}")
+        cursor.itersize = chunksize
+        cursor.execute(query)
+
+        first_row = 0
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                break
+
+            columns = [column.name for column in cursor.description]
+            yield columns, rows, first_row
+
+            first_row += len(rows)
+
+        cursor.close()
+
+
+def _query_table_chunks(
+        query: str,
+        uri: str,
+        chunksize: int
+) -> Iterator[pd.DataFrame]:
+    for columns, rows, first_row in _iterate_query_chunks(query, uri, chunksize):
+        df = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+        df.index = pd.RangeIndex(first_row, first_row + len(df))
+        yield df
+
+
+def _query_geo_table_chunks(
+        query: str,
+        uri: str,
+        geom_col: str,
+        chunksize: int
+) -> Iterator[gpd.GeoDataFrame]:
+    crs = None
+
+    for df in _query_table_chunks(query, uri, chunksize):
+        # PostGIS hands geometries back as hex-encoded EWKB
+        geometries = shapely.from_wkb(df[geom_col].to_numpy(dtype=object))
+
+        # Take the CRS from the first chunk, the same way GeoDataFrame.from_postgis() does
+        if crs is None:
+            srids = shapely.get_srid(geometries[pd.notnull(geometries)])
+            if len(srids) and srids[0] != 0:
+                crs = f"epsg:{srids[0]}"
+
+        df[geom_col] = geometries
+        yield gpd.GeoDataFrame(df, geometry=geom_col, crs=crs)
+
+
 def query_table(
         query: str,
         uri: str,
-        debug: bool = False
-) -> pd.DataFrame:
+        debug: bool = False,
+        chunksize: int = None
+) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
     """
     Query a table in a database and get the result as a ``pandas.DataFrame``
 
+    If ``chunksize`` is provided, the query runs through a server-side cursor and you get
+    an iterator of ``DataFrames`` with at most ``chunksize`` rows each. The index keeps counting
+    up across chunks. Memory use then depends on the chunk size and not on the size of the result.
+
     :param query: 'SELECT * FROM my_table'
     :param uri: connection string
+    :param chunksize: number of rows per chunk, or ``None`` to get everything at once
 
-    :return: ``pandas.DataFrame``
+    :return: ``pandas.DataFrame``, or an iterator of them if ``chunksize`` is provided
     """
 
     if debug:
@@ -250,11 +300,12 @@ def query_table(
         print(f'## QUERYING via Pandas on {uri}')
         print(query)
 
-    engine = sqlalchemy.create_engine(uri)
+    if chunksize:
+        return _query_table_chunks(query, uri, chunksize)
 
-    df = pd.read_sql(query, engine)
+    engine = get_engine(uri)
 
-    engine.dispose()
+    df = pd.read_sql(query, engine)
 
     return df
 
@@ -263,19 +314,24 @@ def query_geo_table(
         query: str,
         uri: str,
         geom_col: str = 'geom',
-        debug: bool = False
-) -> gpd.GeoDataFrame:
+        debug: bool = False,
+        chunksize: int = None
+) -> Union[gpd.GeoDataFrame, Iterator[gpd.GeoDataFrame]]:
     """
     Query a geo table in a SQL database and get the result as a ``geopandas.GeoDataFrame``
 
     Be aware of the name of the geometry column. In PostGIS it's typically called 'geom',
     but geopandas seems to expect 'geometry' instead.
 
+    If ``chunksize`` is provided, the query runs through a server-side cursor and you get
+    an iterator of ``GeoDataFrames`` with at most ``chunksize`` rows each.
+
     :param query: 'SELECT gid, pop2015, geom FROM my_table WHERE pop2015 > 1000'
     :param uri: connection string
     :param geom_col: the name of the geometry column. Should either be 'geom' or 'geometry'
+    :param chunksize: number of rows per chunk, or ``None`` to get everything at once
 
-    :return: ``geopandas.GeoDataFrame``
+    :return: ``geopandas.GeoDataFrame``, or an iterator of them if ``chunksize`` is provided
     """
 
     if debug:
@@ -283,11 +339,11 @@ def query_geo_table(
         print(f'## QUERYING via GeoPandas on {uri}')
         print(query)
 
-    connection = psycopg2.connect(uri)
+    if chunksize:
+        return _query_geo_table_chunks(query, uri, geom_col, chunksize)
 
-    gdf = gpd.GeoDataFrame.from_postgis(query, connection, geom_col=geom_col)
-
-    connection.close()
+    with get_connection(uri) as connection:
+        gdf = gpd.GeoDataFrame.from_postgis(query, connection, geom_col=geom_col)
 
     return gdf
 
@@ -316,14 +372,15 @@ def execute_query(
         print(f'## UPDATING via psycopg2 on {uri}:')
         print('\t', query)
 
-    connection = psycopg2.connect(uri)
-    cursor = connection.cursor()
+    with get_connection(uri) as connection:
+        cursor = connection.cursor()
+
+        cursor.execute(query)
 
-    cursor.execute(query)
+        cursor.close()
 
-    cursor.close()
-    connection.commit()
-    connection.close()
+    # The query may have changed what's in the database, so the cached catalog is stale
+    invalidate_catalog(uri)
 
     if debug:
         runtime = round(time.time() - start_time, 2)
@@ -395,59 +452,313 @@ def project_spatial_table(
         orig_epsg: int,
         new_epsg: int,
         uri: str,
-        debug: bool = False
+        online: bool = False,
+        workers: int = 4,
+        debug: bool = False,
+        geom_col: str = 'geom'
 ):
     """
-    Alter a table's ``geom`` column to a new EPSG
+    Alter a table's geometry column to a new EPSG
+
+    By default this is one ``ALTER TABLE``, which locks everyone out of the table while it's rewritten.
+    With ``online=True`` the table is rebuilt next to the original instead: readers can keep using the
+    original the whole time, and it's only locked for the rename at the end.
+    See ``_project_spatial_table_online()``.
 
     :param tablename: name of the table (string)
     :param geom_type: name of a SQL-valid geometry type (string)
     :param orig_epsg: the EPSG that the data currently has (integer)
     :param new_epsg: the EPSG you want the data to be projected into (integer)
     :param uri: connection string
+    :param online: rebuild the table in parallel and swap it in, instead of altering it in place
+    :param workers: number of connections to copy rows and build indexes with, if ``online``
+    :param geom_col: name of the geometry column
     :return:
     """
 
+    if online:
+        _project_spatial_table_online(tablename, geom_type, orig_epsg, new_epsg, uri, workers=workers,
+                                      debug=debug, geom_col=geom_col)
+        return
+
     qry = f'''ALTER TABLE {tablename}
-              ALTER COLUMN geom TYPE geometry({geom_type}, {new_epsg})
-              USING ST_Transform( ST_SetSRID( geom, {orig_epsg} ), {new_epsg} ); '''
+              ALTER COLUMN "{geom_col}" TYPE geometry({geom_type}, {new_epsg})
+              USING ST_Transform( ST_SetSRID( "{geom_col}", {orig_epsg} ), {new_epsg} ); '''
     execute_query(qry, uri=uri, debug=debug)
 
     log_activity("pGIS.project_spatial_table", uri=uri, query_text=qry, debug=debug)
 
 
-def prep_spatial_table(
+def _project_spatial_table_online(
+        tablename: str,
+        geom_type: str,
+        orig_epsg: int,
+        new_epsg: int,
+        uri: str,
+        workers: int = 4,
+        chunks_per_worker: int = 4,
+        debug: bool = False,
+        geom_col: str = 'geom'
+):
+    """
+    Reproject a table by building a new copy of it and swapping it in.
+
+    1. A shadow table with a unique name is made with ``LIKE`` (columns, defaults, identity and check constraints),
+       with {geom_col} retyped.
+    2. The original gets a ``SHARE`` lock, which holds off writes (so no rows are missed) but not reads.
+    3. Rows are copied and projected in ranges of the integer primary key over ``workers`` connections.
+       Tables without one are copied in a single statement.
+    4. The original's indexes, constraints and foreign keys are rebuilt on the shadow table in parallel,
+       and it's analyzed.
+    5. In the same transaction as the lock, ``serial`` sequences are handed over, the original is dropped,
+       and the shadow table is renamed (along with its indexes) to take its place, with the original's grants and owner.
+
+    Tables that views or other tables' foreign keys depend on are refused, since the original can't be dropped,
+    and so are tables with triggers or row-level security policies, which the new copy wouldn't have.
+    """
+    start_time = time.time()
+
+    # A unique name in the same schema, so no existing table is ever replaced or dropped
+    schema_prefix = tablename.rsplit(".", 1)[0] + "." if "." in tablename else ""
+    bare_shadow_table = f"pgis_reproject_{uuid.uuid4().hex[:12]}"
+    shadow_table = schema_prefix + bare_shadow_table
+
+    # One connection holds the lock, so leave room for it in the pool
+    workers = max(1, min(workers, get_pool(uri).max_size - 1))
+
+    with get_connection(uri) as connection:
+        cursor = connection.cursor()
+
+        cursor.execute(sql_for_blocking_dependents(tablename))
+        dependents = [f"{kind} {name}" for kind, name in cursor.fetchall()]
+        if dependents:
+            raise ValueError(f"Can't reproject {tablename} online, because these depend on it: {', '.join(dependents)}. "
+                             f"Use online=False instead.")
+
+        cursor.execute(f"""
+            SELECT attname FROM pg_attribute
+            WHERE attrelid = '{tablename}'::regclass AND attnum > 0 AND NOT attisdropped
+            ORDER BY attnum""")
+        columns = [row[0] for row in cursor.fetchall()]
+
+        cursor.execute(sql_for_integer_primary_key(tablename))
+        key = cursor.fetchone()
+        key = key[0] if key else None
+
+        cursor.execute(sql_for_table_indexes(tablename))
+        indexes = cursor.fetchall()
+
+        cursor.execute(sql_for_owned_sequences(tablename))
+        owned_sequences = cursor.fetchall()
+
+        cursor.execute(sql_for_foreign_keys(tablename))
+        foreign_keys = cursor.fetchall()
+
+        cursor.execute(f"""
+            CREATE TABLE {shadow_table} (LIKE {tablename} INCLUDING DEFAULTS INCLUDING IDENTITY
+                                                          INCLUDING CONSTRAINTS INCLUDING STORAGE INCLUDING COMMENTS);
+            ALTER TABLE {shadow_table} ALTER COLUMN "{geom_col}" TYPE geometry({geom_type}, {new_epsg});""")
+        cursor.close()
+
+    if debug:
+        print(f'## Reprojecting {tablename} from {orig_epsg} to {new_epsg} online, through {shadow_table}')
+
+    def run(query):
+        with get_connection(uri) as worker_connection:
+            worker_cursor = worker_connection.cursor()
+            worker_cursor.execute(query)
+            n_rows = worker_cursor.rowcount
+            worker_cursor.close()
+        return n_rows
+
+    index_renames = [(f"{bare_shadow_table}_ix{i}", index_name, constraint_name is not None)
+                     for i, (index_name, constraint_name, _) in enumerate(indexes)]
+    index_queries = [f"""
+        SET LOCAL maintenance_work_mem = '{DEFAULT_MAINTENANCE_WORK_MEM}';
+        SET LOCAL max_parallel_maintenance_workers = {DEFAULT_PARALLEL_MAINTENANCE_WORKERS};
+        {sql_to_rebuild_index(shadow_table, temporary_name, constraint_name, definition)}"""
+                     for (temporary_name, _, _), (_, constraint_name, definition) in zip(index_renames, indexes)]
+    index_queries += [sql_to_add_foreign_key(shadow_table, constraint_name, definition)
+                      for constraint_name, definition in foreign_keys]
+
+    try:
+        with get_connection(uri) as lock_connection:
+            lock_cursor = lock_connection.cursor()
+            lock_cursor.execute(f"LOCK TABLE {tablename} IN SHARE MODE;")
+
+            key_ranges = [None]
+            if key:
+                lock_cursor.execute(f'SELECT min("{key}"), max("{key}") FROM {tablename}')
+                low, high = lock_cursor.fetchone()
+                if low is not None:
+                    key_ranges = primary_key_ranges(low, high, workers * chunks_per_worker)
+
+            copy_queries = [sql_to_copy_reprojected_rows(tablename, shadow_table, columns, orig_epsg, new_epsg,
+                                                         key=key if key_range else None, key_range=key_range,
+                                                         geom_col=geom_col)
+                            for key_range in key_ranges]
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                n_rows = sum(executor.map(run, copy_queries))
+
+                if debug:
+                    runtime = round(time.time() - start_time, 2)
+                    print(f'## -> Copied {n_rows} rows in {len(copy_queries)} chunks in {runtime} seconds, '
+                          f'rebuilding {len(index_queries)} indexes and foreign keys')
+
+                list(executor.map(run, index_queries))
+
+            lock_cursor.execute(f"ANALYZE {shadow_table};")
+
+            # Read the grants right before the swap, so any made during the copy are kept too
+            lock_cursor.execute(sql_for_table_privileges(tablename))
+            privileges = lock_cursor.fetchall()
+
+            lock_cursor.execute(sql_to_swap_in_shadow_table(tablename, shadow_table, owned_sequences, index_renames,
+                                                            privileges=privileges))
+            lock_cursor.close()
+
+    except Exception:
+        with get_connection(uri) as connection:
+            cursor = connection.cursor()
+            cursor.execute(f"DROP TABLE IF EXISTS {shadow_table};")
+            cursor.close()
+        raise
+
+    finally:
+        invalidate_catalog(uri)
+
+    if debug:
+        runtime = round(time.time() - start_time, 2)
+        print(f'## Swapped the reprojected {tablename} in after {runtime} seconds')
+
+    log_activity("pGIS.project_spatial_table",
+                 uri=uri,
+                 query_text=f"Reprojected {tablename} from {orig_epsg} to {new_epsg} online: "
+                            f"{n_rows} rows in {len(copy_queries)} chunks with {workers} workers",
+                 debug=debug)
+
+
+def finalize_spatial_table(
         spatial_table_name: str,
         uri: str,
         geom_colname: str = "geom",
+        cluster: bool = False,
+        maintenance_work_mem: str = DEFAULT_MAINTENANCE_WORK_MEM,
+        parallel_workers: int = DEFAULT_PARALLEL_MAINTENANCE_WORKERS,
         debug: bool = False
 ):
     """
-    Spatial tables in QGIS coming from PostGIS need a unique ID column and a spatial index.
-    This function executes the two SQL queries needed.
-    Results in a new column called ``unique_id`` and a spatial index on the existing ``geom`` column
+    Finish off a freshly loaded spatial table in a single transaction on one connection:
+    replace the ``uid`` primary key, rebuild the spatial index on ``geom_colname``,
+    optionally ``CLUSTER`` the table on that index, and ``ANALYZE`` it so the planner has statistics.
+    See ``sql_to_finalize_spatial_table()``.
 
     :param spatial_table_name: 'name_of_the_table'
     :param uri: connection string
+    :param geom_colname: name of the geometry column
+    :param cluster: reorder the table on the spatial index. This rewrites the table again, so it's off by default
+    :param maintenance_work_mem: memory for building the indexes, e.g. '1GB'
+    :param parallel_workers: value for ``max_parallel_maintenance_workers``
     :return: nothing
     """
+    start_time = time.time()
+
+    query = sql_to_finalize_spatial_table(spatial_table_name,
+                                          geom_colname=geom_colname,
+                                          cluster=cluster,
+                                          maintenance_work_mem=maintenance_work_mem,
+                                          parallel_workers=parallel_workers)
+
+    if debug:
+        print('-' * 40)
+        print(f'## FINALIZING {spatial_table_name} on {uri}')
+        print(query)
 
-    # Add a primary key column named 'uid'
-    unique_id_query = f"""
-        ALTER TABLE {spatial_table_name} DROP COLUMN IF EXISTS uid;
-        ALTER TABLE {spatial_table_name} ADD uid serial PRIMARY KEY;"""
-    execute_query(unique_id_query, uri=uri, debug=debug)
+    with get_connection(uri) as connection:
+        cursor = connection.cursor()
+        cursor.execute(query)
+        cursor.close()
+
+    invalidate_catalog(uri)
 
-    # Create a spatial index on the 'geom' column
-    spatial_index_query = f'CREATE INDEX gix_{spatial_table_name} ON {spatial_table_name} USING GIST ({geom_colname});'
-    execute_query(spatial_index_query, uri=uri, debug=debug)
+    if debug:
+        runtime = round(time.time() - start_time, 2)
+        print(f'## -> Finalized {spatial_table_name} in {runtime} seconds')
 
-    log_activity("pGIS.prep_spatial_table",
+    log_activity("pGIS.finalize_spatial_table",
                  uri=uri,
-                 query_text=f"Add uid PK and make spatial index on {geom_colname} column",
+                 query_text=f"Add uid PK, make spatial index on {geom_colname} column"
+                            + (", cluster on it" if cluster else "") + " and analyze",
                  debug=debug)
 
 
+def finalize_spatial_tables(
+        spatial_table_names: list,
+        uri: str,
+        geom_colname: str = "geom",
+        cluster: bool = False,
+        workers: int = 4,
+        maintenance_work_mem: str = DEFAULT_MAINTENANCE_WORK_MEM,
+        parallel_workers: int = DEFAULT_PARALLEL_MAINTENANCE_WORKERS,
+        debug: bool = False
+):
+    """
+    Run ``finalize_spatial_table()`` on many tables at once, each on its own connection.
+
+    Every connection gets its own ``maintenance_work_mem``, so the server may use up to
+    ``workers`` times that much memory while the indexes are built.
+
+    :param spatial_table_names: list of table names
+    :param uri: connection string
+    :param geom_colname: name of the geometry column in every table
+    :param cluster: reorder each table on its spatial index
+    :param workers: number of tables to finalize at once. Capped at the connection pool size
+    :param maintenance_work_mem: memory for building the indexes on each connection, e.g. '1GB'
+    :param parallel_workers: value for ``max_parallel_maintenance_workers`` on each connection
+    :return: nothing
+    """
+    workers = max(1, min(workers, len(spatial_table_names), get_pool(uri).max_size))
+
+    if debug:
+        print(f'## Finalizing {len(spatial_table_names)} tables with {workers} workers')
+
+    # Start the biggest tables first, so one big table doesn't hold everything up at the end
+    catalog = get_catalog(uri)
+    spatial_table_names = sorted(spatial_table_names, key=catalog.total_bytes, reverse=True)
+
+    def finalize(table_name):
+        finalize_spatial_table(table_name, uri,
+                               geom_colname=geom_colname,
+                               cluster=cluster,
+                               maintenance_work_mem=maintenance_work_mem,
+                               parallel_workers=parallel_workers,
+                               debug=debug)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # list() so the first error is raised here
+        list(executor.map(finalize, spatial_table_names))
+
+
+def prep_spatial_table(
+        spatial_table_name: str,
+        uri: str,
+        geom_colname: str = "geom",
+        debug: bool = False
+):
+    """
+    Spatial tables in QGIS coming from PostGIS need a unique ID column and a spatial index.
+    Results in a new column called ``uid`` and a spatial index on the existing ``geom`` column,
+    with fresh statistics for the planner. See ``finalize_spatial_table()``.
+
+    :param spatial_table_name: 'name_of_the_table'
+    :param uri: connection string
+    :return: nothing
+    """
+
+    finalize_spatial_table(spatial_table_name, uri=uri, geom_colname=geom_colname, debug=debug)
+
+
 def register_geometry_column(
         spatial_table: str,
         uri: str,
@@ -488,17 +799,25 @@ def make_geotable_from_query(
         geom_colname: str = "geom",
         geom_type: str = "POINT",
         epsg: int = 4326,
+        unlogged: bool = False,
         debug: bool = False
 ):
     """
-    Quickly make a new spatial table in PostgreSQL with a query, and then prep the table
-    by adding a uid, geom index, and entry into the geometry_columns table
+    Quickly make a new spatial table in PostgreSQL with a query, with a uid, a geom index,
+    and an entry in the geometry_columns table.
+
+    The table is written once, in one transaction: the geometry column is typed and the ``uid``
+    is numbered in the ``CREATE TABLE ... AS`` itself. See ``sql_to_make_geotable()``.
 
     :param new_tblname: 'name_of_my_new_table'
     :param query: "SELECT * FROM my_table WHERE highway = 'Local' "
     :param geom_colname: 'geom'
+    :param geom_type: 'POINT'
+    :param epsg: the EPSG that the data is already in. This does not transform anything
+    :param unlogged: make an ``UNLOGGED`` table, for scratch tables that don't need to survive a crash
     :return:
     """
+    start_time = time.time()
 
     # Confirm that the geom type is valid
     valid_geom_types = ["POINT", "MULTIPOINT", "POLYGON", "MULTIPOLYGON", "LINESTRING", "MULTILINESTRING"]
@@ -512,20 +831,29 @@ def make_geotable_from_query(
         print(f'MAKING {new_tblname} FROM:')
         print(query)
 
-    full_query = f"""
-        DROP TABLE IF EXISTS {new_tblname};
-        CREATE TABLE {new_tblname} AS
-        {query}
-    """
+    with get_connection(uri) as connection:
+        cursor = connection.cursor()
 
-    execute_query(full_query, uri=uri, debug=debug)
-    log_activity("pGIS.make_geotable_from_query", uri=uri, query_text=full_query, debug=debug)
+        # Get the names of the query's columns without running it
+        cursor.execute(f"SELECT * FROM ({query.strip().rstrip(';')}) AS source LIMIT 0")
+        columns = [column.name for column in cursor.description]
+
+        if geom_colname not in columns:
+            raise ValueError(f"The query doesn't return a column named {geom_colname}")
+
+        full_query = sql_to_make_geotable(new_tblname, query, columns,
+                                          geom_colname=geom_colname, geom_type=geom_type, epsg=epsg,
+                                          unlogged=unlogged)
+        cursor.execute(full_query)
+        cursor.close()
 
-    prep_spatial_table(new_tblname, uri=uri, geom_colname=geom_colname, debug=debug)
+    invalidate_catalog(uri)
 
-    register_geometry_column(new_tblname, uri=uri,
-                             geom_type=geom_type, geom_colname=geom_colname,
-                             epsg=epsg, debug=debug)
+    if debug:
+        runtime = round(time.time() - start_time, 2)
+        print(f'## -> Made {new_tblname} in {runtime} seconds')
+
+    log_activity("pGIS.make_geotable_from_query", uri=uri, query_text=full_query, debug=debug)
 
 ################################################################################
 # MAKE A NEW DATABASE
@@ -558,6 +886,7 @@ def load_hexgrid_function(
 def make_new_database(
         uri_defaultdb: str,
         uri_newdb: str,
+        load_hexgrid: bool = True,
         debug: bool = False
 ):
     """
@@ -565,6 +894,8 @@ def make_new_database(
 
     :param uri_defaultdb: connection string to the default database in the cluster
     :param uri_newdb: connection string to the new database
+    :param load_hexgrid: define the ``hex_grid()`` function. Turn this off when loading a backup
+                         that already has it.
     :return: None
     """
 
@@ -586,15 +917,15 @@ def make_new_database(
 
         make_db = f"CREATE DATABASE {db_name};"
 
-        connection = psycopg2.connect(uri_defaultdb)
-        connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
-        cursor = connection.cursor()
+        with get_connection(uri_defaultdb, autocommit=True) as connection:
+            cursor = connection.cursor()
 
-        cursor.execute(make_db)
+            cursor.execute(make_db)
 
-        cursor.close()
-        connection.commit()
-        connection.close()
+            cursor.close()
+
+        # Every cached list of databases on this cluster is now out of date
+        invalidate_catalog()
 
         log_activity("pGIS.make_new_database",
                      uri=uri_newdb,
@@ -622,7 +953,8 @@ def make_new_database(
             print(msg)
 
         # Load the custom SQL hexagon grid function
-        load_hexgrid_function(uri=uri_newdb, debug=debug)
+        if load_hexgrid:
+            load_hexgrid_function(uri=uri_newdb, debug=debug)
 
     else:
         if debug:
@@ -638,36 +970,46 @@ def load_database_file(
         sql_file_path: str,
         uri_defaultdb: str,
         uri_newdb: str,
+        jobs: int = 4,
         debug: bool = False
 ):
     """
-    Load a ``.sql`` file to a new database.
-    NOTE: ``psql`` must be accessible on the system path
+    Load a backup made by ``pg_dump`` to a new database.
+
+    The format is detected from the file: directory and custom-format archives are restored
+    with ``pg_restore``, ``jobs`` tables at a time, and plain ``.sql`` (or ``.sql.gz``) files are
+    streamed through ``psql``. Either way the indexes and constraints are built after the data is in,
+    and the load stops with a ``subprocess.CalledProcessError`` at the first error.
+    NOTE: ``pg_restore`` and ``psql`` must be accessible on the system path
 
-    :param sql_file_path: '/path/to/sqlfile.sql'
+    :param sql_file_path: '/path/to/sqlfile.sql', or the folder of a directory-format backup
     :param uri_defaultdb: connection string to default db for the cluster
     :param uri_newdb: connection string to new database that will be loaded up via the .sql file
+    :param jobs: number of tables to restore at once, for directory and custom-format archives
     :return:
     """
 
-    path_list = sql_file_path.split('\\')
-    sql_file = path_list[-1]
+    sql_file = os.path.basename(sql_file_path.rstrip("/\\"))
 
     db_connection_values = deconstruct_uri(uri_newdb)
     db_name = db_connection_values["database"]
 
     print(f'## Loading {sql_file} to {db_name}')
 
-    make_new_database(uri_defaultdb=uri_defaultdb, uri_newdb=uri_newdb, debug=debug)
+    # The backup may bring its own hex_grid() function, which would clash with one defined up front
+    make_new_database(uri_defaultdb=uri_defaultdb, uri_newdb=uri_newdb, load_hexgrid=False, debug=debug)
 
-    c = f'psql "{uri_newdb}" <  "{sql_file_path}"'
+    restore_database(sql_file_path, uri_newdb, jobs=jobs, debug=debug)
 
-    print(c)
-    os.system(c)
+    # CREATE OR REPLACE, so this is safe whether or not the backup had it
+    load_hexgrid_function(uri=uri_newdb, debug=debug)
+
+    # Everything in the database is new
+    invalidate_catalog(uri_newdb)
 
     log_activity("pGIS.load_database_file",
                  uri=uri_newdb,
-                 query_text=c,
+                 query_text=f"Loaded {sql_file}",
                  debug=debug)
 
 
@@ -680,34 +1022,57 @@ def dataframe_to_postgis(
         dataframe: pd.DataFrame,
         table_name: str,
         uri: str,
+        method: str = None,
+        copy_format: str = "binary",
+        chunksize: int = DEFAULT_CHUNKSIZE,
         debug: bool = False
 ):
     """
     Write a ``pandas.DataFrame`` to a PostgreSQL database.
 
+    By default this streams the rows with ``COPY ... FROM STDIN``, which is much faster
+    than the row-wise ``INSERT`` statements issued by ``DataFrame.to_sql()``.
+    Either way the table is replaced, and ends up with the same columns and types.
+
     :param dataframe: ``pandas.DataFrame``
     :param table_name: 'name_of_the_table'
     :param uri: connection string
+    :param method: ``'copy'`` or ``'to_sql'``. Defaults to ``'copy'`` for PostgreSQL URIs
+    :param copy_format: ``'binary'`` or ``'csv'``, only used when ``method='copy'``
+    :param chunksize: number of rows sent at a time, only used when ``method='copy'``
     :return: None
     """
 
     start_time = time.time()
 
+    if method is None:
+        method = "copy" if is_postgres_uri(uri) else "to_sql"
+
     if debug:
-        print(f'## Writing {table_name} from Pandas dataframe to {uri}')
+        print(f'## Writing {table_name} from Pandas dataframe to {uri} via {method}')
 
     # FORCE ALL COLUMN NAMES TO LOWER-CASE (pgSQL requirement)
     dataframe.columns = [x.lower() for x in dataframe.columns]
 
-    # CONNECT TO DATABASE, WRITE DATAFRAME, THEN DISCONNECT
-    engine = sqlalchemy.create_engine(uri)
-    dataframe.to_sql(table_name, engine, if_exists='replace')
-    engine.dispose()
+    if method == "copy":
+        # STREAM THE DATAFRAME WITH COPY, IN CHUNKS
+        write_dataframe(dataframe, table_name, uri,
+                        copy_format=copy_format, chunksize=chunksize, debug=debug)
+
+    elif method == "to_sql":
+        # WRITE DATAFRAME USING THE CACHED ENGINE FOR THIS DATABASE
+        engine = get_engine(uri)
+        dataframe.to_sql(table_name, engine, if_exists='replace')
+        invalidate_catalog(uri)
+
+    else:
+        raise ValueError(f"method must be 'copy' or 'to_sql', not '{method}'")
 
     if debug:
         # REPORT THE RUNTIME
         runtime = time.time() - start_time
-        print(f'## -> Finished in {runtime} seconds')
+        rows_per_second = int(len(dataframe) / runtime) if runtime else len(dataframe)
+        print(f'## -> Finished in {runtime} seconds ({rows_per_second} rows/sec)')
 
     log_activity("pGIS.dataframe_to_postgis",
                  uri=uri,
@@ -720,19 +1085,35 @@ def csv_to_postgis(
         table_name: str,
         uri: str,
         overwrite: bool = False,
+        method: str = None,
+        infer_types: bool = True,
         debug: bool = False
 ):
     """
     Write ``.CSV`` file to a database.
-    Accomplished by importing to a ``pandas.DataFrame`` and calling ``dataframe_to_postgis()``.
+
+    With ``method='copy'`` (the default for PostgreSQL URIs) the file is streamed through
+    ``COPY ... FROM STDIN`` without ever being loaded into memory. The encoding, header and
+    column types are sniffed from a sample at the start of the file, and ``.gz`` / ``.zip``
+    files are unpacked on the fly.
+
+    With ``method='pandas'`` the file is imported to a ``pandas.DataFrame`` and written with ``dataframe_to_postgis()``.
 
     :param csv_filepath: file path to .csv file
     :param table_name: name of the table to create
     :param uri: connection string
     :param overwrite: bool to control whether you want to overwrite the table, should it already exist in the db
+    :param method: ``'copy'`` or ``'pandas'``. Defaults to ``'copy'`` for PostgreSQL URIs
+    :param infer_types: for ``method='copy'``, pick column types from a sample of the file instead of using ``TEXT``
     :return:
     """
 
+    if method is None:
+        method = "copy" if is_postgres_uri(uri) else "pandas"
+
+    if method not in ["copy", "pandas"]:
+        raise ValueError(f"method must be 'copy' or 'pandas', not '{method}'")
+
     if debug:
         print(f'READING {csv_filepath}')
 
@@ -747,20 +1128,25 @@ def csv_to_postgis(
             print(f'## {table_name} ALREADY EXISTS... Will not replace. Aborting.')
             return None
 
+    # Stream the file straight into the database
+    if method == "copy":
+        copy_csv_file(csv_filepath, table_name, uri, infer_types=infer_types, debug=debug)
+
+        log_activity("pGIS.csv_to_postgis",
+                     uri=uri,
+                     query_text=f"Streamed CSV from {csv_filepath}",
+                     debug=debug)
+        return
+
     # Read .CSV file into Pandas
     try:
         df = pd.read_csv(csv_filepath)
     except:
         df = pd.read_csv(csv_filepath, encoding="ISO-8859-1")
 
-    # Replace "Column Name" with "column_name"
-    df.columns = df.columns.str.replace(' ', '_')
-    df.columns = [x.lower() for x in df.columns]
-
-    # Remove '.' and '-' from column names.
+    # Replace "Column Name" with "column_name" and remove '.', '-', etc.
     # i.e. 'geo.display-label' becomes 'geodisplaylabel'
-    for s in ['.', '-', '(', ')', '+']:
-        df.columns = df.columns.str.replace(s, '')
+    df.columns = sanitize_column_names(df.columns)
 
     log_activity("pGIS.csv_to_postgis",
                  uri=uri,
@@ -771,35 +1157,28 @@ def csv_to_postgis(
     dataframe_to_postgis(df, table_name, uri=uri, debug=debug)
 
 
-def geodataframe_to_postgis(
+def _prepare_geodataframe(
         geodataframe: gpd.GeoDataFrame,
-        output_table_name: str,
-        uri: str,
         src_epsg: Union[bool, int] = None,
-        output_epsg: Union[bool, int] = None,
-        debug: bool = False
-):
+        geom_type: str = None
+) -> Union[tuple, None]:
     """
-    Write a ``geopandas.GeoDataFrame`` to a PostGIS table in a SQL database.
-
-    Assumes that the geometry column has already been named 'geometry'
+    Work out the geometry type and EPSG of a ``GeoDataFrame``, and clean up its columns in place
+    so it can be written to PostGIS: lower-case names, 'geom' renamed to 'geometry',
+    'gid' dropped and 'uid' renamed to 'old_uid'.
 
     :param geodataframe: geopandas.GeoDataFrame
-    :param output_table_name: 'name_of_the_output_table'
-    :param src_epsg: if not None, will assign the geodataframe this EPSG in the format of {"init": "epsg:2227"}
-    :param output_epsg: if not None, will reproject data from input EPSG to specified EPSG
-    :param uri: connection string
-    :return: None
+    :param src_epsg: if not None, will assign the geodataframe this EPSG
+    :param geom_type: geometry type to use. Inferred from the data if ``None``
+    :return: tuple of (geometry type, EPSG code), or ``None`` if there's no valid EPSG
     """
-    start_time = time.time()
-
     # Get the geometry type
     # It's possible there are both MULTIPOLYGONS and POLYGONS. This grabs the MULTI variant
-    geom_types = list(geodataframe.geometry.geom_type.unique())
-    geom_typ = max(geom_types, key=len).upper()
-
-    if debug:
-        print(f'## PROCESSING {geom_typ} geodataframe to {output_table_name} in SQL')
+    if geom_type:
+        geom_typ = geom_type.upper()
+    else:
+        geom_types = list(geodataframe.geometry.geom_type.dropna().unique())
+        geom_typ = max(geom_types, key=len).upper()
 
     # Manually set the EPSG if the user passes one
     if src_epsg:
@@ -818,7 +1197,7 @@ def geodataframe_to_postgis(
         except:
             print('This geodataframe does not have a valid EPSG. Aborting.')
             print(geodataframe.crs)
-            return
+            return None
 
     # Sanitize the columns before writing to the database
     # Make all column names lower case
@@ -827,30 +1206,101 @@ def geodataframe_to_postgis(
     # Replace the 'geom' column with 'geometry'
     if 'geom' in geodataframe.columns:
         geodataframe['geometry'] = geodataframe['geom']
-        geodataframe.drop('geom', 1, inplace=True)
+        geodataframe.drop(columns=['geom'], inplace=True)
+        geodataframe.set_geometry('geometry', inplace=True)
 
     # Drop the 'gid' column
     if 'gid' in geodataframe.columns:
-        geodataframe.drop('gid', 1, inplace=True)
+        geodataframe.drop(columns=['gid'], inplace=True)
 
     # Rename 'uid' to 'old_uid'
     if 'uid' in geodataframe.columns:
-        geodataframe['old_uid'] = geodataframe['uid']
-        geodataframe.drop('uid', 1, inplace=True)
+        geodataframe.rename(columns={'uid': 'old_uid'}, inplace=True)
+
+    return geom_typ, epsg_code
+
+
+def geodataframe_to_postgis(
+        geodataframe: gpd.GeoDataFrame,
+        output_table_name: str,
+        uri: str,
+        src_epsg: Union[bool, int] = None,
+        output_epsg: Union[bool, int] = None,
+        method: str = None,
+        copy_format: str = "binary",
+        chunksize: int = DEFAULT_CHUNKSIZE,
+        if_exists: str = "replace",
+        geom_type: str = None,
+        prep_table: bool = True,
+        debug: bool = False,
+        sql_types: dict = None
+):
+    """
+    Write a ``geopandas.GeoDataFrame`` to a PostGIS table in a SQL database.
+
+    Assumes that the geometry column has already been named 'geometry'
+
+    By default the geometries are encoded to EWKB in a single vectorized call and
+    streamed with ``COPY`` straight into a ``geometry(<type>, <srid>)`` column.
+    Use ``method='to_sql'`` to go through ``geoalchemy2.WKTElement`` and ``to_sql()`` instead.
+
+    :param geodataframe: geopandas.GeoDataFrame
+    :param output_table_name: 'name_of_the_output_table'
+    :param src_epsg: if not None, will assign the geodataframe this EPSG in the format of {"init": "epsg:2227"}
+    :param output_epsg: if not None, will reproject data from input EPSG to specified EPSG
+    :param uri: connection string
+    :param method: ``'copy'`` or ``'to_sql'``. Defaults to ``'copy'`` for PostgreSQL URIs
+    :param copy_format: ``'binary'`` or ``'csv'``, only used when ``method='copy'``
+    :param chunksize: number of rows sent at a time, only used when ``method='copy'``
+    :param if_exists: ``'replace'`` the table, or ``'append'`` these rows to it.
+                      When appending, no reprojection or prep is done.
+    :param geom_type: geometry type for the ``geom`` column. Inferred from the data if ``None``
+    :param prep_table: add the ``uid`` and spatial index after writing. Set to ``False`` when
+                       more chunks will be appended afterwards, and prep once at the end.
+    :param sql_types: optional dict of SQL types keyed on column name, for the columns that ``COPY`` creates.
+                      Appended rows always take the types of the existing table
+    :return: None
+    """
+    start_time = time.time()
 
-    # Build a 'geom' column using geoalchemy2 and drop the source 'geometry' column
-    geodataframe['geom'] = geodataframe['geometry'].apply(lambda x: WKTElement(x.wkt, srid=epsg_code))
-    geodataframe.drop('geometry', 1, inplace=True)
+    if method is None:
+        method = "copy" if is_postgres_uri(uri) else "to_sql"
+
+    if method not in ["copy", "to_sql"]:
+        raise ValueError(f"method must be 'copy' or 'to_sql', not '{method}'")
+
+    prepared = _prepare_geodataframe(geodataframe, src_epsg=src_epsg, geom_type=geom_type)
+    if prepared is None:
+        return
+    geom_typ, epsg_code = prepared
+
+    if debug:
+        print(f'## PROCESSING {geom_typ} geodataframe to {output_table_name} in SQL')
 
     # write geodataframe to SQL database
     if debug:
-        print(f'## -> WRITING TO {uri}')
+        print(f'## -> WRITING TO {uri} via {method}')
+
+    if method == "copy":
+        # Encode every geometry to EWKB at once and COPY the bytes into a typed geometry column
+        geodataframe['geom'] = geometry_to_ewkb(geodataframe['geometry'].values, epsg_code)
+        geodataframe.drop('geometry', axis=1, inplace=True)
 
-    engine = sqlalchemy.create_engine(uri)
-    geodataframe.to_sql(output_table_name, engine,
-                        if_exists='replace', index=True, index_label='gid',
-                        dtype={'geom': Geometry(geom_typ, srid=epsg_code)})
-    engine.dispose()
+        write_dataframe(pd.DataFrame(geodataframe), output_table_name, uri,
+                        if_exists=if_exists, index=True, index_label='gid',
+                        sql_types={**(sql_types or {}), 'geom': geometry_sql_type(geom_typ, epsg_code)},
+                        copy_format=copy_format, chunksize=chunksize, debug=debug)
+
+    else:
+        # Build a 'geom' column using geoalchemy2 and drop the source 'geometry' column
+        geodataframe['geom'] = geodataframe['geometry'].apply(lambda x: WKTElement(x.wkt, srid=epsg_code))
+        geodataframe.drop(columns=['geometry'], inplace=True)
+
+        engine = get_engine(uri)
+        geodataframe.to_sql(output_table_name, engine,
+                            if_exists=if_exists, index=True, index_label='gid',
+                            dtype={'geom': Geometry(geom_typ, srid=epsg_code)})
+        invalidate_catalog(uri)
 
     if debug:
         runtime = round((time.time() - start_time), 2)
@@ -861,11 +1311,415 @@ def geodataframe_to_postgis(
                  query_text=f"Wrote geopandas.GeoDataFrame to {output_table_name}",
                  debug=debug)
 
+    # Appended rows land in a table that has already been set up
+    if if_exists == "append":
+        return
+
     # If provided an EPSG, alter whatever the native projection was to the output_epsg
     if output_epsg:
         project_spatial_table(output_table_name, geom_typ, epsg_code, output_epsg, uri=uri, debug=debug)
 
     # Add a unique_id column and do a spatial index
+    if prep_table:
+        prep_spatial_table(output_table_name, uri=uri, debug=debug)
+
+
+def _arrow_layout(
+        schema,
+        geometry_columns: dict = None,
+        src_epsg: int = None
+) -> dict:
+    """
+    Plan how the columns of an Arrow schema map onto a PostGIS table.
+
+    Names are cleaned up the same way ``_prepare_geodataframe()`` does it: lower-case names,
+    the primary geometry column renamed to 'geom', 'gid' dropped and 'uid' renamed to 'old_uid'.
+    A new ``gid`` column numbers the rows from zero. Nested columns (structs, lists, maps),
+    like the ``bbox`` covering column in a GeoParquet file, are skipped.
+
+    :param schema: ``pyarrow.Schema``
+    :param geometry_columns: dict of column -> {type, srid}. Read from the GeoParquet metadata if ``None``
+    :param src_epsg: if not None, the primary geometry column is given this EPSG
+    :return: dict with the source columns, their new names, the ``(column, sql_type)`` list,
+             the SRID of each geometry column and the type and SRID of the 'geom' column (or ``None``)
+    """
+    import pyarrow as pa
+
+    if geometry_columns is None:
+        geometry_columns = geoparquet_metadata(schema)
+
+    geometry_columns = {column: dict(info) for column, info in geometry_columns.items() if column in schema.names}
+    primary_column = next(iter(geometry_columns), None)
+
+    if src_epsg and primary_column:
+        geometry_columns[primary_column]["srid"] = src_epsg
+
+    layout = {"sources": [], "names": [], "column_types": [("gid", "BIGINT")], "srids": {},
+              "geom": geometry_columns.get(primary_column)}
+
+    for field in schema:
+        name = "geom" if field.name == primary_column else field.name.lower()
+
+        if name == "gid" or (pa.types.is_nested(field.type) and field.name not in geometry_columns):
+            continue
+
+        if name == "uid":
+            name = "old_uid"
+
+        if field.name in geometry_columns:
+            info = geometry_columns[field.name]
+            sql_type = geometry_sql_type(info["type"], info["srid"])
+            layout["srids"][name] = info["srid"]
+        else:
+            sql_type = arrow_sql_type(field.type)
+
+        layout["sources"].append(field.name)
+        layout["names"].append(name)
+        layout["column_types"].append((name, sql_type))
+
+    return layout
+
+
+def _encode_arrow_batches(
+        batches,
+        layout: dict,
+        first_gid: int = 0
+) -> Iterator[bytes]:
+    """ Rename each batch's columns to match the table, number the rows, and encode them for ``COPY`` """
+    import pyarrow as pa
+
+    for batch in batches:
+        arrays = [pa.array(np.arange(first_gid, first_gid + batch.num_rows, dtype=np.int64))]
+        arrays += [batch.column(batch.schema.get_field_index(column)) for column in layout["sources"]]
+
+        renamed = pa.RecordBatch.from_arrays(arrays, names=["gid"] + layout["names"])
+        first_gid += batch.num_rows
+
+        yield encode_arrow_batch(renamed, layout["column_types"], layout["srids"])
+
+
+def _finish_arrow_load(
+        table_name: str,
+        uri: str,
+        layout: dict,
+        output_epsg: int = None,
+        prep_table: bool = True,
+        debug: bool = False
+):
+    """ Reproject and prep the table once the rows are in, if it has a 'geom' column """
+    if layout["geom"] is None:
+        return
+
+    if output_epsg:
+        project_spatial_table(table_name, layout["geom"]["type"], layout["geom"]["srid"], output_epsg,
+                              uri=uri, debug=debug)
+
+    if prep_table:
+        prep_spatial_table(table_name, uri=uri, debug=debug)
+
+
+def _check_arrow_srid(
+        layout: dict,
+        output_epsg: int = None
+):
+    """ Data can only be reprojected if we know where it's coming from """
+    if output_epsg and layout["geom"] is not None and not layout["geom"]["srid"]:
+        raise ValueError("The geometry column has no CRS, so it can't be reprojected. Pass src_epsg= to set one.")
+
+
+def arrow_to_postgis(
+        data,
+        output_table_name: str,
+        uri: str,
+        geometry_columns: dict = None,
+        src_epsg: int = None,
+        output_epsg: int = None,
+        prep_table: bool = True,
+        debug: bool = False
+) -> int:
+    """
+    Write Arrow data, including WKB geometry columns, to a PostGIS table with a binary ``COPY``.
+
+    The values are encoded straight from the Arrow buffers and the WKB geometries get their
+    SRID embedded on the way through, so no row is ever turned into Python objects.
+    The table is laid out like the one ``geodataframe_to_postgis()`` makes: an indexed ``gid``
+    column, a typed ``geom`` column, and (after prepping) a ``uid`` primary key and spatial index.
+
+    :param data: ``pyarrow.Table``, ``pyarrow.RecordBatch``, ``pyarrow.RecordBatchReader``
+                 or an iterable of ``pyarrow.RecordBatch`` objects
+    :param output_table_name: 'name_of_the_output_table'
+    :param uri: connection string
+    :param geometry_columns: dict of WKB column -> {type, srid}, e.g. ``{'geometry': {'type': 'POINT', 'srid': 4326}}``.
+                             Read from the GeoParquet ``geo`` schema metadata if ``None``. The first one becomes 'geom'.
+    :param src_epsg: if not None, will assign the geometry column this EPSG
+    :param output_epsg: if not None, will reproject data from input EPSG to specified EPSG
+    :param prep_table: add the ``uid`` and spatial index after writing
+    :return: number of rows written
+    """
+    import pyarrow as pa
+
+    start_time = time.time()
+
+    if isinstance(data, pa.Table):
+        schema, batches = data.schema, data.to_batches(max_chunksize=DEFAULT_CHUNKSIZE)
+    elif isinstance(data, pa.RecordBatch):
+        schema, batches = data.schema, [data]
+    elif isinstance(data, pa.RecordBatchReader):
+        schema, batches = data.schema, data
+    else:
+        batches = iter(data)
+        first = next(batches)
+        schema, batches = first.schema, itertools.chain([first], batches)
+
+    layout = _arrow_layout(schema, geometry_columns=geometry_columns, src_epsg=src_epsg)
+    _check_arrow_srid(layout, output_epsg)
+
+    if debug:
+        print(f'## Writing Arrow data to {output_table_name} in SQL')
+        print(f'## -> {layout["column_types"]}')
+
+    n_rows = copy_encoded_rows(_encode_arrow_batches(batches, layout), output_table_name, uri,
+                               layout["column_types"], index_columns=["gid"])
+
+    if debug:
+        runtime = round(time.time() - start_time, 2)
+        rate = int(n_rows / runtime) if runtime else n_rows
+        print(f'## -> COPY {n_rows} rows in {runtime} seconds ({rate} rows/sec)')
+
+    log_activity("pGIS.arrow_to_postgis",
+                 uri=uri,
+                 query_text=f"Wrote Arrow data to {output_table_name}",
+                 debug=debug)
+
+    _finish_arrow_load(output_table_name, uri, layout, output_epsg=output_epsg, prep_table=prep_table, debug=debug)
+
+    return n_rows
+
+
+def _encode_row_groups(
+        parquet_filepath: str,
+        layout: dict,
+        workers: int
+) -> Iterator[bytes]:
+    """
+    Read and encode a Parquet file's row groups on a pool of threads, yielding them in order.
+    Each thread opens its own handle on the file, and only a few row groups are held in memory at once.
+    """
+    import pyarrow.parquet as pq
+
+    metadata = pq.ParquetFile(parquet_filepath).metadata
+    row_counts = [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)]
+    first_gids = [sum(row_counts[:i]) for i in range(len(row_counts))]
+
+    local = threading.local()
+
+    def encode_row_group(row_group):
+        if not hasattr(local, "parquet_file"):
+            local.parquet_file = pq.ParquetFile(parquet_filepath)
+
+        table = local.parquet_file.read_row_group(row_group, columns=layout["sources"])
+
+        return b"".join(_encode_arrow_batches(table.to_batches(), layout, first_gid=first_gids[row_group]))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+
+        try:
+            for row_group in range(len(row_counts)):
+                pending.append(executor.submit(encode_row_group, row_group))
+
+                if len(pending) > workers:
+                    yield pending.popleft().result()
+
+            while pending:
+                yield pending.popleft().result()
+
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def parquet_to_postgis(
+        parquet_filepath: str,
+        output_table_name: str,
+        uri: str,
+        columns: list = None,
+        src_epsg: int = None,
+        output_epsg: int = None,
+        workers: int = 4,
+        prep_table: bool = True,
+        debug: bool = False
+) -> int:
+    """
+    Load a (Geo)Parquet file into a PostGIS table with a single binary ``COPY``.
+
+    The CRS and geometry type come from the file's GeoParquet metadata.
+    Row groups are read, decoded and encoded on ``workers`` threads in parallel and sent to
+    the server in order, straight from the Arrow buffers (see ``arrow_to_postgis()``).
+
+    :param parquet_filepath: path to the .parquet file
+    :param output_table_name: 'name_of_the_output_table'
+    :param uri: connection string
+    :param columns: list of columns to load. Loads all of them if ``None``
+    :param src_epsg: if not None, will assign the geometry column this EPSG
+    :param output_epsg: if not None, will reproject data from input EPSG to specified EPSG
+    :param workers: number of row groups to read at once
+    :param prep_table: add the ``uid`` and spatial index after writing
+    :return: number of rows written
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    start_time = time.time()
+
+    schema = pq.read_schema(parquet_filepath)
+    geometry_columns = geoparquet_metadata(schema)
+
+    if columns is not None:
+        schema = pa.schema([schema.field(column) for column in columns], metadata=schema.metadata)
+
+    layout = _arrow_layout(schema, geometry_columns=geometry_columns, src_epsg=src_epsg)
+    _check_arrow_srid(layout, output_epsg)
+
+    if debug:
+        print(f'## Loading {parquet_filepath} to {output_table_name} with {workers} workers')
+        print(f'## -> {layout["column_types"]}')
+
+    n_rows = copy_encoded_rows(_encode_row_groups(parquet_filepath, layout, max(workers, 1)),
+                               output_table_name, uri, layout["column_types"], index_columns=["gid"])
+
+    if debug:
+        runtime = round(time.time() - start_time, 2)
+        rate = int(n_rows / runtime) if runtime else n_rows
+        print(f'## -> COPY {n_rows} rows in {runtime} seconds ({rate} rows/sec)')
+
+    log_activity("pGIS.parquet_to_postgis",
+                 uri=uri,
+                 query_text=f"Loaded {parquet_filepath} to {output_table_name}",
+                 debug=debug)
+
+    _finish_arrow_load(output_table_name, uri, layout, output_epsg=output_epsg, prep_table=prep_table, debug=debug)
+
+    return n_rows
+
+
+def _read_layer_info(
+        path: str,
+        layer: str = None
+) -> dict:
+    """
+    Get the feature count and CRS of a spatial file without reading its features.
+    Uses ``pyogrio`` if it is installed, otherwise ``fiona``.
+
+    :param path: path to a shapefile, geopackage, file geodatabase, etc.
+    :param layer: name of the layer, for multi-layer sources
+    :return: dict with keys ``features`` and ``epsg`` (``None`` if it can't be determined)
+    """
+    try:
+        import pyogrio
+        info = pyogrio.read_info(path, layer=layer)
+        n_features, crs = info["features"], info["crs"]
+
+    except ImportError:
+        import fiona
+        with fiona.open(path, layer=layer) as source:
+            n_features, crs = len(source), source.crs
+
+    try:
+        epsg = pyproj.CRS.from_user_input(crs).to_epsg() if crs else None
+    except pyproj.exceptions.CRSError:
+        epsg = None
+
+    return {"features": n_features, "epsg": epsg}
+
+
+def _rows_per_window(
+        gdf: gpd.GeoDataFrame,
+        memory_budget_mb: float
+) -> int:
+    """
+    Estimate how many rows fit in the memory budget, based on a sample window.
+    Each window is held a few times over (as read, exploded, and encoded), so allow for four copies.
+    """
+    attribute_bytes = gdf.drop(columns="geometry").memory_usage(deep=True).sum()
+    geometry_bytes = shapely.get_num_coordinates(gdf.geometry.values).sum() * 16 + 64 * len(gdf)
+
+    bytes_per_row = max((attribute_bytes + geometry_bytes) / max(len(gdf), 1), 1) * 4
+
+    return max(int(memory_budget_mb * 1024 * 1024 / bytes_per_row), 1000)
+
+
+def _shp_to_postgis_in_windows(
+        shp_path: str,
+        output_table_name: str,
+        uri: str,
+        src_epsg: Union[bool, int] = None,
+        output_epsg: Union[bool, int] = None,
+        chunksize: int = None,
+        memory_budget_mb: float = None,
+        layer: str = None,
+        debug: bool = False
+):
+    """
+    Load a spatial file into PostGIS one window of rows at a time.
+
+    Each window is read, filtered for null geometries, exploded and appended to the output table.
+    The SRID comes from ``src_epsg`` or the layer metadata, and the geometry type is fixed
+    by the first window, so every window is written into the same typed column.
+    """
+    layer_info = _read_layer_info(shp_path, layer=layer)
+    n_features = layer_info["features"]
+    epsg = src_epsg or layer_info["epsg"]
+
+    sample_size = chunksize or 1000
+    geom_type = None
+    rows_loaded = 0
+
+    start = 0
+    while start < n_features:
+        stop = min(start + sample_size, n_features)
+
+        gdf = gpd.read_file(shp_path, layer=layer, rows=slice(start, stop))
+        gdf.index = pd.RangeIndex(start, start + len(gdf))
+
+        # Size the remaining windows from what this one looks like
+        if start == 0 and chunksize is None:
+            sample_size = _rows_per_window(gdf, memory_budget_mb)
+            if debug:
+                print(f"## -> Reading {sample_size} rows at a time to stay within {memory_budget_mb} MB")
+
+        if debug:
+            print(f"## -> Rows {start} to {stop} of {n_features}")
+
+        start = stop
+
+        # REMOVE ROWS WITH NULL GEOMETRY
+        gdf = gdf[gdf['geometry'].notnull()]
+        if gdf.empty:
+            continue
+
+        # EXPLODE TO TRANSFORM ANY MULTIPART FEATURES TO SINGLEPART, THEN RESET THE INDEX
+        gdf = gdf.explode(index_parts=False)
+        gdf['explode'] = gdf.index
+        gdf = gdf.reset_index()
+        gdf.index = pd.RangeIndex(rows_loaded, rows_loaded + len(gdf))
+
+        # Fix the geometry type (and the SRID, if the metadata didn't have one) from the first window
+        if epsg is None and gdf.crs is not None:
+            epsg = gdf.crs.to_epsg()
+
+        if geom_type is None:
+            geom_type = max(gdf.geometry.geom_type.dropna().unique(), key=len).upper()
+
+        geodataframe_to_postgis(gdf, output_table_name, uri=uri, src_epsg=epsg,
+                                if_exists="replace" if rows_loaded == 0 else "append",
+                                geom_type=geom_type, prep_table=False, debug=debug)
+
+        rows_loaded += len(gdf)
+
+    if output_epsg:
+        project_spatial_table(output_table_name, geom_type, epsg, output_epsg, uri=uri, debug=debug)
+
     prep_spatial_table(output_table_name, uri=uri, debug=debug)
 
 
@@ -875,24 +1729,45 @@ def shp_to_postgis(
         uri: str,
         src_epsg: Union[bool, int] = None,
         output_epsg: Union[bool, int] = None,
+        chunksize: int = None,
+        memory_budget_mb: float = None,
+        layer: str = None,
         debug: bool = False
 ):
     """
     Read a ``shapefile`` into ``geopandas.GeoDataFrame`` and then use ``geodataframe_to_postgis()``
 
+    If ``chunksize`` or ``memory_budget_mb`` is provided, the file is read in windows of rows
+    that are each exploded, encoded and appended to the output table. This loads shapefiles
+    and file geodatabases that are larger than RAM.
+
     :param shp_path:  r'c:\path\to\your\shapefile.shp'
     :param output_table_name: 'name_of_the_output_table'
     :param uri: connection string
     :param src_epsg: if not None, will assign the geodataframe this EPSG in the format of {"init": "epsg:2227"}
     :param output_epsg: if not None, will reproject data from input EPSG to specified EPSG
+    :param chunksize: number of features to read at a time
+    :param memory_budget_mb: size each window to fit roughly this much memory. Ignored if ``chunksize`` is provided
+    :param layer: name of the layer to read, for sources like a file geodatabase
     :return:
     """
 
     if debug:
         print(f'## READING - {shp_path}')
 
+    if chunksize or memory_budget_mb:
+        _shp_to_postgis_in_windows(shp_path, output_table_name, uri, src_epsg=src_epsg, output_epsg=output_epsg,
+                                   chunksize=chunksize, memory_budget_mb=memory_budget_mb, layer=layer,
+                                   debug=debug)
+
+        log_activity("pGIS.shp_to_postgis",
+                     uri=uri,
+                     query_text=f"Loaded {shp_path} in windows of rows",
+                     debug=debug)
+        return
+
     # READ THE .SHP INTO A GEOPANDAS.GEODATAFRAME
-    gdf = gpd.read_file(shp_path)
+    gdf = gpd.read_file(shp_path, layer=layer)
 
     # REMOVE ROWS WITH NULL GEOMETRY
     gdf = gdf[gdf['geometry'].notnull()]
@@ -923,56 +1798,126 @@ def postgis_to_shp(
         output_folder: str,
         uri: str,
         geom_col: str = 'geom',
-        debug: bool = False
-):
+        debug: bool = False,
+        chunksize: int = None,
+        raise_errors: bool = False
+) -> Union[str, None]:
     """
     Write a spatial PostGIS table to a shapfile using ``query_geo_table().to_file()``
 
+    If ``chunksize`` is provided, the table is streamed from a server-side cursor and
+    appended to the shapefile one chunk at a time.
+
     :param table_name: 'name_of_the_table'
     :param output_folder: r'c:\\path\\to\\your\\output\\shapefile\\folder'
     :param uri: connection string
     :param geom_col: 'geom' is default spatial column name in postGIS
-    :return: None
+    :param chunksize: number of rows to hold in memory at once, or ``None`` to read the whole table
+    :param raise_errors: raise any error instead of printing it and carrying on
+    :return: path to the shapefile, or ``None`` if the export failed
     """
 
+    out_shp = os.path.join(output_folder, f'{table_name}.shp')
+
     try:
         print(f'## Creating shapefile from {table_name}')
-        df = query_geo_table(f'SELECT * FROM {table_name}',
-                             uri=uri,
-                             geom_col=geom_col,
-                             debug=debug)
+        result = query_geo_table(f'SELECT * FROM {table_name}',
+                                 uri=uri,
+                                 geom_col=geom_col,
+                                 chunksize=chunksize,
+                                 debug=debug)
+
+        chunks = result if chunksize else [result]
 
-        # Convert any boolean column types to strings
-        for c in df.columns:
-            datatype = df[c].dtype.name
-            if datatype == 'bool':
-                df[c] = df[c].astype(str)
+        for chunk_number, df in enumerate(chunks):
 
-        out_shp = os.path.join(output_folder, f'{table_name}.shp')
-        df.to_file(out_shp)
+            # Convert any boolean column types to strings
+            for c in df.columns:
+                datatype = df[c].dtype.name
+                if datatype == 'bool':
+                    df[c] = df[c].astype(str)
+
+            if chunk_number == 0:
+                df.to_file(out_shp)
+            else:
+                df.to_file(out_shp, mode="a")
 
         log_activity("pGIS.postgis_to_shp",
                      uri=uri,
-                     query_text="Saved .SHP from {table_name} to {out_shp}",
+                     query_text=f"Saved .SHP from {table_name} to {out_shp}",
                      debug=debug)
 
-    except:
+    except Exception:
+        if raise_errors:
+            raise
+
         print("## -> an error occured:")
         print(sys.exc_info()[0])
+        return None
 
+    return out_shp
 
-def dump_all_spatial_tables_to_shapefiles(
+
+def _export_table_to_shp(
+        table_name: str,
         output_folder: str,
         uri: str,
+        chunksize: int,
         debug: bool = False
-):
+) -> dict:
+    """
+    Export one table for ``dump_all_spatial_tables_to_shapefiles()``, and report how it went.
+    Defined at module level so a process pool can run it.
+    """
+    start_time = time.time()
+
+    result = {"table": table_name, "path": None, "seconds": None, "bytes": 0, "error": None}
+
+    try:
+        result["path"] = postgis_to_shp(table_name, output_folder, uri, chunksize=chunksize,
+                                        raise_errors=True, debug=debug)
+
+        # A shapefile is several files with the same name: .shp, .shx, .dbf, .prj, .cpg
+        stem = os.path.splitext(result["path"])[0]
+        for extension in [".shp", ".shx", ".dbf", ".prj", ".cpg"]:
+            if os.path.exists(stem + extension):
+                result["bytes"] += os.path.getsize(stem + extension)
+
+    except Exception as error:
+        result["error"] = f"{type(error).__name__}: {error}"
+
+    result["seconds"] = round(time.time() - start_time, 2)
+
+    # Worker processes don't run atexit hooks, so write any queued log records now
+    flush_logs()
+
+    return result
+
+
+def dump_all_spatial_tables_to_shapefiles(
+        output_folder: str,
+        uri: str,
+        debug: bool = False,
+        workers: int = 1,
+        chunksize: int = None
+) -> list:
     """
     Write all spatial tables in a PostGIS database to a subfolder of the output_folder.
 
+    With ``workers`` above 1 the tables are exported at the same time by a pool of processes,
+    each with its own database connection. If ``chunksize`` is provided, every table is streamed
+    ``chunksize`` rows at a time, and its shapefile's column types come from the first chunk.
+
+    A table that fails doesn't stop the others. The run ends with a summary of
+    how long each table took and how big its shapefile is.
+
     :param output_folder: folder path, e.g. r'C:\Egnyte\Shared\SERVICE_AREA\Analytics\data\Projects\El Dorado'
     :param uri: connection string
-    :return:
+    :param workers: number of tables to export at once
+    :param chunksize: number of rows each worker holds in memory at once, or ``None`` to read whole tables
+    :return: list with a dict for each table, with keys ``table``, ``path``, ``seconds``, ``bytes`` and ``error``
     """
+    start_time = time.time()
 
     database_name = deconstruct_uri(uri)["database"]
 
@@ -988,44 +1933,61 @@ def dump_all_spatial_tables_to_shapefiles(
 
     # Get a list of all spatial tables and export each one
     spatial_tables = get_list_of_spatial_tables_in_db(uri, debug=debug)
-    for table in spatial_tables:
-        postgis_to_shp(table, dump_folder, uri=uri, debug=debug)
+
+    if workers > 1 and len(spatial_tables) > 1:
+        # Start the biggest tables first, so one doesn't end up running on its own at the end
+        spatial_tables = sorted(spatial_tables, key=get_catalog(uri).total_bytes, reverse=True)
+
+        # Spawn fresh worker processes rather than forking this one, which may have other threads holding locks
+        # (like the log writer's) and has connections that a forked copy would share
+        with ProcessPoolExecutor(max_workers=min(workers, len(spatial_tables)),
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = [executor.submit(_export_table_to_shp, table, dump_folder, uri, chunksize, debug)
+                       for table in spatial_tables]
+            results = [future.result() for future in futures]
+    else:
+        results = [_export_table_to_shp(table, dump_folder, uri, chunksize, debug) for table in spatial_tables]
+
+    # Summarize the run
+    print(f'## EXPORTED {database_name} to {dump_folder}')
+    for result in results:
+        if result["error"]:
+            print(f'## -> {result["table"]} FAILED after {result["seconds"]} seconds: {result["error"]}')
+        else:
+            megabytes = round(result["bytes"] / 1024 / 1024, 1)
+            print(f'## -> {result["table"]}: {megabytes} MB in {result["seconds"]} seconds')
+
+    n_failed = len([r for r in results if r["error"]])
+    total_megabytes = round(sum(r["bytes"] for r in results) / 1024 / 1024, 1)
+    runtime = round(time.time() - start_time, 2)
+    print(f'## {len(results) - n_failed} of {len(results)} tables, {total_megabytes} MB in {runtime} seconds')
+
+    return results
 
 
 def dump_database_to_sql_file(
         backup_folder: str,
         uri: str,
-        debug: bool = True
-):
-    """ Save a database stored on a host to a .sql file
+        debug: bool = True,
+        dump_format: str = "plain",
+        jobs: int = 4,
+        compression: Union[int, str] = 0
+) -> str:
+    """ Save a database stored on a host to a .sql file with ``pg_dump``.
+
+    Use ``dump_format='directory'`` for a directory-format archive instead, dumped ``jobs``
+    tables at a time, which ``load_database_file()`` can restore in parallel.
+    See ``postGIS_tools.backup_engine`` for backing up many databases at once.
 
     :param backup_folder: '/Users/my_name/Desktop/backup_folder'
     :param uri: connection string
-    :return:
+    :param dump_format: ``'plain'``, ``'directory'`` or ``'custom'``
+    :param jobs: number of tables to dump at once, for the directory format
+    :param compression: ``pg_dump --compress`` value. ``0`` (the default) for none, so a plain dump is a ``.sql`` file
+    :return: path to the backup
+    :raises subprocess.CalledProcessError: if ``pg_dump`` fails
     """
+    result = dump_database(backup_folder, uri, dump_format=dump_format, jobs=jobs, compression=compression,
+                           debug=debug)
 
-    # Get a string for today's date, like '2019_02_26'
-    today = str(datetime.now()).split(' ')[0].replace('-', '_')
-
-    database_name = deconstruct_uri(uri)["database"]
-
-    # USE PG_DUMP VIA COMMAND LINE TO SAVE A .SQL FILE
-    sql_name = f'{database_name}_{today}.sql'
-    sql_file = os.path.join(backup_folder, sql_name)
-
-    if debug:
-        print(f'## Using pg_dump to back up {database_name} to {sql_name}')
-
-    log_activity('pGIS.dump_database_to_sql_file',
-                 uri=uri,
-                query_text=f"Using pg_dump to create {sql_name}",
-                 debug=debug)
-
-    system_call = f'pg_dump {uri} > "{sql_file}" '
-
-    # RUN THE COMMAND FROM COMMAND LINE
-    if debug:
-        print(system_call)
-    os.system(system_call)
-
-    return sql_file
\ No newline at end of file
+    return result["path"]
@@ -0,0 +1,842 @@
+"""
+Overview of ``hexgrid.py``
+--------------------------
+
+Build hexagon grids on the client with ``numpy`` instead of with the ``hex_grid()`` SQL function.
+
+The hexagons are laid out on exactly the same lattice as ``hex_grid()`` in
+``postGIS_tools.queries.hexagon_grid``: for an area of ``size`` square km, each hexagon is
+``4q`` wide and ``2h`` tall, where
+
+    - ``q = floor(sqrt(size * 1,000,000 / (sqrt(3) * 1.5)) / 2)``
+    - ``h = ceil(sqrt(size * 1,000,000 / (sqrt(3) * 1.5)) / 2 * sqrt(3))``
+
+Columns of hexagons are ``6q`` apart starting at the rounded ``xmin`` of the extent, rows are ``2h``
+apart starting at the rounded ``ymin``, and every lattice point holds two hexagons: one with its
+left corner on the point, and one shifted by ``(3q, h)``.
+
+Every vertex is computed at once with array math, encoded straight to 129-byte EWKB polygons,
+and streamed into the table with a binary ``COPY``, so the database only has to store the rows.
+
+For grids too big to send over the network, ``make_hex_grid_in_tiles()`` splits the same lattice
+into tiles and has the database build them with ``hex_grid()`` over several connections at once.
+
+To count and sum points per hexagon, ``bin_points_to_hexagons()`` works out each point's cell
+with arithmetic on the lattice instead of a spatial join, and only the cells that got points are kept.
+
+Examples
+--------
+
+    >>> from postGIS_tools.hexgrid import make_hex_grid
+    >>> make_hex_grid("study_area", 2272, "hexagons", 0.1, uri, debug=True)
+    ## COPY 1048576 hexagons into hexagons in 2.1 seconds
+    >>> make_hex_grid_in_tiles("state_boundary", 2272, "state_hexagons", 0.1, uri, workers=8, clip=True)
+    >>> origin = hex_grid_origin("study_area", 2272, uri)
+    >>> bins = bin_points_to_hexagons("SELECT geom, speed FROM gps_pings", 2272, 0.1, uri=uri,
+    ...                               value_columns=["speed"], origin=origin, output_table_name="ping_hexagons")
+
+"""
+import math
+import struct
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+from postGIS_tools.catalog import invalidate_catalog
+from postGIS_tools.connections import get_connection, get_pool
+from postGIS_tools.copy_engine import BINARY_HEADER, BINARY_TRAILER, DEFAULT_CHUNKSIZE, IteratorFile, CopyPipe, \
+    geometry_sql_type, write_dataframe
+from postGIS_tools.logs import log_activity
+from postGIS_tools.queries.hexagon_grid import sql_for_extent, sql_to_keep_intersecting_hexagons, \
+    sql_to_fill_hex_grid_tile, sql_to_finalize_hex_grid_tiles, hex_grid_function
+
+# Each hexagon is a polygon with one closed ring of 7 points
+HEXAGON_POINTS = 7
+
+# Little-endian EWKB: byte order, type (POLYGON with the SRID flag), SRID, number of rings, number of points
+_EWKB_POLYGON = 3 | 0x20000000
+EWKB_HEADER_BYTES = 17
+EWKB_HEXAGON_BYTES = EWKB_HEADER_BYTES + HEXAGON_POINTS * 16
+
+HEX_GRID_SIGNATURE = "hex_grid(float, float, float, float, float, integer, integer, integer)"
+
+# Hexagon ids pack the lattice column into the high 32 bits and the row (offset to be positive) into the low 32 bits
+_HEX_ID_ROW_OFFSET = 2 ** 31
+
+# Number of points to assign to cells at a time when reading them from the database
+DEFAULT_BINNING_CHUNKSIZE = 1000000
+
+
+################################################################################
+# LATTICE MATH
+################################################################################
+
+
+def hexagon_dimensions(size: float) -> tuple:
+    """
+    Quarter-width and half-height of the hexagons ``hex_grid()`` makes for a given area.
+    Both are rounded to whole units, so the actual area is slightly off the requested one.
+
+    :param size: area of each hexagon in square km (in the units of a projection in meters)
+    :return: tuple of (quarter width, half height) as ``int``
+    """
+    area_m2 = size * 1000000.0
+    quarter_width = math.sqrt(area_m2 / (math.sqrt(3.0) * (3.0 / 2.0))) / 2.0
+
+    q = math.floor(quarter_width)
+    h = math.ceil(quarter_width * math.sqrt(3.0))
+
+    if q < 1:
+        raise ValueError(f"A size of {size} square km is too small to make hexagons with whole-unit corners")
+
+    return q, h
+
+
+def hexagon_template(
+        q: int,
+        h: int
+) -> np.ndarray:
+    """
+    The ring of a hexagon whose left corner is at (0, 0), in the same vertex order as ``hex_grid()``.
+
+    :return: (7 x 2) array of coordinates
+    """
+    return np.array([[0, 0], [q, h], [3 * q, h], [4 * q, 0], [3 * q, -h], [q, -h], [0, 0]], dtype=np.float64)
+
+
+def lattice_series(
+        start: float,
+        stop: float,
+        step: int
+) -> np.ndarray:
+    """ Same values as ``generate_series(start, stop, step)``, with the ends rounded like ``::INTEGER`` does """
+    start, stop = int(np.rint(start)), int(np.rint(stop))
+
+    if stop < start:
+        return np.zeros(0, dtype=np.int64)
+
+    return np.arange(start, stop + 1, step, dtype=np.int64)
+
+
+def hexagon_coordinates(
+        x_origins: np.ndarray,
+        y_origins: np.ndarray,
+        q: int,
+        h: int
+) -> np.ndarray:
+    """
+    Every vertex of the pair of hexagons at each lattice point, for every combination of ``x_origins`` and ``y_origins``.
+
+    :param x_origins: x values of the lattice columns
+    :param y_origins: y values of the lattice rows
+    :param q: quarter width, from ``hexagon_dimensions()``
+    :param h: half height, from ``hexagon_dimensions()``
+    :return: (n x 7 x 2) array, with the pair of hexagons for each lattice point next to each other
+    """
+    xx, yy = np.meshgrid(x_origins.astype(np.float64), y_origins.astype(np.float64), indexing="ij")
+
+    # (columns x rows x 2 hexagons x 2 coordinates)
+    origins = np.empty(xx.shape + (2, 2), dtype=np.float64)
+    origins[..., 0, 0] = xx
+    origins[..., 0, 1] = yy
+    origins[..., 1, 0] = xx + 3 * q
+    origins[..., 1, 1] = yy + h
+
+    return origins.reshape(-1, 1, 2) + hexagon_template(q, h)[None, :, :]
+
+
+def hexagons_to_ewkb(
+        coordinates: np.ndarray,
+        srid: int
+) -> np.ndarray:
+    """
+    Encode hexagon rings as little-endian EWKB polygons, all at once.
+
+    :param coordinates: (n x 7 x 2) array from ``hexagon_coordinates()``
+    :param srid: EPSG code to embed in each geometry
+    :return: (n x 129) ``uint8`` array, one row per polygon
+    """
+    n = len(coordinates)
+
+    out = np.empty((n, EWKB_HEXAGON_BYTES), dtype=np.uint8)
+    out[:, :EWKB_HEADER_BYTES] = np.frombuffer(struct.pack("<BIIII", 1, _EWKB_POLYGON, srid, 1, HEXAGON_POINTS),
+                                               dtype=np.uint8)
+    out[:, EWKB_HEADER_BYTES:] = np.ascontiguousarray(coordinates, dtype="<f8").view(np.uint8).reshape(n, -1)
+
+    return out
+
+
+def iterate_hexagon_chunks(
+        extent: tuple,
+        size: float,
+        chunksize: int = DEFAULT_CHUNKSIZE
+):
+    """
+    Yield the hexagons covering an extent, a few lattice columns at a time.
+
+    :param extent: (xmin, ymin, xmax, ymax) in a projection in meters
+    :param size: area of each hexagon in square km
+    :param chunksize: roughly how many hexagons to hold in memory at once
+    :return: generator of (n x 7 x 2) arrays from ``hexagon_coordinates()``
+    """
+    xmin, ymin, xmax, ymax = extent
+    q, h = hexagon_dimensions(size)
+
+    x_origins = lattice_series(xmin, xmax, 6 * q)
+    y_origins = lattice_series(ymin, ymax, 2 * h)
+
+    if len(y_origins) == 0:
+        return
+
+    columns_per_chunk = max(1, chunksize // (2 * len(y_origins)))
+
+    for start in range(0, len(x_origins), columns_per_chunk):
+        yield hexagon_coordinates(x_origins[start:start + columns_per_chunk], y_origins, q, h)
+
+
+def plan_lattice_tiles(
+        extent: tuple,
+        size: float,
+        n_tiles: int
+) -> list:
+    """
+    Split the lattice covering an extent into about ``n_tiles`` rectangles of whole lattice points,
+    as column strips (split into row bands as well if there are fewer columns than tiles).
+    Each tile's extent runs from its first lattice point to its last, so when ``hex_grid()`` is run
+    on each one the tiles fit together with no gaps and no duplicate hexagons.
+
+    :param extent: (xmin, ymin, xmax, ymax) in a projection in meters
+    :param size: area of each hexagon in square km
+    :param n_tiles: number of tiles to aim for
+    :return: list of (xmin, ymin, xmax, ymax) tuples of ``int``
+    """
+    xmin, ymin, xmax, ymax = extent
+    q, h = hexagon_dimensions(size)
+
+    x_origins = lattice_series(xmin, xmax, 6 * q)
+    y_origins = lattice_series(ymin, ymax, 2 * h)
+
+    if len(x_origins) == 0 or len(y_origins) == 0:
+        return []
+
+    n_column_strips = min(len(x_origins), max(1, n_tiles))
+    n_row_bands = min(len(y_origins), math.ceil(max(1, n_tiles) / n_column_strips))
+
+    return [(int(columns[0]), int(rows[0]), int(columns[-1]), int(rows[-1]))
+            for columns in np.array_split(x_origins, n_column_strips)
+            for rows in np.array_split(y_origins, n_row_bands)]
+
+
+################################################################################
+# LOAD A GRID INTO THE DATABASE
+################################################################################
+
+
+def _hex_grid_extent(
+        extent_table: str,
+        epsg: int,
+        uri: str,
+        estimated: bool = False
+) -> tuple:
+    """
+    Get the extent that ``sql_to_make_hex_grid()`` covers, with its corners projected into ``epsg``.
+    See ``sql_for_extent()``.
+    """
+    query = f"""
+        WITH extent AS ({sql_for_extent(extent_table, estimated=estimated)}
+        ),
+        corners AS (
+            SELECT ST_Transform(ST_SetSRID(ST_MakePoint(ST_XMin(box), ST_YMin(box)), srid), {epsg}) AS low,
+                   ST_Transform(ST_SetSRID(ST_MakePoint(ST_XMax(box), ST_YMax(box)), srid), {epsg}) AS high
+            FROM extent
+        )
+        SELECT ST_X(low), ST_Y(low), ST_X(high), ST_Y(high) FROM corners"""
+
+    with get_connection(uri) as connection:
+        cursor = connection.cursor()
+        cursor.execute(query)
+        extent = cursor.fetchone()
+        cursor.close()
+
+    if extent is None or None in extent:
+        raise ValueError(f"{extent_table} has no geometries to cover with hexagons")
+
+    return extent
+
+
+def hex_grid_table_sql(
+        output_table_name: str,
+        epsg: int
+) -> str:
+    """ SQL to create an empty table shaped like the one ``sql_to_make_hex_grid()`` makes """
+    return f"""
+        DROP TABLE IF EXISTS {output_table_name};
+        CREATE TABLE {output_table_name} (
+          gid SERIAL NOT NULL PRIMARY KEY,
+          geom GEOMETRY(POLYGON, {epsg}) NOT NULL
+        );"""
+
+
+def encode_hexagon_rows(
+        coordinates: np.ndarray,
+        srid: int
+) -> bytes:
+    """
+    Encode hexagons as binary ``COPY`` rows holding just the ``geom`` field.
+
+    :param coordinates: (n x 7 x 2) array from ``hexagon_coordinates()``
+    :param srid: EPSG code to embed in each geometry
+    :return: ``bytes``
+    """
+    n = len(coordinates)
+
+    rows = np.empty((n, 6 + EWKB_HEXAGON_BYTES), dtype=np.uint8)
+    rows[:, :6] = np.frombuffer(struct.pack(">hi", 1, EWKB_HEXAGON_BYTES), dtype=np.uint8)
+    rows[:, 6:] = hexagons_to_ewkb(coordinates, srid)
+
+    return rows.tobytes()
+
+
+def copy_hexagons(
+        chunks,
+        output_table_name: str,
+        epsg: int,
+        cursor
+) -> int:
+    """
+    Stream chunks of hexagons into the ``geom`` column of an existing table with a single binary ``COPY``.
+
+    :param chunks: iterable of (n x 7 x 2) arrays from ``hexagon_coordinates()``
+    :param output_table_name: 'hexagon_layer'
+    :param epsg: SRID of the hexagons
+    :param cursor: open ``psycopg2`` cursor
+    :return: number of hexagons copied
+    """
+    def encoded():
+        yield BINARY_HEADER
+        for chunk in chunks:
+            yield encode_hexagon_rows(chunk, epsg)
+        yield BINARY_TRAILER
+
+    cursor.copy_expert(f"COPY {output_table_name} (geom) FROM STDIN WITH (FORMAT binary)",
+                       IteratorFile(encoded()), size=1024 * 1024)
+
+    return cursor.rowcount
+
+
+def make_hex_grid(
+        extent_table: str,
+        epsg: int,
+        output_table_name: str,
+        size: float,
+        uri: str,
+        estimated_extent: bool = False,
+        clip: bool = False,
+        chunksize: int = DEFAULT_CHUNKSIZE,
+        debug: bool = False
+) -> int:
+    """
+    Make a table of hexagons covering ``extent_table``, matching what ``sql_to_make_hex_grid()`` makes,
+    but with the hexagons computed here and loaded with ``COPY`` instead of built by the database.
+    The table gets a spatial index and fresh statistics.
+
+    :param extent_table: 'name_of_table_to_cover'
+    :param epsg: integer for EPSG you want the hexagons to be in. Must be a projection in meters
+    :param output_table_name: 'hexagon_layer'
+    :param size: float value, 1 = 1 square KM
+    :param uri: connection string
+    :param estimated_extent: use ``ST_EstimatedExtent()`` instead of scanning ``extent_table`` for its extent
+    :param clip: only keep hexagons that touch a geometry in ``extent_table``
+    :param chunksize: roughly how many hexagons to encode and send at a time
+    :return: number of hexagons
+    """
+    start_time = time.time()
+
+    extent = _hex_grid_extent(extent_table, epsg, uri, estimated=estimated_extent)
+
+    if debug:
+        print(f'## Making {size} sq km hexagons over {extent_table} ({extent}) in {output_table_name}')
+
+    with get_connection(uri) as connection:
+        cursor = connection.cursor()
+
+        cursor.execute(hex_grid_table_sql(output_table_name, epsg))
+        n_hexagons = copy_hexagons(iterate_hexagon_chunks(extent, size, chunksize=chunksize),
+                                   output_table_name, epsg, cursor)
+
+        if clip:
+            keep = sql_to_keep_intersecting_hexagons(extent_table, f"{output_table_name}.geom")
+            cursor.execute(f"DELETE FROM {output_table_name} WHERE NOT {keep};")
+            n_hexagons -= cursor.rowcount
+
+        cursor.execute(f"CREATE INDEX gix_{output_table_name} ON {output_table_name} USING GIST (geom);")
+        cursor.execute(f"ANALYZE {output_table_name};")
+
+        cursor.close()
+
+    invalidate_catalog(uri)
+
+    if debug:
+        runtime = round(time.time() - start_time, 2)
+        print(f'## COPY {n_hexagons} hexagons into {output_table_name} in {runtime} seconds')
+
+    log_activity("pGIS.make_hex_grid",
+                 uri=uri,
+                 query_text=f"Made {n_hexagons} hexagons of {size} sq km over {extent_table} in {output_table_name}",
+                 debug=debug)
+
+    return n_hexagons
+
+
+################################################################################
+# GENERATE A GRID ON THE SERVER, ONE TILE PER CONNECTION
+################################################################################
+
+
+def make_hex_grid_in_tiles(
+        extent_table: str,
+        epsg: int,
+        output_table_name: str,
+        size: float,
+        uri: str,
+        workers: int = 4,
+        tiles_per_worker: int = 4,
+        estimated_extent: bool = False,
+        clip: bool = False,
+        debug: bool = False
+) -> int:
+    """
+    Make a table of hexagons covering ``extent_table`` with the ``hex_grid()`` SQL function,
+    running it on tiles of the grid over ``workers`` connections at once.
+
+    The tiles are aligned to the hexagon lattice (see ``plan_lattice_tiles()``) and written to a uniquely named
+    ``UNLOGGED`` staging table, which is then copied into the final table in tile order, indexed and analyzed.
+    Each tile runs in its own backend, so the run time shrinks with the number of cores on the database host.
+
+    :param extent_table: 'name_of_table_to_cover'
+    :param epsg: integer for EPSG you want the hexagons to be in. Must be a projection in meters
+    :param output_table_name: 'hexagon_layer'
+    :param size: float value, 1 = 1 square KM
+    :param uri: connection string
+    :param workers: number of tiles to generate at once. Capped at the connection pool size
+    :param tiles_per_worker: tiles per worker, so workers that finish early pick up more of the grid
+    :param estimated_extent: use ``ST_EstimatedExtent()`` instead of scanning ``extent_table`` for its extent
+    :param clip: only keep hexagons that touch a geometry in ``extent_table``
+    :return: number of hexagons
+    """
+    start_time = time.time()
+
+    extent = _hex_grid_extent(extent_table, epsg, uri, estimated=estimated_extent)
+
+    workers = max(1, min(workers, get_pool(uri).max_size))
+    tiles = plan_lattice_tiles(extent, size, workers * tiles_per_worker)
+
+    # A unique name in the output's schema, so no existing table is ever replaced or dropped
+    schema_prefix = output_table_name.rsplit(".", 1)[0] + "." if "." in output_table_name else ""
+    staging_table = f"{schema_prefix}pgis_hex_tiles_{uuid.uuid4().hex[:12]}"
+
+    if debug:
+        print(f'## Making {size} sq km hexagons over {extent_table} in {len(tiles)} tiles with {workers} workers')
+
+    with get_connection(uri) as connection:
+        cursor = connection.cursor()
+
+        cursor.execute(f"SELECT to_regprocedure('{HEX_GRID_SIGNATURE}') IS NULL")
+        if cursor.fetchone()[0]:
+            cursor.execute(hex_grid_function)
+
+        cursor.execute(f"CREATE UNLOGGED TABLE {staging_table} (tile INTEGER, geom GEOMETRY(POLYGON, {epsg}));")
+        cursor.close()
+
+    def fill_tile(tile_id, tile_extent):
+        query = sql_to_fill_hex_grid_tile(staging_table, tile_id, tile_extent, epsg, size,
+                                          extent_table=extent_table if clip else None)
+
+        with get_connection(uri) as tile_connection:
+            tile_cursor = tile_connection.cursor()
+            tile_cursor.execute(query)
+            n_rows = tile_cursor.rowcount
+            tile_cursor.close()
+
+        return n_rows
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            n_hexagons = sum(executor.map(fill_tile, range(len(tiles)), tiles))
+
+        if debug:
+            runtime = round(time.time() - start_time, 2)
+            print(f'## -> Generated {n_hexagons} hexagons in {runtime} seconds, finalizing {output_table_name}')
+
+        with get_connection(uri) as connection:
+            cursor = connection.cursor()
+            cursor.execute(sql_to_finalize_hex_grid_tiles(staging_table, epsg, output_table_name))
+            cursor.close()
+
+    except Exception:
+        with get_connection(uri) as connection:
+            cursor = connection.cursor()
+            cursor.execute(f"DROP TABLE IF EXISTS {staging_table};")
+            cursor.close()
+        raise
+
+    finally:
+        invalidate_catalog(uri)
+
+    if debug:
+        runtime = round(time.time() - start_time, 2)
+        print(f'## Made {n_hexagons} hexagons in {output_table_name} in {runtime} seconds')
+
+    log_activity("pGIS.make_hex_grid_in_tiles",
+                 uri=uri,
+                 query_text=f"Made {n_hexagons} hexagons of {size} sq km over {extent_table} in {output_table_name}, "
+                            f"{len(tiles)} tiles with {workers} workers",
+                 debug=debug)
+
+    return n_hexagons
+
+
+################################################################################
+# BIN POINTS INTO HEXAGONS
+################################################################################
+
+
+def hexagon_cells(
+        x: np.ndarray,
+        y: np.ndarray,
+        size: float,
+        origin: tuple = (0, 0)
+) -> tuple:
+    """
+    Find the hexagon that each point falls in, with arithmetic only.
+
+    Measured in units of ``q`` across and ``h`` up from ``origin``, hexagon centres sit at ``x = 2 + 3 * column``,
+    and at ``y = 2 * row`` for even columns or ``y = 2 * row + 1`` for odd ones. Inside a hexagon,
+    ``|dx| + |dy| <= 2`` and ``|dy| <= 1`` from its centre. So each point only has two candidates (the nearest
+    centre in the columns on either side of it) and it belongs to whichever one is closer by ``|dx| + |dy|``.
+
+    :param x: x coordinates, in the projection of the grid
+    :param y: y coordinates, in the projection of the grid
+    :param size: area of each hexagon in square km
+    :param origin: any lattice point of the grid, e.g. from ``hex_grid_origin()``
+    :return: tuple of (column, row) ``int64`` arrays
+    """
+    q, h = hexagon_dimensions(size)
+
+    u = (np.asarray(x, dtype=np.float64) - origin[0]) / q
+    v = (np.asarray(y, dtype=np.float64) - origin[1]) / h
+
+    left_column = np.floor((u - 2.0) / 3.0)
+
+    best_column = best_row = best_distance = None
+
+    for column in [left_column, left_column + 1]:
+        parity = np.mod(column, 2.0)
+        row = np.rint((v - parity) / 2.0)
+        distance = np.abs(u - (2.0 + 3.0 * column)) + np.abs(v - (2.0 * row + parity))
+
+        if best_distance is None:
+            best_column, best_row, best_distance = column, row, distance
+        else:
+            closer = distance < best_distance
+            best_column = np.where(closer, column, best_column)
+            best_row = np.where(closer, row, best_row)
+
+    return best_column.astype(np.int64), best_row.astype(np.int64)
+
+
+def hexagon_ids(
+        columns: np.ndarray,
+        rows: np.ndarray
+) -> np.ndarray:
+    """ Pack each (column, row) cell into a single ``int64`` hexagon id """
+    return (np.asarray(columns, dtype=np.int64) << 32) | (np.asarray(rows, dtype=np.int64) + _HEX_ID_ROW_OFFSET)
+
+
+def hexagon_cells_from_ids(ids: np.ndarray) -> tuple:
+    """ Unpack hexagon ids from ``hexagon_ids()`` back into (column, row) arrays """
+    ids = np.asarray(ids, dtype=np.int64)
+
+    return ids >> 32, (ids & 0xFFFFFFFF) - _HEX_ID_ROW_OFFSET
+
+
+def hexagon_cell_coordinates(
+        columns: np.ndarray,
+        rows: np.ndarray,
+        size: float,
+        origin: tuple = (0, 0)
+) -> np.ndarray:
+    """
+    The rings of the hexagons at each (column, row) cell from ``hexagon_cells()``.
+
+    :return: (n x 7 x 2) array, ready for ``hexagons_to_ewkb()``
+    """
+    q, h = hexagon_dimensions(size)
+    columns = np.asarray(columns, dtype=np.int64)
+
+    left_corners = np.empty((len(columns), 1, 2), dtype=np.float64)
+    left_corners[:, 0, 0] = origin[0] + 3 * q * columns
+    left_corners[:, 0, 1] = origin[1] + h * (2 * np.asarray(rows, dtype=np.int64) + np.mod(columns, 2))
+
+    return left_corners + hexagon_template(q, h)[None, :, :]
+
+
+def _sum_points_by_cell(
+        x: np.ndarray,
+        y: np.ndarray,
+        size: float,
+        origin: tuple,
+        values: dict
+) -> pd.DataFrame:
+    """ Count the points in each hexagon and add up their ``values``, with one row per hexagon id """
+    ids = hexagon_ids(*hexagon_cells(x, y, size, origin=origin))
+
+    # factorize() hashes instead of sorting, which is what keeps this linear in the number of points
+    codes, unique_ids = pd.factorize(ids)
+
+    bins = {"hex_id": unique_ids, "count": np.bincount(codes, minlength=len(unique_ids))}
+    for name, value in values.items():
+        bins[f"sum_{name}"] = np.bincount(codes, weights=value, minlength=len(unique_ids))
+
+    return pd.DataFrame(bins)
+
+
+def sql_to_copy_point_coordinates(
+        query: str,
+        epsg: int,
+        value_columns: list = None,
+        geom_col: str = 'geom'
+) -> str:
+    """
+    SQL to ``COPY`` the coordinates of the points from a query, projected into ``epsg``, and their ``value_columns``,
+    all as ``DOUBLE PRECISION`` and never ``NULL``, so every row has the same width.
+
+    The projected point gets its own name, so it can't clash with any column of the query (like its own ``geom``).
+
+    :param query: 'SELECT geom, speed FROM gps_pings'
+    :param epsg: EPSG to project the points into
+    :param value_columns: list of numeric columns to send along. Missing values are sent as 0
+    :param geom_col: the name of the geometry column
+    :return: string, valid SQL query
+    """
+    fields = ["ST_X(points._pgis_point)::DOUBLE PRECISION", "ST_Y(points._pgis_point)::DOUBLE PRECISION"]
+    fields += [f'COALESCE(points."{column}"::DOUBLE PRECISION, 0)' for column in value_columns or []]
+
+    return f"""
+        COPY (
+            SELECT {", ".join(fields)}
+            FROM (
+                SELECT ST_Transform(source."{geom_col}", {epsg}) AS _pgis_point, source.*
+                FROM ({query.strip().rstrip(";")}) AS source
+                WHERE source."{geom_col}" IS NOT NULL AND NOT ST_IsEmpty(source."{geom_col}")
+            ) AS points
+        ) TO STDOUT WITH (FORMAT binary)"""
+
+
+def _copy_point_coordinates(
+        query: str,
+        uri: str,
+        epsg: int,
+        value_columns: list,
+        geom_col: str,
+        chunksize: int
+):
+    """
+    Stream the coordinates of the points from a query (projected into ``epsg``) and their ``value_columns``
+    with ``sql_to_copy_point_coordinates()``, reading each block straight into ``numpy`` with a fixed-width record type.
+
+    :return: generator of tuples of (x, y, dict of values), with up to ``chunksize`` points each
+    """
+    copy_query = sql_to_copy_point_coordinates(query, epsg, value_columns=value_columns, geom_col=geom_col)
+    n_fields = 2 + len(value_columns)
+
+    record = np.dtype([("n_fields", ">i2")] + [item for i in range(n_fields)
+                                               for item in [(f"length_{i}", ">i4"), (f"value_{i}", ">f8")]])
+
+    pipe = CopyPipe()
+
+    def read_from_database():
+        try:
+            with get_connection(uri) as connection:
+                cursor = connection.cursor()
+                cursor.copy_expert(copy_query, pipe)
+                cursor.close()
+        except BaseException as error:
+            pipe.finish(error)
+        else:
+            pipe.finish()
+
+    reader = threading.Thread(target=read_from_database, name="pgis-hexbin", daemon=True)
+    reader.start()
+
+    try:
+        header = pipe.read(len(BINARY_HEADER))
+        if header and header != BINARY_HEADER:
+            raise IOError("The COPY of points didn't start with the binary COPY header")
+
+        buffer = bytearray()
+        while True:
+            block = pipe.read(chunksize * record.itemsize - len(buffer))
+            buffer += block
+
+            n_records = len(buffer) // record.itemsize
+            if n_records and (len(buffer) >= chunksize * record.itemsize or not block):
+                records = np.frombuffer(bytes(buffer[:n_records * record.itemsize]), dtype=record)
+                del buffer[:n_records * record.itemsize]
+
+                yield (records["value_0"].astype(np.float64),
+                       records["value_1"].astype(np.float64),
+                       {column: records[f"value_{i + 2}"].astype(np.float64) for i, column in enumerate(value_columns)})
+
+            if not block:
+                break
+
+        if header and bytes(buffer) != BINARY_TRAILER:
+            raise IOError(f"The COPY of points ended with {len(buffer)} unexpected bytes")
+
+    except BaseException:
+        pipe.abort()
+        raise
+
+    finally:
+        reader.join()
+
+
+def _geodataframe_point_coordinates(
+        gdf: gpd.GeoDataFrame,
+        epsg: int,
+        value_columns: list
+):
+    """ Get the coordinates of the points in a ``GeoDataFrame`` (projected into ``epsg``) and their ``value_columns`` """
+    if gdf.crs is not None and gdf.crs.to_epsg() != epsg:
+        gdf = gdf.to_crs(epsg)
+
+    geometries = np.asarray(gdf.geometry.values, dtype=object)
+    keep = ~(shapely.is_missing(geometries) | shapely.is_empty(geometries))
+
+    values = {column: np.nan_to_num(gdf[column].to_numpy(dtype=np.float64, na_value=0.0)[keep])
+              for column in value_columns}
+
+    yield shapely.get_x(geometries[keep]), shapely.get_y(geometries[keep]), values
+
+
+def hex_grid_origin(
+        extent_table: str,
+        epsg: int,
+        uri: str,
+        estimated_extent: bool = False
+) -> tuple:
+    """
+    The first lattice point of the grid that ``make_hex_grid()`` or ``sql_to_make_hex_grid()`` makes over ``extent_table``.
+    Pass it as the ``origin`` of ``bin_points_to_hexagons()`` to bin points into the same hexagons.
+
+    :return: tuple of (x, y)
+    """
+    xmin, ymin, _, _ = _hex_grid_extent(extent_table, epsg, uri, estimated=estimated_extent)
+
+    return int(np.rint(xmin)), int(np.rint(ymin))
+
+
+def bin_points_to_hexagons(
+        points,
+        epsg: int,
+        size: float,
+        uri: str = None,
+        value_columns: list = None,
+        origin: tuple = (0, 0),
+        output_table_name: str = None,
+        geom_col: str = 'geom',
+        chunksize: int = DEFAULT_BINNING_CHUNKSIZE,
+        debug: bool = False
+) -> pd.DataFrame:
+    """
+    Count the points that fall in each hexagon, and add up their ``value_columns``,
+    without building the hexagons or doing a spatial join.
+
+    Each point's cell is worked out with ``hexagon_cells()`` on the same lattice as ``hex_grid()``,
+    so only the hexagons that got at least one point come back. Points from a query are streamed
+    with a binary ``COPY`` and binned ``chunksize`` at a time, so they never all have to fit in memory.
+    Points exactly on a shared edge go to one of the hexagons, not both.
+
+    :param points: a query like 'SELECT geom, speed FROM gps_pings', or a ``geopandas.GeoDataFrame`` of points
+    :param epsg: integer for EPSG of the hexagons. Must be a projection in meters. The points are projected into it
+    :param size: float value, 1 = 1 square KM
+    :param uri: connection string. Needed for a query, or to write ``output_table_name``
+    :param value_columns: list of numeric columns to add up in each hexagon. Missing values count as 0
+    :param origin: a lattice point of the grid. Use ``hex_grid_origin()`` to match a grid made over a table
+    :param output_table_name: if provided, also write the bins to this table with their hexagons as ``geom``
+    :param geom_col: the name of the geometry column
+    :param chunksize: number of points to bin at a time, for a query
+    :return: ``pandas.DataFrame`` with one row per hexagon: ``hex_id``, ``hex_column``, ``hex_row``,
+             ``count``, and ``sum_{column}`` for each of the ``value_columns``, sorted by ``hex_id``
+    """
+    start_time = time.time()
+    value_columns = list(value_columns or [])
+
+    if isinstance(points, gpd.GeoDataFrame):
+        chunks = _geodataframe_point_coordinates(points, epsg, value_columns)
+        source = "a GeoDataFrame"
+    else:
+        chunks = _copy_point_coordinates(points, uri, epsg, value_columns, geom_col, chunksize)
+        source = points
+
+    if debug:
+        print(f'## Binning points from {source} into {size} sq km hexagons')
+
+    partial_bins = []
+    n_points = 0
+
+    for x, y, values in chunks:
+        partial_bins.append(_sum_points_by_cell(x, y, size, origin, values))
+        n_points += len(x)
+
+    sum_columns = ["count"] + [f"sum_{column}" for column in value_columns]
+
+    if partial_bins:
+        bins = pd.concat(partial_bins, ignore_index=True).groupby("hex_id", sort=True)[sum_columns].sum().reset_index()
+    else:
+        bins = pd.DataFrame({column: np.zeros(0, dtype=np.int64) for column in ["hex_id"] + sum_columns})
+
+    hex_columns, hex_rows = hexagon_cells_from_ids(bins["hex_id"].to_numpy())
+    bins.insert(1, "hex_column", hex_columns)
+    bins.insert(2, "hex_row", hex_rows)
+
+    if debug:
+        runtime = round(time.time() - start_time, 2)
+        print(f'## -> Binned {n_points} points into {len(bins)} hexagons in {runtime} seconds')
+
+    if output_table_name:
+        coordinates = hexagon_cell_coordinates(hex_columns, hex_rows, size, origin=origin)
+        table = bins.assign(geom=[row.tobytes() for row in hexagons_to_ewkb(coordinates, epsg)])
+
+        write_dataframe(table, output_table_name, uri, index=False,
+                        sql_types={"geom": geometry_sql_type("POLYGON", epsg)}, debug=debug)
+
+        with get_connection(uri) as connection:
+            cursor = connection.cursor()
+            cursor.execute(f"""
+                ALTER TABLE {output_table_name} ADD PRIMARY KEY (hex_id);
+                CREATE INDEX gix_{output_table_name} ON {output_table_name} USING GIST (geom);
+                ANALYZE {output_table_name};""")
+            cursor.close()
+
+        invalidate_catalog(uri)
+
+    if uri:
+        log_activity("pGIS.bin_points_to_hexagons",
+                     uri=uri,
+                     query_text=f"Binned {n_points} points from {source} into {len(bins)} hexagons of {size} sq km"
+                                + (f" in {output_table_name}" if output_table_name else ""),
+                     debug=debug)
+
+    return bins
+
+
+if __name__ == "__main__":
+    pass
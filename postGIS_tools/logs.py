@@ -7,26 +7,51 @@ in your ``PostgreSQL`` database. It creates a table named ``db_history``
 and many ``postGIS_tools.functions`` use the ``log_activity()`` function
 to update this table after successfully completing their task.
 
+Log records are queued and written by a background thread, in batches,
+with one multi-row ``INSERT`` per database. Whether ``db_history`` exists is
+checked once per URI and then remembered. Anything still queued is written
+when the interpreter exits, or when you call ``flush_logs()``.
+
+Call ``set_log_mode("sync")`` (or set the ``PGIS_LOG_MODE=sync`` environment
+variable) to write each record immediately instead, e.g. in tests.
+
 Example
 -------
 
     >>> import postGIS_tools as pGIS
-    >>> pGIS.log_activity("my_database", "execute_query", "UPDATE my_table SET my_col = 'my value'", debug=True)
-    Logging to db_history:
-            INSERT INTO db_history (username, function_name, query_text, update_time, user_os, user_cpu)
-                VALUES ('aaron', 'execute_query', 'UPDATE my_table SET my_col = ''my value''',
-                        '2019-11-23 09:00:26 PST', 'Darwin', 'Aaron-MBP.local');
+    >>> pGIS.log_activity("execute_query", uri, "UPDATE my_table SET my_col = 'my value'", debug=True)
+
+            Logging to db_history:
+             execute_query: UPDATE my_table SET my_col = 'my value' @ 2019-11-23 09:00:26 PST
+    >>> pGIS.flush_logs()
 
 """
+import atexit
 import os
+import queue
+import threading
 from datetime import datetime
 from pytz import timezone
 import psycopg2
+import psycopg2.extras
 
 from postGIS_tools.configurations import THIS_SYSTEM, THIS_USER, THIS_COMPUTER, LOCAL_CONFIG_FOLDER
+from postGIS_tools.connections import get_connection
 
 SIMPLE_LOG_FILE = os.path.join(LOCAL_CONFIG_FOLDER, "LOGFILE-postGIS_tools.txt")
 
+# "async" queues records for the background writer, "sync" writes each one right away
+LOG_MODE = os.environ.get("PGIS_LOG_MODE", "async")
+
+# The background writer sends a batch once it has this many records, or after this many seconds
+LOG_BATCH_SIZE = 500
+LOG_FLUSH_SECONDS = 1.0
+
+# URIs where the db_history table is known to exist
+_KNOWN_LOG_TABLES = set()
+_KNOWN_LOG_TABLES_LOCK = threading.Lock()
+
+
 def _make_log_table(
         uri: str,
         debug: bool = True
@@ -54,19 +79,14 @@ def _make_log_table(
         print(f"Making db_history log table within {uri}")
 
     try:
-        connection = psycopg2.connect(uri)
-        cur = connection.cursor()
-        cur.execute(query_to_make_table)
-        cur.close()
-        connection.commit()
+        with get_connection(uri) as connection:
+            cur = connection.cursor()
+            cur.execute(query_to_make_table)
+            cur.close()
 
     except (Exception, psycopg2.DatabaseError) as error:
         print(error)
 
-    finally:
-        if connection is not None:
-            connection.close()
-
 
 def _log_table_exists(
         uri: str,
@@ -81,15 +101,14 @@ def _log_table_exists(
 
     exists_query = "SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'"
 
-    connection = psycopg2.connect(uri)
-    cursor = connection.cursor()
-    cursor.execute(exists_query)
+    with get_connection(uri) as connection:
+        cursor = connection.cursor()
+        cursor.execute(exists_query)
 
-    result = cursor.fetchall()
-    result_list = [x[0] for x in result]
+        result = cursor.fetchall()
+        result_list = [x[0] for x in result]
 
-    cursor.close()
-    connection.close()
+        cursor.close()
 
     if "db_history" in result_list:
         return True
@@ -100,6 +119,178 @@ def _log_table_exists(
         return False
 
 
+def _ensure_log_table(
+        uri: str,
+        debug: bool = False
+):
+    """
+    Make sure the ``db_history`` table exists, checking the database only the first time each URI is seen.
+
+    :param uri: connection string
+    :return: None
+    """
+    with _KNOWN_LOG_TABLES_LOCK:
+        if uri in _KNOWN_LOG_TABLES:
+            return
+
+    if not _log_table_exists(uri=uri, debug=debug):
+        _make_log_table(uri=uri, debug=debug)
+
+    with _KNOWN_LOG_TABLES_LOCK:
+        _KNOWN_LOG_TABLES.add(uri)
+
+
+def _write_log_records(
+        records: list,
+        debug: bool = False
+):
+    """
+    Write a batch of log records to the local text file and to each database's ``db_history`` table.
+
+    :param records: list of dicts made by ``log_activity()``
+    :return: None
+    """
+
+    # Do the text update, opening the file once for the whole batch
+    try:
+        if not os.path.exists(SIMPLE_LOG_FILE):
+            with open(SIMPLE_LOG_FILE, "w") as textfile:
+                textfile.write("uri, user, function, query_text, timestamp, system, computer\r\n")
+
+        with open(SIMPLE_LOG_FILE, "a") as textfile:
+            for record in records:
+                escaped_query_text = record["query_text"].replace("'", "''")
+                textfile.write(", ".join([record["uri"], THIS_USER, record["function_name"], escaped_query_text,
+                                          record["timestamp_text"], THIS_SYSTEM, THIS_COMPUTER]) + "\r\n")
+
+    except OSError as error:
+        print(error)
+
+    # Do the database update, with one multi-row INSERT per URI
+    records_by_uri = {}
+    for record in records:
+        records_by_uri.setdefault(record["uri"], []).append(record)
+
+    insert_query = """
+        INSERT INTO db_history (username, function_name, query_text, update_time, user_os, user_cpu)
+            VALUES %s
+    """
+
+    for uri, uri_records in records_by_uri.items():
+        values = [(THIS_USER, r["function_name"], r["query_text"], r["timestamp"], THIS_SYSTEM, THIS_COMPUTER)
+                  for r in uri_records]
+
+        try:
+            _ensure_log_table(uri=uri, debug=debug)
+
+            with get_connection(uri) as connection:
+                cursor = connection.cursor()
+                psycopg2.extras.execute_values(cursor, insert_query, values, page_size=LOG_BATCH_SIZE)
+                cursor.close()
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(error)
+
+            # The table may have been dropped since we last checked
+            with _KNOWN_LOG_TABLES_LOCK:
+                _KNOWN_LOG_TABLES.discard(uri)
+
+
+class _LogSink:
+    """
+    Background thread that drains a queue of log records and writes them in batches.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self._run, name="postGIS_tools-log-sink", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+
+            # Keep collecting until the batch is full or the queue has been quiet for a moment
+            while len(batch) < LOG_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get(timeout=LOG_FLUSH_SECONDS))
+                except queue.Empty:
+                    break
+
+            try:
+                _write_log_records(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def put(self, record: dict):
+        self.queue.put(record)
+
+    def flush(self):
+        self.queue.join()
+
+
+_SINK = None
+_SINK_LOCK = threading.Lock()
+
+
+def _get_sink() -> _LogSink:
+    """ Start the background writer on first use (and again in a forked child process). """
+    global _SINK
+
+    with _SINK_LOCK:
+        if _SINK is None or _SINK.pid != os.getpid():
+            _SINK = _LogSink()
+
+        return _SINK
+
+
+def _after_fork_in_child():
+    """
+    Another thread (like the background writer) may have held these locks when the process forked,
+    and it doesn't exist in the child to release them. Start over with new locks and no writer.
+    """
+    global _SINK, _SINK_LOCK, _KNOWN_LOG_TABLES_LOCK
+
+    _SINK = None
+    _SINK_LOCK = threading.Lock()
+    _KNOWN_LOG_TABLES_LOCK = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def set_log_mode(mode: str):
+    """
+    Choose how ``log_activity()`` writes its records.
+
+    :param mode: ``'async'`` to queue records for the background writer, or ``'sync'`` to write each one immediately
+    :return: None
+    """
+    global LOG_MODE
+
+    if mode not in ["async", "sync"]:
+        raise ValueError(f"mode must be 'async' or 'sync', not '{mode}'")
+
+    flush_logs()
+    LOG_MODE = mode
+
+
+def flush_logs():
+    """
+    Block until every queued log record has been written.
+
+    :return: None
+    """
+    if _SINK is not None and _SINK.pid == os.getpid():
+        _SINK.flush()
+
+
+atexit.register(flush_logs)
+
+
 def log_activity(
         function_name: str,
         uri: str,
@@ -114,6 +305,8 @@ def log_activity(
 
     If the ``db_history`` table does not exist yet, make the table before inserting this row.
 
+    Unless the log mode is ``'sync'``, the record is queued and written in the background.
+
     :param function_name: the name of the function that was run (string)
     :param uri: connection string
     :param query_text: the SQL text that was run (string)
@@ -124,52 +317,22 @@ def log_activity(
 
     # Get a timestamp for right now
     right_now = timezone(local_timezone).localize(datetime.now())
-    right_now = right_now.strftime("%Y-%m-%d %H:%M:%S %Z")
-
-    # Create the db_history log table in the database if it doesn't exist yet
-    if not _log_table_exists(uri=uri, debug=debug):
-        _make_log_table(uri=uri, debug=debug)
-
-    # Create the local text file if it doesn't exist yet
-    if not os.path.exists(SIMPLE_LOG_FILE):
-        with open(SIMPLE_LOG_FILE, "w") as textfile:
-            textfile.write("uri, user, function, query_text, timestamp, system, computer\r\n")
-            textfile.close()
 
-    # Escape any single quotes in the query text
-    query_text = query_text.replace("'", "''")
-
-    # Insert the values as a new row
-    insert_query = f"""
-        INSERT INTO db_history (username, function_name, query_text, update_time, user_os, user_cpu)
-            VALUES ('{THIS_USER}', '{function_name}', '{query_text}', 
-                    '{right_now}', '{THIS_SYSTEM}', '{THIS_COMPUTER}');
-    """
+    record = {"uri": uri,
+              "function_name": function_name,
+              "query_text": query_text,
+              "timestamp": right_now,
+              "timestamp_text": right_now.strftime("%Y-%m-%d %H:%M:%S %Z")}
 
     if debug:
         print("""
         Logging to db_history:""")
-        print(insert_query)
-
-    # Do the text update
-    with open(SIMPLE_LOG_FILE, "a") as textfile:
-        textfile.write(", ".join([uri, THIS_USER, function_name, query_text, right_now, THIS_SYSTEM, THIS_COMPUTER]) + "\r\n")
-        textfile.close()
-
-    # Do the database update
-    try:
-        connection = psycopg2.connect(uri)
-        cursor = connection.cursor()
-        cursor.execute(insert_query)
-        cursor.close()
-        connection.commit()
-
-    except (Exception, psycopg2.DatabaseError) as error:
-        print(error)
+        print(f"\t {function_name}: {query_text} @ {record['timestamp_text']}")
 
-    finally:
-        if connection is not None:
-            connection.close()
+    if LOG_MODE == "sync":
+        _write_log_records([record], debug=debug)
+    else:
+        _get_sink().put(record)
 
 
 if __name__ == "__main__":
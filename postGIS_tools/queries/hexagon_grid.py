@@ -7,23 +7,75 @@ Text-based definition of a SQL function to create a hexagon grid overlay
 """
 
 
+def sql_for_extent(
+        extent_table: str,
+        estimated: bool = False
+) -> str:
+    """
+    This function returns a string with a SQL query that gets the extent to cover with hexagons,
+    as one row with a ``box`` and the ``srid`` it's in, scanning the table once.
+
+    :param extent_table: 'name_of_table_to_cover'
+    :param estimated: read the extent from the planner statistics with ``ST_EstimatedExtent()``,
+                      which doesn't scan the table at all but may miss rows added since the last ``ANALYZE``.
+                      Falls back to a scan if the table has no statistics.
+    :return: string, valid SQL query
+    """
+
+    if estimated:
+        return f"""
+        SELECT coalesce(ST_EstimatedExtent('{extent_table}', 'geom'),
+                        (SELECT ST_Extent(geom) FROM {extent_table})) AS box,
+               (SELECT ST_SRID(geom) FROM {extent_table} LIMIT 1) AS srid"""
+
+    return f"""
+        SELECT ST_Extent(ST_Transform(geom, 4326)) AS box,
+               4326 AS srid
+        FROM {extent_table}"""
+
+
+def sql_to_keep_intersecting_hexagons(
+        extent_table: str,
+        hexagon_geom: str
+) -> str:
+    """
+    This function returns a SQL condition that's true for hexagons touching a geometry in {extent_table}.
+    The SRID is looked up once, so each test can use the spatial index on {extent_table}.
+
+    :param extent_table: 'name_of_table_to_cover'
+    :param hexagon_geom: SQL for the hexagon, e.g. 'hexes.geom'
+    :return: string, SQL condition
+    """
+
+    return f"""EXISTS (
+            SELECT 1 FROM {extent_table} covered
+            WHERE ST_Intersects(covered.geom,
+                                ST_Transform({hexagon_geom}, (SELECT ST_SRID(geom) FROM {extent_table} LIMIT 1))))"""
+
+
 def sql_to_make_hex_grid(
         extent_table: str,
         epsg: int,
         output_table_name: str,
-        size: float
+        size: float,
+        estimated_extent: bool = False,
+        clip: bool = False
 ):
     """
     This function returns a string with a valid SQL query that creates
-    a hexagon layer covering the input {extent_table}.
+    a hexagon layer covering the input {extent_table}, with a spatial index and fresh statistics.
 
     :param extent_table: 'name_of_table_to_cover'
     :param epsg: integer for EPSG you want the hexagons to be in
     :param output_table_name: 'hexagon_layer'
     :param size: float value, 1 = 1 square KM
+    :param estimated_extent: use ``ST_EstimatedExtent()`` instead of scanning {extent_table} for its extent
+    :param clip: only keep hexagons that touch a geometry in {extent_table}, instead of filling its whole bounding box
     :return: string, valid SQL query
     """
 
+    where_clause = f"WHERE {sql_to_keep_intersecting_hexagons(extent_table, 'hexes.geom')}" if clip else ""
+
     create_hex_grid_command = f"""
     DROP TABLE IF EXISTS {output_table_name};
     CREATE TABLE {output_table_name} (
@@ -32,17 +84,92 @@ def sql_to_make_hex_grid(
     )
     WITH (OIDS=FALSE);  
 
+    WITH extent AS ({sql_for_extent(extent_table, estimated=estimated_extent)}
+    )
     INSERT INTO {output_table_name} (geom)
-    SELECT hex_grid({size},
-                    (select st_xmin(st_transform(st_collect(geom), 4326)) from {extent_table}),
-                    (select st_ymin(st_transform(st_collect(geom), 4326)) from {extent_table}),
-                    (select st_xmax(st_transform(st_collect(geom), 4326)) from {extent_table}),
-                    (select st_ymax(st_transform(st_collect(geom), 4326)) from {extent_table}),
-                    4326, {epsg}, {epsg});"""
+    SELECT hexes.geom
+    FROM (
+        SELECT hex_grid({size},
+                        ST_XMin(box), ST_YMin(box), ST_XMax(box), ST_YMax(box),
+                        srid, {epsg}, {epsg}) AS geom
+        FROM extent
+    ) hexes
+    {where_clause};
+
+    CREATE INDEX gix_{output_table_name} ON {output_table_name} USING GIST (geom);
+    ANALYZE {output_table_name};"""
 
     return create_hex_grid_command.replace('\n', '')
 
 
+def sql_to_fill_hex_grid_tile(
+        staging_table: str,
+        tile_id: int,
+        tile_extent: tuple,
+        epsg: int,
+        size: float,
+        extent_table: str = None
+):
+    """
+    This function returns a string with a valid SQL query that adds one tile of a hexagon grid
+    to {staging_table}, which has ``tile`` and ``geom`` columns.
+
+    The tile's extent must be in {epsg} and sit on lattice points of the full grid
+    (see ``postGIS_tools.hexgrid.plan_lattice_tiles()``), so neighbouring tiles line up exactly.
+
+    :param staging_table: 'pgis_hex_tiles_1a2b3c4d5e6f'
+    :param tile_id: number of the tile, kept to order the final table
+    :param tile_extent: (xmin, ymin, xmax, ymax) of the tile's lattice points, in {epsg}
+    :param epsg: integer for EPSG you want the hexagons to be in
+    :param size: float value, 1 = 1 square KM
+    :param extent_table: if given, only keep hexagons that touch a geometry in this table
+    :return: string, valid SQL query
+    """
+
+    xmin, ymin, xmax, ymax = tile_extent
+    where_clause = f"WHERE {sql_to_keep_intersecting_hexagons(extent_table, 'hexes.geom')}" if extent_table else ""
+
+    return f"""
+    INSERT INTO {staging_table} (tile, geom)
+    SELECT {tile_id}, hexes.geom
+    FROM (
+        SELECT hex_grid({size}, {xmin}, {ymin}, {xmax}, {ymax}, {epsg}, {epsg}, {epsg}) AS geom
+    ) hexes
+    {where_clause};"""
+
+
+def sql_to_finalize_hex_grid_tiles(
+        staging_table: str,
+        epsg: int,
+        output_table_name: str
+):
+    """
+    This function returns a string with a valid SQL query that moves the tiles in {staging_table}
+    into a logged table shaped like the one ``sql_to_make_hex_grid()`` makes, numbered tile by tile,
+    then indexes and analyzes it and drops {staging_table}.
+
+    :param staging_table: 'pgis_hex_tiles_1a2b3c4d5e6f'
+    :param epsg: integer for EPSG the hexagons are in
+    :param output_table_name: 'hexagon_layer'
+    :return: string, valid SQL query
+    """
+
+    return f"""
+    DROP TABLE IF EXISTS {output_table_name};
+    CREATE TABLE {output_table_name} (
+      gid SERIAL NOT NULL PRIMARY KEY,
+      geom GEOMETRY('POLYGON', {epsg}, 2) NOT NULL
+    );
+
+    INSERT INTO {output_table_name} (geom)
+    SELECT geom FROM {staging_table} ORDER BY tile;
+
+    DROP TABLE {staging_table};
+
+    CREATE INDEX gix_{output_table_name} ON {output_table_name} USING GIST (geom);
+    ANALYZE {output_table_name};"""
+
+
 hex_grid_function = """
 ------ this function was found and copied from the web link below:
 ------ https://github.com/minus34/postgis-scripts/blob/master/hex-grid/create-hex-grid-function.sql
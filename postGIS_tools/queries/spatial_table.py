@@ -0,0 +1,396 @@
+"""
+Summary of ``spatial_table.py``
+-------------------------------
+
+Text-based definition of the SQL that finalizes a spatial table after it's loaded:
+a ``uid`` primary key, a spatial index, optionally a ``CLUSTER`` on that index, and fresh statistics.
+
+"""
+
+# Memory for building the indexes, and the number of extra workers PostgreSQL 11+ may use for B-tree builds
+DEFAULT_MAINTENANCE_WORK_MEM = "1GB"
+DEFAULT_PARALLEL_MAINTENANCE_WORKERS = 4
+
+
+def sql_to_finalize_spatial_table(
+        spatial_table_name: str,
+        geom_colname: str = "geom",
+        cluster: bool = False,
+        maintenance_work_mem: str = DEFAULT_MAINTENANCE_WORK_MEM,
+        parallel_workers: int = DEFAULT_PARALLEL_MAINTENANCE_WORKERS
+) -> str:
+    """
+    This function returns a string with SQL that finalizes a freshly loaded spatial table in one transaction.
+
+    The settings are raised with ``SET LOCAL`` so they end with the transaction
+    and don't stick to a pooled connection. Dropping and re-adding ``uid`` happens in a single
+    ``ALTER TABLE``, so the table is only rewritten once.
+
+    :param spatial_table_name: 'name_of_the_table'
+    :param geom_colname: name of the geometry column to index
+    :param cluster: reorder the table on the spatial index, so nearby features are stored together
+    :param maintenance_work_mem: memory for building the indexes, e.g. '1GB'
+    :param parallel_workers: value for ``max_parallel_maintenance_workers``
+    :return: string, valid SQL query
+    """
+
+    index_name = f"gix_{spatial_table_name}"
+
+    finalize_command = f"""
+        SET LOCAL maintenance_work_mem = '{maintenance_work_mem}';
+        SET LOCAL max_parallel_maintenance_workers = {int(parallel_workers)};
+
+        ALTER TABLE {spatial_table_name}
+            DROP COLUMN IF EXISTS uid,
+            ADD COLUMN uid SERIAL PRIMARY KEY;
+
+        DROP INDEX IF EXISTS {index_name};
+        CREATE INDEX {index_name} ON {spatial_table_name} USING GIST ({geom_colname});"""
+
+    if cluster:
+        finalize_command += f"""
+        CLUSTER {spatial_table_name} USING {index_name};"""
+
+    finalize_command += f"""
+        ANALYZE {spatial_table_name};"""
+
+    return finalize_command
+
+
+def sql_for_blocking_dependents(tablename: str) -> str:
+    """
+    This function returns a string with a SQL query listing the views and foreign keys that point at {tablename},
+    which would stop it from being dropped, and its triggers and row-level security policies,
+    which a new copy of the table wouldn't have.
+
+    :param tablename: 'name_of_the_table'
+    :return: string, valid SQL query returning rows of (kind, name)
+    """
+
+    return f"""
+        SELECT DISTINCT 'view', view.oid::regclass::text
+        FROM pg_depend dependency
+        JOIN pg_rewrite rule ON rule.oid = dependency.objid
+        JOIN pg_class view ON view.oid = rule.ev_class
+        WHERE dependency.refobjid = '{tablename}'::regclass
+          AND view.oid <> '{tablename}'::regclass
+        UNION ALL
+        SELECT 'foreign key', conrelid::regclass::text || '.' || conname
+        FROM pg_constraint
+        WHERE confrelid = '{tablename}'::regclass AND contype = 'f'
+        UNION ALL
+        SELECT 'trigger', tgname::text
+        FROM pg_trigger
+        WHERE tgrelid = '{tablename}'::regclass AND NOT tgisinternal
+        UNION ALL
+        SELECT 'policy', polname::text
+        FROM pg_policy
+        WHERE polrelid = '{tablename}'::regclass"""
+
+
+def sql_for_foreign_keys(tablename: str) -> str:
+    """
+    This function returns a string with a SQL query listing the foreign keys of {tablename} (the ones it
+    references other tables with), which ``LIKE`` doesn't copy.
+
+    :param tablename: 'name_of_the_table'
+    :return: string, valid SQL query returning rows of (constraint name, definition)
+    """
+
+    return f"""
+        SELECT conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = '{tablename}'::regclass AND contype = 'f'
+        ORDER BY conname"""
+
+
+def sql_for_table_privileges(tablename: str) -> str:
+    """
+    This function returns a string with a SQL query that gets the owner of {tablename} and the privileges
+    it has granted to other roles, with the role names already quoted.
+    There's always at least one row, with ``NULL`` privileges if none have been granted.
+
+    :param tablename: 'name_of_the_table'
+    :return: string, valid SQL query returning rows of (owner, grantee, privilege, grantable)
+    """
+
+    return f"""
+        SELECT quote_ident(pg_get_userbyid(cls.relowner)),
+               CASE WHEN acl.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(acl.grantee)) END,
+               acl.privilege_type,
+               acl.is_grantable
+        FROM pg_class cls
+        LEFT JOIN LATERAL aclexplode(cls.relacl) acl ON acl.grantee <> cls.relowner
+        WHERE cls.oid = '{tablename}'::regclass"""
+
+
+def sql_for_integer_primary_key(tablename: str) -> str:
+    """
+    This function returns a string with a SQL query that gets the name of {tablename}'s primary key column,
+    if the primary key is a single integer column.
+
+    :param tablename: 'name_of_the_table'
+    :return: string, valid SQL query returning zero or one rows
+    """
+
+    return f"""
+        SELECT attribute.attname
+        FROM pg_index ix
+        JOIN pg_attribute attribute ON attribute.attrelid = ix.indrelid AND attribute.attnum = ix.indkey[0]
+        WHERE ix.indrelid = '{tablename}'::regclass
+          AND ix.indisprimary
+          AND ix.indnatts = 1
+          AND attribute.atttypid IN ('smallint'::regtype, 'integer'::regtype, 'bigint'::regtype)"""
+
+
+def sql_for_table_indexes(tablename: str) -> str:
+    """
+    This function returns a string with a SQL query listing every index on {tablename}, with the definition
+    of the constraint it belongs to (for primary keys, unique and exclusion constraints) or of the index itself.
+
+    :param tablename: 'name_of_the_table'
+    :return: string, valid SQL query returning rows of (index name, constraint name or NULL, definition)
+    """
+
+    return f"""
+        SELECT index_class.relname,
+               con.conname,
+               CASE WHEN con.oid IS NULL THEN pg_get_indexdef(ix.indexrelid)
+                    ELSE pg_get_constraintdef(con.oid) END
+        FROM pg_index ix
+        JOIN pg_class index_class ON index_class.oid = ix.indexrelid
+        LEFT JOIN pg_constraint con ON con.conindid = ix.indexrelid AND con.conrelid = ix.indrelid
+                                   AND con.contype IN ('p', 'u', 'x')
+        WHERE ix.indrelid = '{tablename}'::regclass
+        ORDER BY ix.indisprimary DESC, index_class.relname"""
+
+
+def sql_for_owned_sequences(tablename: str) -> str:
+    """
+    This function returns a string with a SQL query listing the sequences owned by {tablename}'s columns,
+    with ``'a'`` for ``serial`` columns and ``'i'`` for identity columns.
+
+    :param tablename: 'name_of_the_table'
+    :return: string, valid SQL query returning rows of (sequence, column, dependency type)
+    """
+
+    return f"""
+        SELECT sequence.oid::regclass::text, attribute.attname, dependency.deptype
+        FROM pg_depend dependency
+        JOIN pg_class sequence ON sequence.oid = dependency.objid AND sequence.relkind = 'S'
+        JOIN pg_attribute attribute ON attribute.attrelid = dependency.refobjid
+                                   AND attribute.attnum = dependency.refobjsubid
+        WHERE dependency.refobjid = '{tablename}'::regclass
+          AND dependency.deptype IN ('a', 'i')"""
+
+
+def primary_key_ranges(
+        low: int,
+        high: int,
+        n_ranges: int
+) -> list:
+    """
+    Split the key values from ``low`` to ``high`` (inclusive) into up to ``n_ranges`` half-open ranges of about the same width.
+
+    :return: list of (start, stop) tuples, covering ``low <= key < high + 1``
+    """
+    n_ranges = max(1, min(n_ranges, high - low + 1))
+    step = -(-(high - low + 1) // n_ranges)
+
+    return [(start, min(start + step, high + 1)) for start in range(low, high + 1, step)]
+
+
+def sql_to_copy_reprojected_rows(
+        tablename: str,
+        shadow_table: str,
+        columns: list,
+        orig_epsg: int,
+        new_epsg: int,
+        key: str = None,
+        key_range: tuple = None,
+        geom_col: str = "geom"
+) -> str:
+    """
+    This function returns a string with a SQL query that copies the rows of {tablename} into {shadow_table},
+    which has the same columns, with {geom_col} projected from {orig_epsg} into {new_epsg}.
+
+    :param tablename: 'name_of_the_table'
+    :param shadow_table: 'pgis_reproject_1a2b3c4d5e6f'
+    :param columns: list of the columns of {tablename}, in order
+    :param orig_epsg: the EPSG that the data currently has (integer)
+    :param new_epsg: the EPSG you want the data to be projected into (integer)
+    :param key: integer primary key column to take a range of. Copies every row if ``None``
+    :param key_range: (start, stop) tuple from ``primary_key_ranges()``
+    :param geom_col: name of the geometry column
+    :return: string, valid SQL query
+    """
+
+    select_list = ", ".join(f'ST_Transform(ST_SetSRID("{column}", {orig_epsg}), {new_epsg})' if column == geom_col
+                            else f'"{column}"' for column in columns)
+
+    where_clause = f'WHERE "{key}" >= {key_range[0]} AND "{key}" < {key_range[1]}' if key else ""
+
+    return f"""
+        INSERT INTO {shadow_table} OVERRIDING SYSTEM VALUE
+        SELECT {select_list}
+        FROM {tablename}
+        {where_clause};"""
+
+
+def sql_to_swap_in_shadow_table(
+        tablename: str,
+        shadow_table: str,
+        owned_sequences: list,
+        index_renames: list,
+        privileges: list = None
+) -> str:
+    """
+    This function returns a string with SQL that replaces {tablename} with {shadow_table}.
+    Run it at the end of the transaction that already holds a lock on {tablename}, so the swap is atomic.
+
+    Sequences of ``serial`` columns are handed over to the new table before the old one is dropped,
+    and identity columns of the new table pick up where the old ones left off.
+    The new table gets the original's grants, and then its owner.
+
+    :param tablename: 'name_of_the_table', optionally with its schema
+    :param shadow_table: 'pgis_reproject_1a2b3c4d5e6f', in the same schema
+    :param owned_sequences: rows from ``sql_for_owned_sequences()``
+    :param index_renames: list of (temporary name, original name, is a constraint) tuples for the new table's indexes
+    :param privileges: rows from ``sql_for_table_privileges()``
+    :return: string, valid SQL query
+    """
+
+    schema_prefix = tablename.rsplit(".", 1)[0] + "." if "." in tablename else ""
+    bare_tablename = tablename.rsplit(".", 1)[-1]
+
+    swap_command = f"""
+        LOCK TABLE {tablename} IN ACCESS EXCLUSIVE MODE;"""
+
+    for sequence, column, dependency_type in owned_sequences:
+        if dependency_type == "a":
+            swap_command += f"""
+        ALTER SEQUENCE {sequence} OWNED BY {shadow_table}."{column}";"""
+        else:
+            swap_command += f"""
+        SELECT setval(pg_get_serial_sequence('{shadow_table}', '{column}'), last_value, is_called) FROM {sequence};"""
+
+    swap_command += f"""
+        DROP TABLE {tablename};
+        ALTER TABLE {shadow_table} RENAME TO {bare_tablename};"""
+
+    for temporary_name, original_name, is_constraint in index_renames:
+        if is_constraint:
+            swap_command += f"""
+        ALTER TABLE {tablename} RENAME CONSTRAINT "{temporary_name}" TO "{original_name}";"""
+        else:
+            swap_command += f"""
+        ALTER INDEX {schema_prefix}"{temporary_name}" RENAME TO "{original_name}";"""
+
+    owner = None
+    for owner, grantee, privilege, grantable in privileges or []:
+        if privilege:
+            grant_option = " WITH GRANT OPTION" if grantable else ""
+            swap_command += f"""
+        GRANT {privilege} ON {tablename} TO {grantee}{grant_option};"""
+
+    # Grant first, while the new table still belongs to whoever is running this
+    if owner:
+        swap_command += f"""
+        ALTER TABLE {tablename} OWNER TO {owner};"""
+
+    return swap_command
+
+
+def sql_to_add_foreign_key(
+        shadow_table: str,
+        constraint_name: str,
+        definition: str
+) -> str:
+    """
+    This function returns a string with SQL that adds one of the foreign keys from ``sql_for_foreign_keys()``
+    to {shadow_table}. Constraint names only need to be unique per table, so it keeps its original name.
+
+    :return: string, valid SQL query
+    """
+
+    return f'ALTER TABLE {shadow_table} ADD CONSTRAINT "{constraint_name}" {definition};'
+
+
+def sql_to_rebuild_index(
+        shadow_table: str,
+        temporary_name: str,
+        constraint_name: str,
+        definition: str
+) -> str:
+    """
+    This function returns a string with SQL that rebuilds one of the indexes from ``sql_for_table_indexes()``
+    on {shadow_table}, under a temporary name so it doesn't clash with the original while both tables exist.
+
+    :param shadow_table: 'pgis_reproject_1a2b3c4d5e6f'
+    :param temporary_name: name for the new index (or constraint)
+    :param constraint_name: name of the constraint the original index belongs to, or ``None``
+    :param definition: the definition of the constraint, or the ``CREATE INDEX`` statement of the original
+    :return: string, valid SQL query
+    """
+
+    if constraint_name:
+        return f'ALTER TABLE {shadow_table} ADD CONSTRAINT "{temporary_name}" {definition};'
+
+    unique = " UNIQUE" if definition.startswith("CREATE UNIQUE INDEX") else ""
+    method_and_columns = definition.split(" USING ", 1)[1]
+
+    return f'CREATE{unique} INDEX "{temporary_name}" ON {shadow_table} USING {method_and_columns};'
+
+
+def sql_to_make_geotable(
+        new_tblname: str,
+        query: str,
+        columns: list,
+        geom_colname: str = "geom",
+        geom_type: str = "POINT",
+        epsg: int = 4326,
+        unlogged: bool = False
+) -> str:
+    """
+    This function returns a string with SQL that makes a spatial table from a query in a single write,
+    with the geometry column already typed and a ``uid`` key numbered in the ``SELECT``,
+    so the table never has to be rewritten to add either one. The key becomes an identity column,
+    and the table gets a spatial index and fresh statistics.
+
+    :param new_tblname: 'name_of_my_new_table'
+    :param query: "SELECT * FROM my_table WHERE highway = 'Local' "
+    :param columns: the names of the columns the query returns, in order. Any ``uid`` column is replaced
+    :param geom_colname: 'geom'
+    :param geom_type: 'POINT'
+    :param epsg: the EPSG of the geometries. This does not transform anything
+    :param unlogged: make an ``UNLOGGED`` table, which is faster to write but is emptied if the server crashes
+    :return: string, valid SQL query
+    """
+
+    select_list = [f'ST_SetSRID(source."{column}", {epsg})::geometry({geom_type}, {epsg}) AS "{column}"'
+                   if column == geom_colname else f'source."{column}"'
+                   for column in columns if column != "uid"]
+    select_list.append("row_number() OVER ()::integer AS uid")
+
+    unlogged_keyword = "UNLOGGED " if unlogged else ""
+    query = query.strip().rstrip(";")
+    select_text = ",\n               ".join(select_list)
+
+    return f"""
+        SET LOCAL maintenance_work_mem = '{DEFAULT_MAINTENANCE_WORK_MEM}';
+        SET LOCAL max_parallel_maintenance_workers = {DEFAULT_PARALLEL_MAINTENANCE_WORKERS};
+
+        DROP TABLE IF EXISTS {new_tblname};
+        CREATE {unlogged_keyword}TABLE {new_tblname} AS
+        SELECT {select_text}
+        FROM (
+        {query}
+        ) AS source;
+
+        ALTER TABLE {new_tblname} ADD PRIMARY KEY (uid);
+        ALTER TABLE {new_tblname} ALTER COLUMN uid ADD GENERATED BY DEFAULT AS IDENTITY;
+        SELECT setval(pg_get_serial_sequence('{new_tblname}', 'uid'), coalesce(max(uid), 0) + 1, false)
+        FROM {new_tblname};
+
+        CREATE INDEX gix_{new_tblname} ON {new_tblname} USING GIST ({geom_colname});
+        ANALYZE {new_tblname};"""
@@ -6,18 +6,22 @@ TODO: docstrings all across file
 Examples
 --------
 
-    >>> from postGIS_tools.configurations import get_postGIS_config, USER_DESKTOP
+    >>> from postGIS_tools.configurations import get_postGIS_config, make_uri, USER_DESKTOP
     >>> config, _ = get_postGIS_config()
     >>> config["localhost"]["debug"] = True
-    >>> back_up_all_databases(USER_DESKTOP, **config["localhost"])
+    >>> back_up_all_databases(USER_DESKTOP, make_uri("postgres", **config["localhost"]), max_jobs=8)
+    >>> back_up_all_databases(USER_DESKTOP, make_uri("postgres", **config["localhost"]), incremental="table")
     >>> remove_all_databases(databases_to_keep=["aaron", "postgres"], **config["localhost"])
 
 """
 
+from typing import Union
+
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 
 import postGIS_tools as pGIS
+from postGIS_tools.backup_engine import back_up_databases, DEFAULT_COMPRESSION
 from postGIS_tools.constants import PG_PASSWORD
 
 
@@ -26,18 +30,43 @@ from postGIS_tools.constants import PG_PASSWORD
 
 def back_up_all_databases(
         backup_folder: str,
-        host: str = 'localhost',
-        username: str = 'postgres',
-        password: str = PG_PASSWORD,
-        port: int = 5432,
+        uri: str,
+        default_db: str = "postgres",
+        dump_format: str = "directory",
+        jobs_per_database: int = 2,
+        max_jobs: int = 8,
+        compression: Union[int, str] = DEFAULT_COMPRESSION,
+        incremental: str = None,
+        fingerprint_method: str = "counters",
         debug: bool = True
-):
-    """ Save each database to file """
-
-    config = {'host': host, 'username': username, 'password': password, 'port': port, 'debug': debug}
-
-    for database in pGIS.get_database_list(**config):
-        pGIS.dump_database_to_sql_file(database, backup_folder, **config)
+) -> dict:
+    """
+    Save each database on the cluster to file, several at once, with a ``manifest.json``
+    recording the size and duration of each dump.
+    See ``postGIS_tools.backup_engine.back_up_databases()``.
+
+    :param backup_folder: '/Users/my_name/Desktop/backup_folder'
+    :param uri: connection string to the cluster's default database
+    :param default_db: name of the default database, which isn't backed up
+    :param dump_format: ``'directory'``, ``'custom'`` or ``'plain'``
+    :param jobs_per_database: number of ``pg_dump`` jobs for each database
+    :param max_jobs: most ``pg_dump`` jobs to run at once across all databases
+    :param compression: ``pg_dump --compress`` value
+    :param incremental: ``'database'`` to skip databases that haven't changed since their last backup,
+                        or ``'table'`` to back up only the tables that have
+    :param fingerprint_method: how changes are detected, ``'counters'`` or ``'checksum'``
+    :return: the manifest, as a dict
+    """
+    databases = pGIS.get_database_list(uri, default_db=default_db, debug=debug)
+
+    return back_up_databases(backup_folder, uri, databases,
+                             dump_format=dump_format,
+                             jobs_per_database=jobs_per_database,
+                             max_jobs=max_jobs,
+                             compression=compression,
+                             incremental=incremental,
+                             fingerprint_method=fingerprint_method,
+                             debug=debug)
 
 
 def remove_all_databases(
@@ -16,11 +16,24 @@ Examples
     >>> # Copy a table from a local to remote database
     >>> copy_spatial_table('src_tbl_name', 'dest_tbl_name', 'localhost', 'src_db', '192.168.1.14', 'dest_db')
 
+    >>> # Copy every spatial table from one database to another, 8 at a time
+    >>> transfer_database(local_uri, cloud_uri, workers=8)
+
 """
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Union
 
+from psycopg2.extensions import parse_dsn
+
 import postGIS_tools
+from postGIS_tools.catalog import get_catalog, invalidate_catalog
+from postGIS_tools.configurations import make_uri
+from postGIS_tools.connections import get_connection, get_pool
 from postGIS_tools.constants import PG_PASSWORD
+from postGIS_tools.copy_engine import copy_between_databases, create_table_statements, geometry_sql_type, \
+    is_postgres_uri, quote_identifier, quote_table_name, libpq_uri, _encoder_type
+from postGIS_tools.logs import log_activity
 
 
 def copy_spatial_table(
@@ -76,24 +89,76 @@ def transfer_spatial_table(
         destination_table_name: str,
         destination_uri: str,
         epsg: Union[bool, int] = None,
-        debug: bool = True
+        debug: bool = True,
+        chunksize: int = None,
+        method: str = None
 ):
     """
     Copy a spatial table from one db/host to another table/db/host.
     If an ESPG is passed, this will also reproject the geom column for you.
 
-    TODO: docstring
+    When the source and destination are the same database, the default is ``method='sql'``:
+    the copy is a single ``CREATE TABLE ... AS SELECT`` and no rows leave the server.
+
+    Otherwise, with ``method='copy'`` (the default when both URIs point at PostgreSQL) the rows are piped
+    from ``COPY (SELECT ...) TO STDOUT`` on the source straight into ``COPY ... FROM STDIN``
+    on the destination, in PostgreSQL's binary format. The destination table is created
+    from the column types in the source catalog, and any reprojection happens in the source
+    ``SELECT``, so geometries are never decoded in Python.
+
+    With ``method='geopandas'`` the table goes through a ``GeoDataFrame``. If ``chunksize`` is provided,
+    the source table is streamed through a server-side cursor and written to the destination
+    one chunk at a time, so the whole table is never in memory.
+
+    Either way the destination gets a ``gid`` column numbered from zero, the source ``uid`` is kept
+    as ``old_uid``, and the table is prepped with a new ``uid`` and a spatial index.
 
     :param source_table_name: 'name_of_source_spatial_table'
+    :param source_uri: connection string for the source database
     :param destination_table_name: 'name_of_new_copy'. If ``None`` then will use the source table name.
+    :param destination_uri: connection string for the destination database
     :param epsg: None is default, but could be an int like: 2227
-    :return: nothing, but creates a copy of the source table
+    :param chunksize: for ``method='geopandas'``, number of rows to hold in memory at once,
+                      or ``None`` to read the whole table
+    :param method: ``'sql'``, ``'copy'`` or ``'geopandas'``. Defaults to ``'sql'`` within a database,
+                   ``'copy'`` between PostgreSQL databases, and ``'geopandas'`` if the table can't be copied directly
+    :return: number of rows copied with ``method='sql'`` or ``method='copy'``, otherwise ``None``
     """
 
+    if destination_table_name is None:
+        destination_table_name = source_table_name
+
     if debug:
         print(f'## COPYING FROM {source_table_name} at {source_uri}')
         print(f"## \t TO {destination_table_name} in {destination_uri}")
 
+    if method is None:
+        if not _can_copy_directly(source_table_name, source_uri, destination_uri):
+            method = "geopandas"
+        elif _same_database(source_uri, destination_uri):
+            method = "sql"
+        else:
+            method = "copy"
+
+    if method not in ["sql", "copy", "geopandas"]:
+        raise ValueError(f"method must be 'sql', 'copy' or 'geopandas', not '{method}'")
+
+    if method == "sql":
+        if not _same_database(source_uri, destination_uri):
+            raise ValueError("method='sql' only works when the source and destination are the same database")
+
+        return _transfer_spatial_table_with_sql(source_table_name, source_uri, destination_table_name,
+                                                epsg=epsg, debug=debug)
+
+    if method == "copy":
+        return _transfer_spatial_table_with_copy(source_table_name, source_uri, destination_table_name,
+                                                 destination_uri, epsg=epsg, debug=debug)
+
+    if chunksize:
+        _transfer_spatial_table_in_chunks(source_table_name, source_uri, destination_table_name, destination_uri,
+                                          epsg=epsg, chunksize=chunksize, debug=debug)
+        return
+
     # Get a geodataframe with the source_uri
     gdf = postGIS_tools.functions.query_geo_table(f'SELECT * FROM {source_table_name}', source_uri,
                                                   geom_col='geom', debug=debug)
@@ -103,6 +168,324 @@ def transfer_spatial_table(
                                                     output_epsg=epsg, debug=debug)
 
 
+def _can_copy_directly(
+        source_table_name: str,
+        source_uri: str,
+        destination_uri: str
+) -> bool:
+    """
+    A table can be piped with ``COPY`` if both ends are PostgreSQL and the source
+    has a ``geom`` column with a known SRID (which the geopandas path would also need).
+    """
+    if not (is_postgres_uri(source_uri) and is_postgres_uri(destination_uri)):
+        return False
+
+    catalog = get_catalog(source_uri)
+    geom_info = catalog.geometry_columns.get(_catalog_table_name(source_table_name, catalog), {}).get("geom")
+
+    return geom_info is not None and geom_info["srid"] != 0
+
+
+def _catalog_table_name(
+        source_table_name: str,
+        catalog
+) -> Union[str, None]:
+    """
+    The catalog keys tables by name alone, keeping the one in 'public' if a name is used in more than one schema.
+    Find the key for a table name that may include its schema, or ``None`` if the catalog describes another table.
+    """
+    if "." not in source_table_name:
+        return source_table_name
+
+    schema, table = source_table_name.rsplit(".", 1)
+    if catalog.tables.get(table, {}).get("schema") == schema:
+        return table
+
+    return None
+
+
+def _spatial_copy_query(
+        source_table_name: str,
+        catalog,
+        epsg: Union[bool, int] = None
+) -> tuple:
+    """
+    Build the ``SELECT`` that reshapes a source table into the columns ``geodataframe_to_postgis()``
+    would have made (``gid`` first, ``old_uid`` and ``geom`` last), keeping the exact types
+    from the source catalog. Any reprojection is done in the query.
+
+    :param source_table_name: 'name_of_source_spatial_table'
+    :param catalog: ``CatalogSnapshot`` of the source database
+    :param epsg: None is default, but could be an int like: 2227
+    :return: tuple of (query, list of ``(column, sql_type)`` tuples for the output)
+    """
+    catalog_name = _catalog_table_name(source_table_name, catalog)
+    if catalog_name not in catalog.geometry_columns:
+        raise ValueError(f"{source_table_name} isn't a spatial table the catalog knows about, use method='geopandas'")
+
+    geom_info = catalog.geometry_columns[catalog_name]["geom"]
+    output_srid = epsg or geom_info["srid"]
+    geom_sql_type = geometry_sql_type(geom_info["type"], output_srid)
+
+    # Number the rows from zero, like the index written by geodataframe_to_postgis()
+    select_columns = ["(row_number() OVER () - 1)::BIGINT AS gid"]
+    column_types = [("gid", "BIGINT")]
+
+    source_columns = dict(catalog.columns[catalog_name])
+
+    for column, sql_type in catalog.columns[catalog_name]:
+        if column not in ["gid", "uid", "geom"]:
+            select_columns.append(f"{quote_identifier(column)} AS {quote_identifier(column.lower())}")
+            column_types.append((column.lower(), sql_type))
+
+    if "uid" in source_columns:
+        select_columns.append("uid AS old_uid")
+        column_types.append(("old_uid", source_columns["uid"]))
+
+    if epsg and epsg != geom_info["srid"]:
+        select_columns.append(f"ST_Transform(geom, {epsg})::{geom_sql_type} AS geom")
+    else:
+        select_columns.append(f"geom::{geom_sql_type} AS geom")
+    column_types.append(("geom", geom_sql_type))
+
+    query = f"SELECT {', '.join(select_columns)} FROM {quote_table_name(source_table_name)}"
+
+    return query, column_types
+
+
+def _same_database(
+        uri_a: str,
+        uri_b: str
+) -> bool:
+    """ Do two connection strings point at the same database on the same server? """
+    if not (is_postgres_uri(uri_a) and is_postgres_uri(uri_b)):
+        return False
+
+    a, b = parse_dsn(libpq_uri(uri_a)), parse_dsn(libpq_uri(uri_b))
+
+    def server(dsn: dict) -> tuple:
+        return dsn.get("host", "localhost"), str(dsn.get("port", 5432)), dsn.get("dbname")
+
+    return server(a) == server(b)
+
+
+def _transfer_spatial_table_with_sql(
+        source_table_name: str,
+        uri: str,
+        destination_table_name: str,
+        epsg: Union[bool, int] = None,
+        debug: bool = True
+):
+    """
+    Copy a spatial table within one database with ``CREATE TABLE ... AS``, so no rows leave the server.
+    """
+    if source_table_name == destination_table_name:
+        raise ValueError(f"Can't copy {source_table_name} onto itself")
+
+    source_query, column_types = _spatial_copy_query(source_table_name, get_catalog(uri, debug=debug), epsg)
+
+    _, create_index = create_table_statements(destination_table_name, column_types, ["gid"])
+
+    if debug:
+        print('## -> COPYING server-side with CREATE TABLE AS')
+
+    with get_connection(uri) as connection:
+        cursor = connection.cursor()
+
+        cursor.execute(f"DROP TABLE IF EXISTS {quote_identifier(destination_table_name)};")
+        cursor.execute(f"CREATE TABLE {quote_identifier(destination_table_name)} AS {source_query};")
+        n_rows = cursor.rowcount
+        cursor.execute(create_index)
+
+        cursor.close()
+
+    invalidate_catalog(uri)
+
+    log_activity("pGIS.transfer_spatial_table",
+                 uri=uri,
+                 query_text=f"Copied {source_table_name} into {destination_table_name} with CREATE TABLE AS",
+                 debug=debug)
+
+    postGIS_tools.functions.prep_spatial_table(destination_table_name, uri=uri, debug=debug)
+
+    return n_rows
+
+
+def _transfer_spatial_table_with_copy(
+        source_table_name: str,
+        source_uri: str,
+        destination_table_name: str,
+        destination_uri: str,
+        epsg: Union[bool, int] = None,
+        debug: bool = True
+):
+    """
+    Pipe a spatial table between databases with binary ``COPY``.
+
+    The destination gets the same columns that ``geodataframe_to_postgis()`` would have made
+    (``gid`` first, ``old_uid`` and ``geom`` last), but keeps the exact types from the source.
+    """
+    source_query, column_types = _spatial_copy_query(source_table_name, get_catalog(source_uri, debug=debug), epsg)
+
+    # Create the bare table first, and index the 'gid' column once the rows are in
+    create_table, create_index = create_table_statements(destination_table_name, column_types, ["gid"])
+
+    n_rows = copy_between_databases(source_query, source_uri, destination_table_name, destination_uri,
+                                    columns=[column for column, _ in column_types],
+                                    setup_statements=[f"DROP TABLE IF EXISTS {quote_identifier(destination_table_name)};",
+                                                      create_table],
+                                    finish_statements=[create_index],
+                                    debug=debug)
+
+    log_activity("pGIS.transfer_spatial_table",
+                 uri=destination_uri,
+                 query_text=f"Piped {source_table_name} into {destination_table_name} with COPY",
+                 debug=debug)
+
+    postGIS_tools.functions.prep_spatial_table(destination_table_name, uri=destination_uri, debug=debug)
+
+    return n_rows
+
+
+def _transfer_spatial_table_in_chunks(
+        source_table_name: str,
+        source_uri: str,
+        destination_table_name: str,
+        destination_uri: str,
+        epsg: Union[bool, int] = None,
+        chunksize: int = 100000,
+        debug: bool = True
+):
+    """
+    Stream a spatial table between databases one chunk at a time.
+    Each chunk is reprojected client-side (if needed) and appended to the destination,
+    which is prepped once all of the rows have landed.
+    """
+
+    # Every chunk needs to agree on the geometry type, so take it from the source table
+    geom_type_query = f"""
+        SELECT type FROM geometry_columns
+        WHERE f_table_name = '{source_table_name}' AND f_geometry_column = 'geom' """
+    geom_type_result = postGIS_tools.functions.fetch_things_from_database(geom_type_query, source_uri, debug=debug)
+
+    geom_type = None
+    if geom_type_result and geom_type_result[0][0].upper() != "GEOMETRY":
+        geom_type = geom_type_result[0][0]
+
+    # Create the destination with the source's column types, instead of whatever the first chunk's dtypes suggest
+    # (a column that's all NULL in the first chunk would otherwise become TEXT). Later chunks are encoded
+    # as the destination's types when they're appended.
+    catalog = get_catalog(source_uri, debug=debug)
+    source_types = catalog.columns.get(_catalog_table_name(source_table_name, catalog), [])
+    encoder_types = {column: _encoder_type(pg_type) for column, pg_type in source_types if column != "geom"}
+    sql_types = {column: sql_type for column, sql_type in encoder_types.items() if sql_type}
+
+    chunks = postGIS_tools.functions.query_geo_table(f'SELECT * FROM {source_table_name}', source_uri,
+                                                     geom_col='geom', chunksize=chunksize, debug=debug)
+
+    for chunk_number, gdf in enumerate(chunks):
+        if epsg:
+            gdf = gdf.to_crs(epsg=epsg)
+
+        postGIS_tools.functions.geodataframe_to_postgis(gdf, destination_table_name, destination_uri,
+                                                        if_exists="replace" if chunk_number == 0 else "append",
+                                                        geom_type=geom_type, prep_table=False, debug=debug,
+                                                        sql_types=sql_types)
+
+    postGIS_tools.functions.prep_spatial_table(destination_table_name, uri=destination_uri, debug=debug)
+
+
+def transfer_database(
+        source_uri: str,
+        destination_uri: str,
+        tables: list = None,
+        workers: int = 4,
+        epsg: Union[bool, int] = None,
+        debug: bool = False
+) -> list:
+    """
+    Copy many spatial tables from one database to another, several at a time.
+
+    Each worker copies one table at a time with ``transfer_spatial_table()``, over its own
+    source and destination connections. The largest tables (by size in the source catalog)
+    are started first, so a big table doesn't end up running on its own at the very end.
+    Indexes and the ``uid`` key are built after each table's rows have landed.
+
+    A table that fails is reported and the others carry on.
+
+    :param source_uri: connection string for the source database
+    :param destination_uri: connection string for the destination database, which must already exist
+    :param tables: list of tables to copy. Defaults to every spatial table in the source database
+    :param workers: number of tables to copy at once. Capped at the connection pool size
+    :param epsg: if provided, reproject every table into this EPSG
+    :return: list with a dict for each table, with keys
+             ``table``, ``rows``, ``megabytes``, ``seconds``, ``rows_per_second`` and ``error``
+    """
+    start_time = time.time()
+
+    catalog = get_catalog(source_uri, debug=debug)
+
+    if tables is None:
+        tables = catalog.spatial_tables()
+
+    # Biggest tables first
+    tables = sorted(tables, key=catalog.total_bytes, reverse=True)
+
+    if not tables:
+        return []
+
+    # Every worker holds one connection to each database for as long as its table takes
+    workers = max(1, min(workers, len(tables), get_pool(source_uri).max_size, get_pool(destination_uri).max_size))
+
+    print(f'## TRANSFERRING {len(tables)} tables with {workers} workers')
+
+    def transfer(table: str) -> dict:
+        table_start = time.time()
+
+        result = {"table": table,
+                  "rows": None,
+                  "megabytes": round(catalog.total_bytes(table) / 1024 / 1024, 1),
+                  "seconds": None,
+                  "rows_per_second": None,
+                  "error": None}
+
+        try:
+            result["rows"] = transfer_spatial_table(table, source_uri, table, destination_uri, epsg=epsg, debug=debug)
+        except Exception as error:
+            result["error"] = f"{type(error).__name__}: {error}"
+
+        result["seconds"] = round(time.time() - table_start, 2)
+        if result["rows"] is not None and result["seconds"]:
+            result["rows_per_second"] = int(result["rows"] / result["seconds"])
+
+        return result
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(transfer, table) for table in tables]
+
+        for future in as_completed(futures):
+            result = future.result()
+            results[result["table"]] = result
+
+            if result["error"]:
+                print(f'## -> {result["table"]} FAILED: {result["error"]}')
+            else:
+                print(f'## -> {result["table"]}: {result["rows"]} rows ({result["megabytes"]} MB) '
+                      f'in {result["seconds"]} seconds ({result["rows_per_second"]} rows/sec)')
+
+    runtime = round(time.time() - start_time, 2)
+    n_failed = len([r for r in results.values() if r["error"]])
+    print(f'## FINISHED {len(tables) - n_failed} of {len(tables)} tables in {runtime} seconds')
+
+    log_activity("pGIS.transfer_database",
+                 uri=destination_uri,
+                 query_text=f"Transferred {len(tables) - n_failed} tables from {source_uri}",
+                 debug=debug)
+
+    return [results[table] for table in tables]
+
+
 def copy_spatial_table_same_db(
         src_tbl,
         dest_tbl,
@@ -111,21 +494,26 @@ def copy_spatial_table_same_db(
         username: str = 'postgres',
         password: str = PG_PASSWORD,
         port: int = 5432,
-        debug: bool = False
+        debug: bool = False,
+        epsg: Union[bool, int] = None
 ):
     """
     Make a copy of a spatial table inside the same database.
 
-    :param src_tbl:
-    :param dest_tbl:
-    :param database:
-    :param host:
-    :return:
+    The copy runs entirely on the server with ``CREATE TABLE ... AS SELECT``,
+    and any reprojection is done in the same query.
+
+    :param src_tbl: 'name_of_source_spatial_table'
+    :param dest_tbl: 'name_of_new_copy'
+    :param database: 'my_database'
+    :param host: 'localhost'
+    :param epsg: None is default, but could be an int like: 2227
+    :return: number of rows copied
     """
 
-    config = {'password': password, 'username': username, 'debug': debug}
+    uri = make_uri(database, host=host, username=username, password=password, port=port)
 
-    copy_spatial_table(src_tbl, dest_tbl, host, database, host, database, **config)
+    return transfer_spatial_table(src_tbl, uri, dest_tbl, uri, epsg=epsg, debug=debug)
 
 
 def copy_spatial_table_same_host(
@@ -137,21 +525,28 @@ def copy_spatial_table_same_host(
         username: str = 'postgres',
         password: str = PG_PASSWORD,
         port: int = 5432,
-        debug: bool = False
+        debug: bool = False,
+        epsg: Union[bool, int] = None
 ):
     """
     Make a copy of a spatial table on the same host but into a different database.
 
-    :param src_tbl:
-    :param dest_tbl:
-    :param src_database:
-    :param dest_database:
-    :param host:
-    :return:
+    PostgreSQL can't query across databases, so the rows are piped from ``COPY ... TO STDOUT``
+    on one database into ``COPY ... FROM STDIN`` on the other. Any reprojection is done in the source query.
+
+    :param src_tbl: 'name_of_source_spatial_table'
+    :param dest_tbl: 'name_of_new_copy'
+    :param src_database: 'my_source_database'
+    :param dest_database: 'my_destination_database'
+    :param host: 'localhost'
+    :param epsg: None is default, but could be an int like: 2227
+    :return: number of rows copied
     """
-    config = {'password': password, 'username': username, 'debug': debug}
 
-    copy_spatial_table(src_tbl, dest_tbl, host, src_database, host, dest_database, **config)
+    src_uri = make_uri(src_database, host=host, username=username, password=password, port=port)
+    dest_uri = make_uri(dest_database, host=host, username=username, password=password, port=port)
+
+    return transfer_spatial_table(src_tbl, src_uri, dest_tbl, dest_uri, epsg=epsg, debug=debug)
 
 
 if __name__ == "__main__":
@@ -164,7 +559,10 @@ if __name__ == "__main__":
     local_db = "aa_2019_216_mv_modal_2019_12_04"
     do_db = "mountain_view_modal_2019_216"
 
-    postGIS_tools.make_new_database(do_db, default_db="defaultdb", debug=True, **digital_ocean_config)
+    local_uri = postGIS_tools.make_uri(local_db, **local_config)
+    do_uri = postGIS_tools.make_uri(do_db, **digital_ocean_config)
+    do_default_uri = postGIS_tools.make_uri("defaultdb", **digital_ocean_config)
+
+    postGIS_tools.make_new_database(do_default_uri, do_uri, debug=True)
 
-    for table in postGIS_tools.get_list_of_spatial_tables_in_db(local_db, **local_config):
-        transfer_spatial_table(table, local_db, table, do_db, local_config, digital_ocean_config)
+    transfer_database(local_uri, do_uri, workers=8)
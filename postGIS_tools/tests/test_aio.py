@@ -0,0 +1,37 @@
+import asyncio
+
+from postGIS_tools import aio
+
+from ward import test
+
+
+class _FakePool:
+    """ Awaitable but not a coroutine, just like ``asyncpg.Pool`` """
+    created = 0
+
+    def __init__(self, dsn, **kwargs):
+        self.dsn = dsn
+        self.kwargs = kwargs
+        _FakePool.created += 1
+
+    def __await__(self):
+        yield from asyncio.sleep(0).__await__()
+        return self
+
+
+@test("get_pool() awaits the pool asyncpg hands back, and every task on a loop shares it")
+def _():
+    create_pool = aio.asyncpg.create_pool
+    aio.asyncpg.create_pool = _FakePool
+
+    async def get_pools():
+        return await asyncio.gather(*[aio.get_pool("postgresql+psycopg2://user:pw@host:5432/db") for _ in range(3)])
+
+    try:
+        pools = asyncio.run(get_pools())
+    finally:
+        aio.asyncpg.create_pool = create_pool
+
+    assert all(pool is pools[0] for pool in pools)
+    assert _FakePool.created == 1
+    assert pools[0].dsn == "postgresql://user:pw@host:5432/db"
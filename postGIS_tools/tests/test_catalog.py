@@ -0,0 +1,40 @@
+from postGIS_tools.catalog import CatalogSnapshot
+
+from ward import test
+
+RAW_CATALOG = {
+    "tables": [
+        {"schema": "public", "table": "parcels", "kind": "r", "estimated_rows": 1200, "total_bytes": 81920},
+        {"schema": "public", "table": "spatial_ref_sys", "kind": "r", "estimated_rows": 8500, "total_bytes": 7000000},
+        {"schema": "public", "table": "new_table", "kind": "r", "estimated_rows": -1, "total_bytes": 8192},
+    ],
+    "columns": [
+        {"schema": "public", "table": "parcels", "column": "uid", "type": "integer", "base_type": "int4"},
+        {"schema": "public", "table": "parcels", "column": "geom",
+         "type": "geometry(MultiPolygon,2227)", "base_type": "geometry"},
+        {"schema": "public", "table": "new_table", "column": "geom", "type": "geometry", "base_type": "geometry"},
+    ],
+    "indexes": [
+        {"schema": "public", "table": "parcels", "index": "parcels_pkey",
+         "definition": "CREATE UNIQUE INDEX parcels_pkey ON public.parcels USING btree (uid)", "is_primary": True},
+    ],
+    "databases": ["postgres", "my_project"],
+}
+
+
+@test("CatalogSnapshot parses geometry types and SRIDs out of the column types")
+def _():
+    catalog = CatalogSnapshot(RAW_CATALOG)
+
+    assert catalog.geometry_columns["parcels"] == {"geom": {"type": "MULTIPOLYGON", "srid": 2227}}
+    assert catalog.geometry_columns["new_table"] == {"geom": {"type": "GEOMETRY", "srid": 0}}
+
+
+@test("CatalogSnapshot hides the PostGIS tables and clamps unknown row estimates")
+def _():
+    catalog = CatalogSnapshot(RAW_CATALOG)
+
+    assert catalog.table_names() == ["parcels", "new_table"]
+    assert "spatial_ref_sys" in catalog.table_names(include_postgis_tables=True)
+    assert catalog.column_names("parcels") == ["uid", "geom"]
+    assert catalog.estimated_rows("new_table") == 0
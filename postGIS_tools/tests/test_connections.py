@@ -0,0 +1,18 @@
+from postGIS_tools.connections import configure_connection_pool, get_engine, close_all_connections, \
+    POOL_MAX_IDLE_SECONDS
+
+from ward import test
+
+
+@test("get_engine() recycles connections after the max_idle set with configure_connection_pool()")
+def _():
+    uri = "postgresql+psycopg2://user:pw@localhost:5432/db"
+
+    try:
+        assert get_engine(uri).pool._recycle == POOL_MAX_IDLE_SECONDS
+
+        configure_connection_pool(max_idle=30)
+        assert get_engine(uri).pool._recycle == 30
+    finally:
+        configure_connection_pool()
+        close_all_connections(uri)
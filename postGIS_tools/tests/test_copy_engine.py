@@ -0,0 +1,181 @@
+import contextlib
+import os
+import struct
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+import psycopg2.errors
+import pyarrow as pa
+import shapely
+
+from postGIS_tools import copy_engine
+from postGIS_tools.copy_engine import encode_binary_rows, frame_sql_types, CopyPipe, encode_arrow_batch, \
+    arrow_sql_type, geometry_to_ewkb, match_table_column_types, encode_csv_rows, copy_csv_file, \
+    CSV_SAMPLE_BYTES
+
+from ward import test, raises
+
+
+def _decode_binary_rows(data: bytes) -> list:
+    """ Read binary COPY rows back into lists of raw field bytes """
+    rows = []
+    position = 0
+
+    while position < len(data):
+        n_fields = struct.unpack(">h", data[position:position + 2])[0]
+        position += 2
+
+        row = []
+        for _ in range(n_fields):
+            length = struct.unpack(">i", data[position:position + 4])[0]
+            position += 4
+
+            if length == -1:
+                row.append(None)
+            else:
+                row.append(data[position:position + length])
+                position += length
+
+        rows.append(row)
+
+    return rows
+
+
+@test("encode_binary_rows() writes each field with its length, and NULLs as -1")
+def _():
+    df = pd.DataFrame({"id": [1, 2], "score": [1.5, np.nan], "name": ["a", None], "flag": [True, False]})
+
+    rows = _decode_binary_rows(encode_binary_rows(df, frame_sql_types(df)))
+
+    assert rows == [
+        [struct.pack(">q", 1), struct.pack(">d", 1.5), b"a", b"\x01"],
+        [struct.pack(">q", 2), None, None, b"\x00"],
+    ]
+
+
+@test("encode_binary_rows() counts timestamps from 2000-01-01")
+def _():
+    df = pd.DataFrame({"t": pd.to_datetime(["2000-01-01 00:00:00", "2000-01-02 00:00:01"])})
+
+    rows = _decode_binary_rows(encode_binary_rows(df, frame_sql_types(df)))
+
+    assert [struct.unpack(">q", r[0])[0] for r in rows] == [0, 86401 * 1000000]
+
+
+@test("encode_arrow_batch() matches encode_binary_rows(), with WKB geometries turned into EWKB")
+def _():
+    geometries = [shapely.Point(1, 2), None, shapely.LineString([(0, 0), (3, 4)])]
+    batch = pa.RecordBatch.from_pydict({
+        "a": pa.array([1, None, 3], type=pa.int32()),
+        "b": ["x", "yz", None],
+        "geom": pa.array([None if g is None else shapely.to_wkb(g, flavor="iso") for g in geometries]),
+    }).slice(1, 2)
+    column_types = [("a", arrow_sql_type(pa.int32())), ("b", "TEXT"), ("geom", "geometry(GEOMETRY, 2227)")]
+
+    frame = pd.DataFrame({"a": pd.array([None, 3], dtype="Int32"), "b": ["yz", None],
+                          "geom": list(geometry_to_ewkb(geometries[1:], 2227))})
+
+    assert encode_arrow_batch(batch, column_types, {"geom": 2227}) == encode_binary_rows(frame, column_types)
+
+
+@test("CopyPipe passes every byte from the writer thread to the reader, in order")
+def _():
+    data = bytes(range(256)) * 40
+    pipe = CopyPipe(block_size=100, max_blocks=2)
+
+    def write():
+        for start in range(0, len(data), 7):
+            pipe.write(data[start:start + 7])
+        pipe.finish()
+
+    writer = threading.Thread(target=write)
+    writer.start()
+
+    received = b""
+    while True:
+        block = pipe.read(33)
+        if not block:
+            break
+        received += block
+
+    writer.join()
+
+    assert received == data
+
+
+@test("match_table_column_types() encodes appended rows with the existing table's types, whatever their dtypes")
+def _():
+    table_types = [("count", "bigint"), ("score", "double precision"), ("name", "character varying(20)")]
+
+    # An integer column that picked up NULLs in this chunk, and a float column that happens to hold whole numbers
+    df = pd.DataFrame({"count": [1.0, None, 3.0], "score": [2, 3, 4], "name": ["a", "b", None]})
+    column_types = match_table_column_types(frame_sql_types(df), table_types, "my_table")
+
+    assert column_types == [("count", "BIGINT"), ("score", "DOUBLE PRECISION"), ("name", "TEXT")]
+
+    rows = _decode_binary_rows(encode_binary_rows(df, column_types))
+    assert struct.unpack(">q", rows[0][0])[0] == 1 and rows[1][0] is None
+    assert struct.unpack(">d", rows[2][1])[0] == 4.0
+
+    fractions = pd.DataFrame({"count": [1.5]})
+    with raises(ValueError):
+        encode_binary_rows(fractions, match_table_column_types(frame_sql_types(fractions), table_types, "my_table"))
+
+    with raises(ValueError):
+        match_table_column_types([("amount", "BIGINT")], [("amount", "numeric(10,2)")], "my_table")
+
+
+@test("encode_csv_rows() writes geometries as plain hex EWKB, and only bytea with the \\x prefix")
+def _():
+    ewkb = geometry_to_ewkb([shapely.Point(1, 2)], 2227)[0]
+    df = pd.DataFrame({"blob": [b"\x01\x02"], "geom": [ewkb]})
+
+    line = encode_csv_rows(df, [("blob", "BYTEA"), ("geom", "geometry(POINT, 2227)")]).decode("utf-8").strip()
+
+    assert line == "\\x0102," + ewkb.hex()
+
+
+@test("copy_csv_file() loads the file again as LATIN1 when a character past the sample isn't UTF8")
+def _():
+    copy_queries = []
+
+    class FakeCursor:
+        rowcount = 0
+
+        def execute(self, query):
+            pass
+
+        def copy_expert(self, query, csv_file, size):
+            copy_queries.append(query)
+            if len(copy_queries) == 1:
+                raise psycopg2.errors.CharacterNotInRepertoire("invalid byte sequence for encoding \"UTF8\"")
+
+        def close(self):
+            pass
+
+    class FakeConnection:
+        def cursor(self):
+            return FakeCursor()
+
+    @contextlib.contextmanager
+    def fake_get_connection(uri):
+        yield FakeConnection()
+
+    get_connection, invalidate_catalog = copy_engine.get_connection, copy_engine.invalidate_catalog
+    copy_engine.get_connection, copy_engine.invalidate_catalog = fake_get_connection, lambda uri: None
+
+    with tempfile.TemporaryDirectory() as folder:
+        csv_filepath = os.path.join(folder, "places.csv")
+        with open(csv_filepath, "wb") as csv_file:
+            csv_file.write(b"id,name\n" + b"1,Oakland\n" * (CSV_SAMPLE_BYTES // 10) + b"2,Caf\xe9\n")
+
+        try:
+            copy_csv_file(csv_filepath, "places", "postgresql://fake")
+        finally:
+            copy_engine.get_connection, copy_engine.invalidate_catalog = get_connection, invalidate_catalog
+
+    assert len(copy_queries) == 2
+    assert "ENCODING 'UTF8'" in copy_queries[0]
+    assert "ENCODING 'LATIN1'" in copy_queries[1]
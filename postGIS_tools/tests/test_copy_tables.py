@@ -0,0 +1,107 @@
+import contextlib
+
+import geopandas as gpd
+import shapely
+
+import postGIS_tools.functions
+from postGIS_tools.routines import copy_tables
+from postGIS_tools.routines.copy_tables import transfer_spatial_table, _same_database, _spatial_copy_query
+
+from ward import test, raises
+
+
+def _parcels(first_uid: int = 10) -> gpd.GeoDataFrame:
+    """ A chunk of a source table, as query_geo_table() returns it """
+    return gpd.GeoDataFrame({"gid": [0, 1],
+                             "uid": [first_uid, first_uid + 1],
+                             "owner": ["a", "b"],
+                             "geom": [shapely.box(0, 0, 1, 1), shapely.box(1, 1, 2, 2)]},
+                            geometry="geom", crs="epsg:2227")
+
+
+@contextlib.contextmanager
+def _fake_database(**patches):
+    """ Swap out the functions that would touch a database, and record what gets written """
+    calls = {"writes": [], "projected": [], "prepped": []}
+
+    fakes = {
+        "write_dataframe": lambda frame, table_name, uri, **kwargs: calls["writes"].append((frame, table_name, kwargs)),
+        "log_activity": lambda *args, **kwargs: None,
+        "project_spatial_table": lambda table_name, *args, **kwargs: calls["projected"].append((table_name, args)),
+        "prep_spatial_table": lambda table_name, **kwargs: calls["prepped"].append(table_name),
+        **patches,
+    }
+
+    originals = {name: getattr(postGIS_tools.functions, name) for name in fakes}
+    for name, fake in fakes.items():
+        setattr(postGIS_tools.functions, name, fake)
+
+    try:
+        yield calls
+    finally:
+        for name, original in originals.items():
+            setattr(postGIS_tools.functions, name, original)
+
+
+@test("transfer_spatial_table(method='geopandas') writes the source's geom column and reprojects the copy")
+def _():
+    with _fake_database(query_geo_table=lambda query, uri, **kwargs: _parcels()) as calls:
+        transfer_spatial_table("parcels", "postgresql://source", "parcels_copy", "postgresql://destination",
+                               epsg=4326, method="geopandas", debug=False)
+
+    frame, table_name, kwargs = calls["writes"][0]
+
+    assert table_name == "parcels_copy"
+    assert sorted(frame.columns) == ["geom", "old_uid", "owner"]
+    assert kwargs["sql_types"]["geom"] == "geometry(POLYGON, 2227)"
+    assert calls["projected"] == [("parcels_copy", ("POLYGON", 2227, 4326))]
+    assert calls["prepped"] == ["parcels_copy"]
+
+
+@test("transfer_spatial_table(method='geopandas', chunksize=...) appends every chunk, reprojected, then preps once")
+def _():
+    class FakeCatalog:
+        columns = {"parcels": [("gid", "bigint"), ("uid", "integer"), ("owner", "text"),
+                               ("geom", "geometry(Polygon,2227)")]}
+
+    get_catalog = copy_tables.get_catalog
+    copy_tables.get_catalog = lambda uri, debug=False: FakeCatalog()
+
+    try:
+        with _fake_database(query_geo_table=lambda query, uri, **kwargs: iter([_parcels(10), _parcels(12)]),
+                            fetch_things_from_database=lambda query, uri, **kwargs: [("POLYGON",)]) as calls:
+            transfer_spatial_table("parcels", "postgresql://source", "parcels_copy", "postgresql://destination",
+                                   epsg=4326, chunksize=2, method="geopandas", debug=False)
+    finally:
+        copy_tables.get_catalog = get_catalog
+
+    assert [kwargs["if_exists"] for _, _, kwargs in calls["writes"]] == ["replace", "append"]
+    assert [list(frame["old_uid"]) for frame, _, _ in calls["writes"]] == [[10, 11], [12, 13]]
+    assert all(kwargs["sql_types"]["geom"] == "geometry(POLYGON, 4326)" for _, _, kwargs in calls["writes"])
+    assert calls["prepped"] == ["parcels_copy"]
+
+
+@test("_same_database() understands SQLAlchemy-style driver names")
+def _():
+    assert _same_database("postgresql+psycopg2://user:pw@db.example.com:5432/gis",
+                          "postgresql://other_user@db.example.com/gis")
+    assert not _same_database("postgresql+psycopg2://user:pw@db.example.com:5432/gis",
+                              "postgresql://user:pw@db.example.com:5432/other")
+
+
+@test("_spatial_copy_query() quotes the schema and table of a schema-qualified source separately")
+def _():
+    class FakeCatalog:
+        tables = {"parcels": {"schema": "gis"}}
+        columns = {"parcels": [("uid", "integer"), ("Owner", "text"), ("geom", "geometry(Polygon,2227)")]}
+        geometry_columns = {"parcels": {"geom": {"type": "POLYGON", "srid": 2227}}}
+
+    query, column_types = _spatial_copy_query("gis.parcels", FakeCatalog(), epsg=4326)
+
+    assert query.endswith('FROM "gis"."parcels"')
+    assert 'ST_Transform(geom, 4326)::geometry(POLYGON, 4326) AS geom' in query
+    assert column_types == [("gid", "BIGINT"), ("owner", "text"), ("old_uid", "integer"),
+                            ("geom", "geometry(POLYGON, 4326)")]
+
+    with raises(ValueError):
+        _spatial_copy_query("other_schema.parcels", FakeCatalog())
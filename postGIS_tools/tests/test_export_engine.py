@@ -0,0 +1,25 @@
+import shapely
+import geopandas as gpd
+
+from postGIS_tools.export_engine import _chunk_to_arrow, _query_for
+
+from ward import test
+
+
+@test("_query_for() selects everything from a table name, and leaves queries alone")
+def _():
+    assert _query_for("parcels") == "SELECT * FROM parcels"
+    assert _query_for("SELECT gid, geom FROM parcels") == "SELECT gid, geom FROM parcels"
+
+
+@test("_chunk_to_arrow() stores geometries as WKB with a bbox column of their extents")
+def _():
+    gdf = gpd.GeoDataFrame({"gid": [0, 1],
+                            "geom": [shapely.box(0, 0, 2, 1), shapely.Point(5, 6)]},
+                           geometry="geom", crs="epsg:2227")
+
+    table = _chunk_to_arrow(gdf, "geom", with_bbox=True)
+
+    assert table.column_names == ["gid", "geom", "bbox"]
+    assert shapely.from_wkb(table.column("geom").to_pylist())[1] == shapely.Point(5, 6)
+    assert table.column("bbox").to_pylist()[0] == {"xmin": 0.0, "ymin": 0.0, "xmax": 2.0, "ymax": 1.0}
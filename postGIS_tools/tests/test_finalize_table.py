@@ -0,0 +1,92 @@
+from postGIS_tools.queries.spatial_table import sql_to_finalize_spatial_table, primary_key_ranges, \
+    sql_to_rebuild_index, sql_to_swap_in_shadow_table, sql_to_make_geotable, sql_to_copy_reprojected_rows
+
+from ward import test
+
+
+@test("sql_to_finalize_spatial_table() replaces uid in one ALTER, indexes, and analyzes with SET LOCAL settings")
+def _():
+    sql = sql_to_finalize_spatial_table("parcels", maintenance_work_mem="2GB", parallel_workers=6)
+
+    assert "SET LOCAL maintenance_work_mem = '2GB'" in sql
+    assert "SET LOCAL max_parallel_maintenance_workers = 6" in sql
+    assert sql.count("ALTER TABLE") == 1
+    assert sql.index("CREATE INDEX gix_parcels") < sql.index("ANALYZE parcels")
+    assert "CLUSTER" not in sql
+
+
+@test("sql_to_finalize_spatial_table() clusters on the spatial index before analyzing, if asked")
+def _():
+    sql = sql_to_finalize_spatial_table("parcels", geom_colname="shape", cluster=True)
+
+    assert "USING GIST (shape)" in sql
+    assert sql.index("CLUSTER parcels USING gix_parcels") < sql.index("ANALYZE parcels")
+
+
+@test("primary_key_ranges() covers every key from low to high exactly once")
+def _():
+    ranges = primary_key_ranges(-3, 1000, 16)
+    keys = [key for start, stop in ranges for key in range(start, stop)]
+
+    assert len(ranges) == 16
+    assert keys == list(range(-3, 1001))
+    assert primary_key_ranges(5, 5, 8) == [(5, 6)]
+
+
+@test("sql_to_copy_reprojected_rows() projects the named geometry column and copies the rest as they are")
+def _():
+    sql = sql_to_copy_reprojected_rows("parcels", "pgis_reproject_1a2b", ["uid", "geom", "shape"], 2227, 4326,
+                                       key="uid", key_range=(0, 100), geom_col="shape")
+
+    assert 'SELECT "uid", "geom", ST_Transform(ST_SetSRID("shape", 2227), 4326)' in sql
+    assert 'WHERE "uid" >= 0 AND "uid" < 100' in sql
+
+
+@test("sql_to_rebuild_index() recreates indexes and constraints on the shadow table under a temporary name")
+def _():
+    index = sql_to_rebuild_index("public.parcels_reprojected", "tmp_1", None,
+                                 "CREATE UNIQUE INDEX ix_apn ON public.parcels USING btree (apn) WHERE (apn IS NOT NULL)")
+    constraint = sql_to_rebuild_index("parcels_reprojected", "tmp_0", "parcels_pkey", "PRIMARY KEY (uid)")
+
+    assert index == 'CREATE UNIQUE INDEX "tmp_1" ON public.parcels_reprojected USING btree (apn) WHERE (apn IS NOT NULL);'
+    assert constraint == 'ALTER TABLE parcels_reprojected ADD CONSTRAINT "tmp_0" PRIMARY KEY (uid);'
+
+
+@test("sql_to_swap_in_shadow_table() hands over sequences before dropping the original, then renames everything")
+def _():
+    sql = sql_to_swap_in_shadow_table("gis.parcels", "gis.parcels_reprojected",
+                                      [("gis.parcels_uid_seq", "uid", "a")],
+                                      [("tmp_0", "parcels_pkey", True), ("tmp_1", "gix_parcels", False)],
+                                      privileges=[("gis_admin", "qgis_readers", "SELECT", False),
+                                                  ("gis_admin", "editors", "UPDATE", True)])
+
+    assert sql.index("OWNED BY gis.parcels_reprojected") < sql.index("DROP TABLE gis.parcels;")
+    assert "ALTER TABLE gis.parcels_reprojected RENAME TO parcels;" in sql
+    assert 'RENAME CONSTRAINT "tmp_0" TO "parcels_pkey"' in sql
+    assert 'ALTER INDEX gis."tmp_1" RENAME TO "gix_parcels"' in sql
+    assert "GRANT SELECT ON gis.parcels TO qgis_readers;" in sql
+    assert "GRANT UPDATE ON gis.parcels TO editors WITH GRANT OPTION;" in sql
+    assert sql.index("GRANT UPDATE") < sql.index("ALTER TABLE gis.parcels OWNER TO gis_admin;")
+
+
+@test("sql_to_swap_in_shadow_table() still restores the owner when nothing has been granted")
+def _():
+    sql = sql_to_swap_in_shadow_table("parcels", "parcels_reprojected", [], [],
+                                      privileges=[("gis_admin", None, None, None)])
+
+    assert "GRANT" not in sql
+    assert sql.strip().endswith("ALTER TABLE parcels OWNER TO gis_admin;")
+
+
+@test("sql_to_make_geotable() types the geometry and numbers uid in the CREATE TABLE AS, replacing any old uid")
+def _():
+    sql = sql_to_make_geotable("local_roads", "SELECT * FROM roads WHERE highway = 'Local';",
+                               ["uid", "name", "geom"], geom_type="MULTILINESTRING", epsg=2227, unlogged=True)
+
+    assert "CREATE UNLOGGED TABLE local_roads AS" in sql
+    assert 'source."uid"' not in sql and 'source."name"' in sql
+    assert 'ST_SetSRID(source."geom", 2227)::geometry(MULTILINESTRING, 2227) AS "geom"' in sql
+    assert "row_number() OVER ()::integer AS uid" in sql
+    assert "WHERE highway = 'Local'\n" in sql
+    assert sql.count("ALTER COLUMN") == 1 and "TYPE" not in sql.split("AS source;")[1]
+    assert sql.index("USING GIST (geom)") < sql.index("ANALYZE local_roads")
@@ -0,0 +1,47 @@
+import geopandas as gpd
+import shapely
+
+from postGIS_tools import functions
+from postGIS_tools.functions import _prepare_geodataframe, geodataframe_to_postgis
+
+from ward import test
+
+
+def _parcels() -> gpd.GeoDataFrame:
+    """ A frame shaped like the ones query_geo_table() returns, with 'gid', 'uid' and 'geom' columns """
+    return gpd.GeoDataFrame({"GID": [0, 1],
+                             "uid": [10, 11],
+                             "Owner": ["a", "b"],
+                             "geom": [shapely.box(0, 0, 1, 1), shapely.box(1, 1, 2, 2)]},
+                            geometry="geom", crs="epsg:2227")
+
+
+@test("_prepare_geodataframe() renames 'geom' to 'geometry', drops 'gid' and keeps 'uid' as 'old_uid'")
+def _():
+    gdf = _parcels()
+
+    assert _prepare_geodataframe(gdf) == ("POLYGON", 2227)
+    assert sorted(gdf.columns) == ["geometry", "old_uid", "owner"]
+    assert gdf.geometry.name == "geometry"
+    assert list(gdf["old_uid"]) == [10, 11]
+
+
+@test("geodataframe_to_postgis() writes a frame with 'geom', 'gid' and 'uid' columns as a typed geom column")
+def _():
+    writes = []
+
+    write_dataframe, log_activity = functions.write_dataframe, functions.log_activity
+    functions.write_dataframe = lambda frame, table_name, uri, **kwargs: writes.append((frame, table_name, kwargs))
+    functions.log_activity = lambda *args, **kwargs: None
+
+    try:
+        geodataframe_to_postgis(_parcels(), "parcels", "postgresql://fake", prep_table=False)
+    finally:
+        functions.write_dataframe, functions.log_activity = write_dataframe, log_activity
+
+    frame, table_name, kwargs = writes[0]
+
+    assert table_name == "parcels"
+    assert sorted(frame.columns) == ["geom", "old_uid", "owner"]
+    assert kwargs["sql_types"]["geom"] == "geometry(POLYGON, 2227)"
+    assert frame["geom"][0] == shapely.to_wkb(shapely.set_srid(shapely.box(0, 0, 1, 1), 2227), include_srid=True)
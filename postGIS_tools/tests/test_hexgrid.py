@@ -0,0 +1,107 @@
+import numpy as np
+import geopandas as gpd
+import shapely
+
+from postGIS_tools.hexgrid import hexagon_dimensions, iterate_hexagon_chunks, hexagons_to_ewkb, plan_lattice_tiles, \
+    hexagon_cells, hexagon_cell_coordinates, bin_points_to_hexagons, sql_to_copy_point_coordinates
+from postGIS_tools.queries.hexagon_grid import sql_to_make_hex_grid
+
+from ward import test
+
+
+@test("hexagon_dimensions() rounds like hex_grid(), giving hexagons close to the requested area")
+def _():
+    q, h = hexagon_dimensions(1.0)
+
+    assert (q, h) == (310, 538)
+    assert abs(6 * q * h - 1000000) / 1000000 < 0.01
+
+
+@test("iterate_hexagon_chunks() lays out pairs of hexagons on the hex_grid() lattice, from the rounded extent")
+def _():
+    q, h = hexagon_dimensions(1.0)
+    chunks = list(iterate_hexagon_chunks((10.4, 20.6, 2000, 2000), 1.0, chunksize=4))
+    coordinates = np.concatenate(chunks)
+
+    # Columns at 10 and 10 + 6q, rows at 21 and 21 + 2h, two hexagons each
+    assert len(chunks) == 2
+    assert len(coordinates) == 2 * 2 * 2
+    assert tuple(coordinates[0, 0]) == (10, 21)
+    assert tuple(coordinates[1, 0]) == (10 + 3 * q, 21 + h)
+    assert tuple(coordinates[-2, 0]) == (10 + 6 * q, 21 + 2 * h)
+
+
+@test("hexagons_to_ewkb() makes valid polygons with the SRID embedded")
+def _():
+    coordinates = next(iterate_hexagon_chunks((0, 0, 0, 0), 1.0))
+    polygons = [shapely.from_wkb(row.tobytes()) for row in hexagons_to_ewkb(coordinates, 2227)]
+
+    assert len(polygons) == 2
+    assert all(polygon.is_valid and polygon.geom_type == "Polygon" for polygon in polygons)
+    assert shapely.get_srid(polygons[0]) == 2227
+    assert polygons[0].touches(polygons[1])
+
+
+@test("sql_to_make_hex_grid() reads the extent in one pass, and indexes and analyzes the grid")
+def _():
+    sql = sql_to_make_hex_grid("study_area", 2227, "hexagons", 0.5)
+    clipped = sql_to_make_hex_grid("study_area", 2227, "hexagons", 0.5, clip=True)
+
+    assert sql.count("FROM study_area") == 1
+    assert "USING GIST (geom)" in sql and "ANALYZE hexagons" in sql
+    assert "ST_Intersects" in clipped and "ST_Intersects" not in sql
+
+
+@test("plan_lattice_tiles() splits the grid into tiles that fit together with no gaps or duplicates")
+def _():
+    extent = (1000.3, 2000.7, 90000, 50000)
+    whole_grid = np.concatenate(list(iterate_hexagon_chunks(extent, 1.0)))[:, 0]
+
+    tiles = plan_lattice_tiles(extent, 1.0, 16)
+    tiled = np.concatenate([np.concatenate(list(iterate_hexagon_chunks(tile, 1.0))) for tile in tiles])[:, 0]
+
+    assert len(tiles) == 16
+    assert len(tiled) == len(whole_grid)
+    assert set(map(tuple, tiled)) == set(map(tuple, whole_grid))
+
+
+@test("hexagon_cells() puts every point in a hexagon that contains it, on the same lattice as the grid")
+def _():
+    origin = (1234, -567)
+    rng = np.random.default_rng(0)
+    x, y = rng.uniform(2000, 20000, 20000), rng.uniform(0, 20000, 20000)
+
+    columns, rows = hexagon_cells(x, y, 0.37, origin=origin)
+    coordinates = hexagon_cell_coordinates(columns, rows, 0.37, origin=origin)
+
+    assert shapely.intersects_xy(shapely.polygons(coordinates), x, y).all()
+
+    grid = np.concatenate(list(iterate_hexagon_chunks((1234, -567, 25000, 25000), 0.37)))[:, 0]
+    assert set(map(tuple, coordinates[:, 0])) <= set(map(tuple, grid))
+
+
+@test("bin_points_to_hexagons() counts and sums the points of a GeoDataFrame per hexagon")
+def _():
+    rng = np.random.default_rng(1)
+    gdf = gpd.GeoDataFrame({"speed": rng.uniform(0, 60, 5000)},
+                           geometry=gpd.points_from_xy(rng.uniform(0, 10000, 5000), rng.uniform(0, 10000, 5000)),
+                           crs="epsg:2227")
+
+    bins = bin_points_to_hexagons(gdf, 2227, 1.0, value_columns=["speed"])
+
+    assert list(bins.columns) == ["hex_id", "hex_column", "hex_row", "count", "sum_speed"]
+    assert bins["hex_id"].is_unique and bins["hex_id"].is_monotonic_increasing
+    assert bins["count"].sum() == 5000
+    assert np.isclose(bins["sum_speed"].sum(), gdf["speed"].sum())
+
+
+@test("sql_to_copy_point_coordinates() gives the projected point a name that can't clash with the query's geom")
+def _():
+    sql = sql_to_copy_point_coordinates("SELECT geom, speed FROM gps_pings;", 2272, value_columns=["speed"])
+
+    assert "ST_Transform(source.\"geom\", 2272) AS _pgis_point, source.*" in sql
+    assert "ST_X(points._pgis_point)" in sql and "ST_Y(points._pgis_point)" in sql
+    assert "points.geom" not in sql and " AS geom" not in sql
+    assert 'COALESCE(points."speed"::DOUBLE PRECISION, 0)' in sql
+    assert "FROM (SELECT geom, speed FROM gps_pings) AS source" in sql
+    assert sql.strip().endswith("TO STDOUT WITH (FORMAT binary)")
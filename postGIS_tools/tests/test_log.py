@@ -1,4 +1,4 @@
-from postGIS_tools.logs import log_activity
+from postGIS_tools.logs import log_activity, set_log_mode
 from ward import test
 
 
@@ -8,6 +8,8 @@ def _():
     Confirm that you can create/update the log table for a given URI
     """
     try:
+        set_log_mode("sync")
+
         uri = "postgresql://postgres@localhost:5432/test_from_qgis"
 
         log_activity("postGIS_tools test run", uri=uri,
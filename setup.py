@@ -17,6 +17,17 @@ with open('requirements.txt') as f:
     requirements_lines = f.readlines()
 install_requires = [r.strip() for r in requirements_lines]
 
+# Optional dependencies:
+#   parquet: GeoParquet import/export
+#   export:  fast file exports through GDAL with pyogrio
+#   aio:     the asyncio API in postGIS_tools.aio
+extras_require = {
+    "parquet": ["pyarrow"],
+    "export": ["pyogrio", "pyarrow"],
+    "aio": ["asyncpg"],
+}
+extras_require["all"] = sorted({package for packages in extras_require.values() for package in packages})
+
 pkgs = find_packages()
 
 setup(
@@ -29,4 +40,5 @@ setup(
     url='https://github.com/aaronfraint/postGIS-tools.git',
     packages=pkgs,
     install_requires=install_requires,
+    extras_require=extras_require,
 )